@@ -0,0 +1,473 @@
+# --------------------------------------------------------------------------
+# The module computes the aggregate values between consecutive profiling
+# samples, the values aggregate.sh computes with one jq and bc process per
+# metric. A run is loaded once, every numeric metric becomes a column and
+# the operators of aggregate.cfg (delta, max, min, sum, avg, last) are applied to
+# all pairs of samples at once with numpy. Numbers are printed the way jq
+# 1.6 prints them and computed the way bc computes them, so the delta files
+# are the same bytes aggregate.sh writes.
+#
+# Usage: python3 aggregate.py INPUT_DIR OUTPUT_DIR [AGGREGATE_CONFIG]
+#        python3 aggregate.py benchmark INPUT_DIR [AGGREGATE_CONFIG] [PAIRS]
+#        (times aggregate.sh on the first PAIRS pairs against the engine)
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+import numpy as np
+import binlog
+import breakdown
+
+DELTA='delta'
+MAX='max'
+MIN='min'
+SUM='sum'
+AVG='avg'
+# the value of the later sample, for the gauges such as Sample_Interval
+LAST='last'
+OPERATORS=[DELTA, MAX, MIN, SUM, AVG, LAST]
+
+AGGREGATE_CONFIG='aggregate.cfg'
+AGGREGATE_SCRIPT=os.path.join(os.path.dirname(os.path.abspath(__file__)), "aggregate.sh")
+PROFILING_FILE_PATTERN='????_??_??_??_??_??.json'
+RUN_FILE_PATTERN='????_??_??_??_??_??.ndjson'
+# a binary run goes on in <run>_1.bin, <run>_2.bin, ... when its schema changes
+BINARY_RUN_FILE_PATTERN='????_??_??_??_??_??*.bin'
+VERSION_FIELD='"Version": 1.0'
+
+# bc prints no leading zero, .5 and -.5, which python does not parse as JSON
+BC_FRACTION=re.compile(r'(?<!\\)(": -?)\.(?=[0-9])')
+
+BC_SCALE=20        # scale of bc -l, used by the avg division
+BC_LINE_LENGTH=70  # bc breaks longer numbers with a backslash
+INT64_DIGITS=18    # columns of larger scaled values are computed with python integers
+
+RATE_SUFFIX='PerSecond'
+UTILIZATION_SUFFIX='Utilization'
+NANOSECONDS=10**9
+# the counters without a t* timestamp, their rates are taken over the currentTime interval
+RATE_METRICS=[
+    "vDiskSectorReads", "vDiskSectorWrites", "vDiskSuccessfulReads", "vDiskSuccessfulWrites",
+    "vDiskMergedReads", "vDiskMergedWrites", "vDiskReadTime", "vDiskWriteTime",
+    "vNetworkBytesRecvd", "vNetworkBytesSent", "vPgFault", "vMajorPageFault",
+    "cDiskSectorIO", "cDiskReadBytes", "cDiskWriteBytes", "cNetworkBytesRecvd", "cNetworkBytesSent",
+    "cPGFault", "cMajorPGFault",
+]
+# the CPU times and their units per second: centiseconds, or nanoseconds for the cgroup usage
+CPU_TIME_UNITS={
+    "vCpuTime": 100,
+    "vCpuTimeUserMode": 100,
+    "vCpuTimeKernelMode": 100,
+    "vCpuIdleTime": 100,
+    "vCpuTimeIOWait": 100,
+    "vCpuTimeIntSrvc": 100,
+    "vCpuTimeSoftIntSrvc": 100,
+    "vCpuNice": 100,
+    "vCpuSteal": 100,
+    "cCpuTime": NANOSECONDS,
+    "cCpuTimeUserMode": 100,
+    "cCpuTimeKernelMode": 100,
+}
+# the nanoseconds of a single CPU, cCpu$0TIME, cCpu$1TIME, ...
+PER_CPU_TIME=re.compile(r'^cCpu[$_]?[0-9]+TIME$')
+
+def jq_number(value):
+    """jq_number(value)
+
+    The method returns a number the way jq 1.6 prints it, that is the
+    shortest digits of the double written in positional notation unless
+    the exponent is below -4 or more than 15 digits beyond them
+    """
+    value = float(value)
+    if value != value:
+        return "null"
+    value = max(-sys.float_info.max, min(sys.float_info.max, value))
+    text = repr(value)
+    if 'e' not in text:
+        # python and jq switch to the exponent at the same small values
+        return text[:-2] if text.endswith(".0") else text
+    mantissa, exponent = text.split('e')
+    sign = "-" if mantissa.startswith("-") else ""
+    digits = mantissa.lstrip("-").replace(".", "")
+    point = int(exponent) + 1
+    if point <= -4 or point > len(digits) + 15:
+        fraction = "." + digits[1:] if len(digits) > 1 else ""
+        return "{}{}{}e{}{:02d}".format(sign, digits[0], fraction, "-" if point < 1 else "+", abs(point - 1))
+    if point <= 0:
+        return "{}0.{}{}".format(sign, "0" * -point, digits)
+    if point >= len(digits):
+        return sign + digits + "0" * (point - len(digits))
+    return sign + digits[:point] + "." + digits[point:]
+
+def jq_string(value):
+    """jq_string(value)
+
+    The method returns a string the way jq 1.6 prints it
+    """
+    return json.dumps(value, ensure_ascii=False).replace("\x7f", "\\u007f")
+
+def bc_operand(literal):
+    """bc_operand(literal)
+
+    The method returns the pair (unscaled integer, scale) bc reads from a
+    number printed by jq. A missing value is the bc variable null, that is
+    zero. bc rejects the exponent notation, such numbers are expanded
+    """
+    if literal == "null":
+        return 0, 0
+    if 'e' in literal:
+        literal = format(Decimal(literal), 'f')
+    negative = literal.startswith("-")
+    integer, _, fraction = literal.lstrip("-").partition(".")
+    unscaled = int(integer + fraction)
+    return (-unscaled if negative else unscaled), len(fraction)
+
+def bc_number(unscaled, scale):
+    """bc_number(unscaled, scale)
+
+    The method prints the number unscaled / 10^scale the way bc prints it:
+    zero is "0", there is no leading zero before the point, all the digits
+    of the scale are kept and long numbers are broken with a backslash
+    """
+    unscaled = int(unscaled)
+    if unscaled == 0:
+        return "0"
+    digits = str(abs(unscaled)).rjust(scale + 1, "0")
+    integer = digits[:len(digits) - scale].lstrip("0")
+    text = ("-" if unscaled < 0 else "") + integer
+    if scale > 0:
+        text += "." + digits[len(digits) - scale:]
+    width = BC_LINE_LENGTH - 2
+    return "\\\n".join(text[index:index + width] for index in range(0, len(text), width))
+
+def parse_delta(text):
+    """parse_delta(text)
+
+    The method parses the text of a delta file written by aggregate.sh or
+    by this module
+    """
+    return json.loads(BC_FRACTION.sub(r'\g<1>0.', text.replace("\\\n", "")))
+
+def compute_rates(delta, processors=None):
+    """compute_rates(delta, [processors])
+
+    The method returns the per-second rates of the counters of a delta
+    record, over the interval of their own t* timestamp when they have one
+    and of currentTime otherwise, and the utilization of the CPU times in
+    percent of the processors (of one CPU for the per-CPU times)
+    """
+    rates = {}
+    interval = delta.get("currentTime")
+    interval = interval / NANOSECONDS if is_number(interval) and interval > 0 else None
+    for key, value in delta.items():
+        if not is_number(value):
+            continue
+        elapsed = delta.get("t" + key)
+        if not (is_number(elapsed) and elapsed > 0):
+            if key not in RATE_METRICS or interval is None:
+                continue
+            elapsed = interval
+        rate = value / elapsed
+        rates[key + RATE_SUFFIX] = rate
+        unit, cpus = CPU_TIME_UNITS.get(key), processors
+        if unit is None and PER_CPU_TIME.match(key):
+            unit, cpus = NANOSECONDS, 1
+        if unit is not None and is_number(cpus) and cpus > 0:
+            rates[key + UTILIZATION_SUFFIX] = rate / unit / cpus * 100
+    return rates
+
+def read_config(config_path=AGGREGATE_CONFIG):
+    """read_config([config_path])
+
+    The method returns the lines of the aggregate configuration file, none
+    when the file does not exist and every metric falls back to delta
+    """
+    try:
+        with open(config_path, 'r') as infile:
+            return infile.read().splitlines()
+    except (OSError, TypeError):
+        return []
+
+def lookup_operator(config_lines, path):
+    """lookup_operator(config_lines, path)
+
+    The method returns the operator of a metric path such as .vLoadAvg.
+    Like the grep of aggregate.sh the path is matched as a regular
+    expression anywhere in a line, so a path matching several lines, or
+    a line with an unknown operator, falls back to delta
+    """
+    pattern = re.compile(re.escape(path).replace("\\.", "."))
+    matches = [line.split(":")[1] if ":" in line else line for line in config_lines if pattern.search(line)]
+    operator = "\n".join(matches).rstrip("\n")
+    if operator in OPERATORS:
+        return operator
+    return DELTA
+
+def flatten(record, path=""):
+    """flatten(record, [path])
+
+    The method returns the (path, key, value) entries of a sample in the
+    order aggregate.sh visits them: keys sorted, objects inlined and
+    arrays (the process list) left out
+    """
+    entries = []
+    for key in sorted(record):
+        value = record[key]
+        key_path = path + "." + key
+        if isinstance(value, dict):
+            entries.extend(flatten(value, key_path))
+        elif not isinstance(value, list):
+            entries.append((key_path, key, value))
+    return entries
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def scale_to(unscaled, digits):
+    """scale_to(unscaled, digits)
+
+    The method multiplies a column by 10^digits, with python integers once
+    the values may not fit in 64 bits anymore
+    """
+    if digits == 0:
+        return unscaled
+    if unscaled.dtype != object and (digits > INT64_DIGITS or np.abs(unscaled).max(initial=0) >= 10**(INT64_DIGITS - digits)):
+        unscaled = unscaled.astype(object)
+    return unscaled * 10**digits
+
+def powers_of_ten(exponents, dtype):
+    if dtype == object:
+        return np.array([10**exponent for exponent in exponents.tolist()], dtype=object)
+    return 10 ** exponents
+
+def truncate_divide(dividend, divisor):
+    # bc truncates toward zero
+    quotient = np.abs(dividend) // divisor
+    return np.where(dividend < 0, -quotient, quotient)
+
+def aggregate_column(literals, operator):
+    """aggregate_column(literals, operator)
+
+    The method applies an operator to all consecutive pairs of one metric
+    and returns the printed results, the i-th result aggregates the
+    samples i and i+1
+    """
+    operands = [bc_operand(literal) for literal in literals]
+    scales = np.array([scale for _unscaled, scale in operands], dtype=np.int64)
+    column_scale = int(scales.max(initial=0))
+    # one scale for the whole column so the pairs compute with plain integers
+    scaled = [value * 10**(column_scale - scale) for value, scale in operands]
+    dtype = object
+    if column_scale <= INT64_DIGITS and all(abs(value) < 10**INT64_DIGITS for value in scaled):
+        dtype = np.int64
+    unscaled = np.array(scaled, dtype=dtype)
+    first, second = unscaled[:-1], unscaled[1:]
+
+    if operator == LAST:
+        return literals[1:]
+    if operator == MAX or operator == MIN:
+        keep_first = first > second if operator == MAX else first < second
+        return [literals[index] if keep else literals[index + 1] for index, keep in enumerate(keep_first)]
+    if operator == AVG:
+        total = first + second
+        if column_scale <= BC_SCALE:
+            results = truncate_divide(scale_to(total, BC_SCALE - column_scale), 2)
+        else:
+            results = truncate_divide(total, 2 * 10**(column_scale - BC_SCALE))
+        return [bc_number(result, BC_SCALE) for result in results]
+
+    if operator == SUM:
+        results = first + second
+    else:
+        results = second - first
+    # bc keeps the larger scale of the two operands
+    pair_scales = np.maximum(scales[:-1], scales[1:])
+    results = results // powers_of_ten(column_scale - pair_scales, results.dtype)
+    return [bc_number(result, scale) for result, scale in zip(results, pair_scales.tolist())]
+
+def aggregate_records(records, config_lines):
+    """aggregate_records(records, config_lines)
+
+    The method returns the delta text of every pair of consecutive
+    samples, as printed by aggregate.sh. The per-CPU, per-disk and
+    per-interface breakdowns, which aggregate.sh leaves out, follow as
+    compact vectors of deltas
+    """
+    flattened = [flatten(record) for record in records]
+    values = [dict((path, value) for path, _key, value in entries) for entries in flattened]
+
+    # the columns of the metrics that are a number in a first sample of a pair
+    paths = {}
+    for entries in flattened[:-1]:
+        for path, _key, value in entries:
+            if is_number(value):
+                paths[path] = True
+    columns = {}
+    for path in paths:
+        literals = []
+        for sample in values:
+            value = sample.get(path)
+            literals.append(jq_number(value) if is_number(value) else "null")
+        columns[path] = aggregate_column(literals, lookup_operator(config_lines, path))
+
+    deltas = []
+    for index, entries in enumerate(flattened[:-1]):
+        fields = []
+        for path, key, value in entries:
+            if isinstance(value, bool):
+                text = "true" if value else "false"
+            elif value is None:
+                text = "null"
+            elif isinstance(value, str):
+                text = jq_string(value)
+            else:
+                text = columns[path][index]
+            fields.append('"{}": {},'.format(key, text))
+        for key in sorted(records[index]):
+            if breakdown.is_breakdown(records[index][key]) and breakdown.is_breakdown(records[index + 1].get(key)):
+                vectors = breakdown.diff(records[index][key], records[index + 1][key])
+                if vectors is not None:
+                    fields.append('"{}": {},'.format(key, json.dumps(vectors, separators=(',', ':'))))
+        deltas.append("{" + "".join(fields) + VERSION_FIELD + "}")
+    return deltas
+
+def parse_sample(text):
+    # aggregate.sh replaces every dollar sign before reading the samples
+    return json.loads(text.replace("$", "_"))
+
+def load_samples(paths):
+    """load_samples(paths)
+
+    The method reads the sample files, a file that cannot be parsed is
+    reported and left out
+    """
+    samples = []
+    for path in paths:
+        try:
+            with open(path, 'r') as infile:
+                samples.append((path, parse_sample(infile.read())))
+        except (OSError, ValueError) as error:
+            print("skipping {}: {}".format(path, error), file=sys.stderr)
+    return samples
+
+def replace_dollar(value):
+    if isinstance(value, dict):
+        return dict((key.replace("$", "_"), replace_dollar(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [replace_dollar(item) for item in value]
+    if isinstance(value, str):
+        return value.replace("$", "_")
+    return value
+
+def load_run(path):
+    """load_run(path)
+
+    The method reads the records of an ndjson or binary run file, a
+    truncated last line or record is left out
+    """
+    if path.endswith(binlog.EXTENSION):
+        return [replace_dollar(record) for record in binlog.RunReader(path).records()]
+    records = []
+    with open(path, 'r') as infile:
+        for line in infile:
+            try:
+                records.append(parse_sample(line))
+            except ValueError:
+                pass
+    return records
+
+def find_profiling_files(input_dir):
+    return sorted(glob.glob(os.path.join(input_dir, PROFILING_FILE_PATTERN)))
+
+def find_run_files(input_dir):
+    paths = sorted(glob.glob(os.path.join(input_dir, RUN_FILE_PATTERN)))
+    return paths + sorted(glob.glob(os.path.join(input_dir, BINARY_RUN_FILE_PATTERN)))
+
+def aggregate_directory(input_dir, output_dir, config_path=AGGREGATE_CONFIG):
+    """aggregate_directory(input_dir, output_dir, [config_path])
+
+    The method writes delta_<second sample>.json for every pair of
+    consecutive sample files and delta_<run>.ndjson, one delta per line,
+    for every ndjson or binary run file. It returns the number of deltas
+    written
+    """
+    config_lines = read_config(config_path)
+    count = 0
+
+    samples = load_samples(find_profiling_files(input_dir))
+    deltas = aggregate_records([record for _path, record in samples], config_lines)
+    for (path, _record), delta in zip(samples[1:], deltas):
+        with open(os.path.join(output_dir, "delta_" + os.path.basename(path)), 'w') as outfile:
+            outfile.write(delta)
+    count += len(deltas)
+
+    for path in find_run_files(input_dir):
+        deltas = aggregate_records(load_run(path), config_lines)
+        name = os.path.splitext(os.path.basename(path))[0] + ".ndjson"
+        with open(os.path.join(output_dir, "delta_" + name), 'w') as outfile:
+            for delta in deltas:
+                outfile.write(delta + "\n")
+        count += len(deltas)
+    return count
+
+def benchmark(input_dir, config_path=AGGREGATE_CONFIG, pairs=10):
+    """benchmark(input_dir, [config_path], [pairs])
+
+    The method times the engine on all the sample files of a directory and
+    aggregate.sh on the first pairs, and compares their outputs
+    """
+    paths = find_profiling_files(input_dir)
+    if len(paths) < 2:
+        raise ValueError("{} needs at least two sample files".format(input_dir))
+    config_path = os.path.abspath(config_path)
+    report = {"pairs": len(paths) - 1}
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        aggregate_directory(input_dir, output_dir, config_path)
+        report["engine_seconds"] = time.perf_counter() - start
+
+        if shutil.which("jq") is None or shutil.which("bc") is None:
+            report["shell"] = "skipped, aggregate.sh needs jq and bc"
+            return report
+        pairs = min(pairs, len(paths) - 1)
+        identical = 0
+        start = time.perf_counter()
+        for index in range(1, pairs + 1):
+            # aggregate.sh writes its temporary files to the working directory
+            output = subprocess.run(["bash", AGGREGATE_SCRIPT, paths[index - 1], paths[index], config_path],
+                                    cwd=output_dir, stdout=subprocess.PIPE, check=True).stdout
+            with open(os.path.join(output_dir, "delta_" + os.path.basename(paths[index])), 'rb') as infile:
+                identical += infile.read() == output
+        shell_seconds = (time.perf_counter() - start) / pairs * (len(paths) - 1)
+
+    report["shell_pairs_timed"] = pairs
+    report["shell_seconds_estimated"] = shell_seconds
+    report["speedup"] = shell_seconds / report["engine_seconds"]
+    report["identical_outputs"] = "{}/{}".format(identical, pairs)
+    return report
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == "benchmark":
+        config_path = sys.argv[3] if len(sys.argv) > 3 else AGGREGATE_CONFIG
+        pairs = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+        print(json.dumps(benchmark(sys.argv[2], config_path, pairs), indent=4))
+    elif len(sys.argv) in [3, 4]:
+        config_path = sys.argv[3] if len(sys.argv) > 3 else AGGREGATE_CONFIG
+        count = aggregate_directory(sys.argv[1], sys.argv[2], config_path)
+        print("wrote {} aggregate values to {}".format(count, sys.argv[2]))
+    else:
+        print("Usage: {} INPUT_DIR OUTPUT_DIR [AGGREGATE_CONFIG]".format(sys.argv[0]))
+        print("       {} benchmark INPUT_DIR [AGGREGATE_CONFIG] [PAIRS]".format(sys.argv[0]))
+        sys.exit(1)
@@ -11,6 +11,7 @@
 #     2021/11/08 : varikmp - implemented different aggregate operators
 #                            beside the existing one (delta)
 #     2025/10/16 : varikmp - swap the order of two time steps
+#     2026/10/18 : wlloyd  - implemented the last operator for the gauges
 #======================================================================
 #  OPTION
 #    PROFILING_FILE_1 # specify the first  profiling file in JSON format
@@ -107,6 +108,10 @@ function print_aggregations
                             AGG_RS=$(bc -l <<< "($VALUE_1 + $VALUE_2) / 2")
                             ;;
 
+                        "last")
+                            AGG_RS=$VALUE_2
+                            ;;
+
                         *) # delta
                             AGG_RS=$(bc -l <<< "$VALUE_2 - $VALUE_1")
                             ;;
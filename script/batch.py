@@ -0,0 +1,220 @@
+# --------------------------------------------------------------------------
+# The module aggregates many profiling runs at once. Every directory below
+# the root holding profiling files is a run, the runs are aggregated (the
+# delta and csv tools of profiler.sh) by a pool of worker processes sized
+# to the available cores, and one summary row per run is merged into a
+# single table tagged with the static.json fields of the run.
+#
+# A manifest next to the summary keeps the fingerprint of the inputs of
+# every run, a run whose profiling files, static.json and aggregate
+# configuration did not change since the last batch is skipped and its
+# previous summary row is reused.
+#
+# Usage: python3 batch.py ROOT_DIR [-o summary.csv] [-a aggregate.cfg] [-j WORKERS] [--force]
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import numpy as np
+import aggregate
+import export
+
+MANIFEST_FILE='batch_manifest.json'
+SUMMARY_FILE='summary.csv'
+RUN_KEY='run'
+SAMPLES_KEY='samples'
+DURATION_KEY='duration'
+
+def find_runs(root_dir):
+    """find_runs(root_dir)
+
+    The method returns the directories below the root holding profiling
+    files, sorted by path
+    """
+    runs = []
+    for directory, _subdirs, _files in os.walk(root_dir):
+        if get_input_files(directory):
+            runs.append(directory)
+    return sorted(runs)
+
+def get_input_files(run_dir):
+    paths = glob.glob(os.path.join(run_dir, aggregate.PROFILING_FILE_PATTERN))
+    paths += aggregate.find_run_files(run_dir)
+    return sorted(paths)
+
+def get_fingerprint(run_dir, config_lines):
+    """get_fingerprint(run_dir, config_lines)
+
+    The method returns a digest of the names, sizes and modification times
+    of the inputs of a run and of the aggregate configuration
+    """
+    digest = hashlib.sha1("\n".join(config_lines).encode("utf-8"))
+    for path in get_input_files(run_dir) + [os.path.join(run_dir, "static.json")]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        digest.update("{} {} {}\n".format(os.path.basename(path), stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+    return digest.hexdigest()
+
+def read_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(manifest_path, manifest):
+    # replace the manifest at once so an interrupted batch keeps the previous one
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w') as outfile:
+        json.dump(manifest, outfile, indent=4)
+    os.replace(temp_path, manifest_path)
+
+def summarize_records(records, config_lines):
+    """summarize_records(records, config_lines)
+
+    The method reduces the samples of a run to one row with the operators
+    of aggregate.cfg: the last minus the first value for delta, and the
+    maximum, minimum, mean or total over all samples otherwise
+    """
+    columns = {}
+    for index, record in enumerate(records):
+        for path, key, value in aggregate.flatten(record):
+            if aggregate.is_number(value):
+                if path not in columns:
+                    columns[path] = (key, np.full(len(records), np.nan))
+                columns[path][1][index] = value
+
+    summary = {SAMPLES_KEY: len(records)}
+    times = columns.get(".currentTime")
+    if times is not None and len(records) > 1:
+        summary[DURATION_KEY] = (times[1][-1] - times[1][0]) / 10**9
+    for path, (key, values) in columns.items():
+        present = values[~np.isnan(values)]
+        if len(present) == 0:
+            continue
+        operator = aggregate.lookup_operator(config_lines, path)
+        if operator == aggregate.MAX:
+            summary[key] = float(present.max())
+        elif operator == aggregate.MIN:
+            summary[key] = float(present.min())
+        elif operator == aggregate.AVG:
+            summary[key] = float(present.mean())
+        elif operator == aggregate.SUM:
+            summary[key] = float(present.sum())
+        elif operator == aggregate.LAST:
+            summary[key] = float(present[-1])
+        else:
+            summary[key] = float(present[-1] - present[0])
+    return summary
+
+def process_run(task):
+    """process_run(task)
+
+    The method aggregates one run in a worker process: the delta files,
+    delta.csv and process.csv of the run, and its summary row tagged with
+    the static fields. It returns the run and its row, or its error
+    """
+    run_dir, config_path, export_formats = task
+    try:
+        config_lines = aggregate.read_config(config_path)
+        # a run of a single sample has no delta to export, it still gets a summary row
+        if aggregate.aggregate_directory(run_dir, run_dir, config_path) > 0:
+            export.export_directory(run_dir, os.path.join(run_dir, "delta.csv"), os.path.join(run_dir, "process.csv"), export_formats)
+
+        records = [record for _path, record in aggregate.load_samples(glob.glob(os.path.join(run_dir, aggregate.PROFILING_FILE_PATTERN)))]
+        for path in aggregate.find_run_files(run_dir):
+            records += aggregate.load_run(path)
+        records.sort(key=lambda record: record.get("currentTime", 0))
+        static_fields, static_values = export.read_static(run_dir)
+        row = dict(zip(static_fields, static_values))
+        row.update(summarize_records(records, config_lines))
+        return run_dir, row, None
+    except (OSError, ValueError) as error:
+        return run_dir, None, str(error)
+
+def get_worker_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def run_batch(root_dir, summary_file=SUMMARY_FILE, config_path=aggregate.AGGREGATE_CONFIG, workers=None, force=False, export_formats=[export.CSV]):
+    """run_batch(root_dir, [summary_file], [config_path], [workers], [force], [export_formats])
+
+    The method aggregates the changed runs below the root in parallel,
+    records every finished run in the manifest and writes the merged
+    summary. It returns the number of runs aggregated, skipped and failed
+    """
+    config_lines = aggregate.read_config(config_path)
+    manifest_path = os.path.join(os.path.dirname(os.path.abspath(summary_file)), MANIFEST_FILE)
+    manifest = {} if force else read_manifest(manifest_path)
+
+    runs = dict((os.path.relpath(run_dir, root_dir), run_dir) for run_dir in find_runs(root_dir))
+    fingerprints = dict((run, get_fingerprint(run_dir, config_lines)) for run, run_dir in runs.items())
+    tasks = [(run_dir, config_path, export_formats) for run, run_dir in runs.items()
+             if manifest.get(run, {}).get("fingerprint") != fingerprints[run]]
+    skipped = len(runs) - len(tasks)
+
+    failed = 0
+    if tasks:
+        with multiprocessing.Pool(min(workers or get_worker_count(), len(tasks))) as pool:
+            for run_dir, row, error in pool.imap_unordered(process_run, tasks):
+                run = os.path.relpath(run_dir, root_dir)
+                if error is not None:
+                    print("failed to aggregate {}: {}".format(run, error), file=sys.stderr)
+                    manifest.pop(run, None)
+                    failed += 1
+                    continue
+                manifest[run] = {"fingerprint": fingerprints[run], "summary": row}
+                write_manifest(manifest_path, manifest)
+
+    # the runs removed from the root leave the manifest
+    for run in list(manifest):
+        if run not in runs:
+            del manifest[run]
+    write_manifest(manifest_path, manifest)
+    write_summary(summary_file, [(run, manifest[run]["summary"]) for run in sorted(runs) if run in manifest])
+    return len(tasks) - failed, skipped, failed
+
+def write_summary(summary_file, rows):
+    """write_summary(summary_file, rows)
+
+    The method writes one line per run, the columns are the union of the
+    fields of all runs in the order they first appear
+    """
+    fields = [RUN_KEY]
+    for _run, row in rows:
+        for field in row:
+            if field not in fields:
+                fields.append(field)
+    with open(summary_file, 'w', buffering=export.BUFFER_SIZE) as outfile:
+        outfile.write(",".join(fields) + "\n")
+        for run, row in rows:
+            row = dict(row)
+            row[RUN_KEY] = run
+            outfile.write(",".join(export.csv_value(row.get(field)) for field in fields) + "\n")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='aggregate all the profiling runs below a directory.')
+    parser.add_argument('root_dir', action='store', help='directory searched for the runs, every directory holding profiling files is a run')
+    parser.add_argument("-o", "--summary-file", action="store", default=SUMMARY_FILE, help='CSV file of the merged summary, the manifest is kept next to it (default is summary.csv)')
+    parser.add_argument("-a", "--aggregate-config-file", action="store", default=aggregate.AGGREGATE_CONFIG, help='aggregate configuration file (default is aggregate.cfg)')
+    parser.add_argument("-j", "--workers", type=int, action="store", help='number of worker processes (default is the number of available cores)')
+    parser.add_argument("-f", "--export-formats", action="store", default=export.CSV, help='comma separated export formats of every run among {} (default is csv)'.format(", ".join(export.EXPORT_FORMATS)))
+    parser.add_argument("--force", action="store_true", default=False, help='aggregate all the runs even when their inputs did not change')
+    args = parser.parse_args()
+
+    aggregated, skipped, failed = run_batch(args.root_dir, args.summary_file, args.aggregate_config_file, args.workers, args.force, args.export_formats.split(","))
+    print("aggregated {} runs, skipped {} unchanged runs, {} failed".format(aggregated, skipped, failed))
+    if failed:
+        sys.exit(1)
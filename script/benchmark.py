@@ -0,0 +1,312 @@
+# --------------------------------------------------------------------------
+# The tool benchmarks the profiler offline. The collector benchmark replays
+# a synthetic host of fakeroot.py with a given number of processes through
+# the collectors of rudataall.py (rudataall.py --replay) and times every
+# level of its samples (VM, container, process for the all and tree scopes,
+# breakdown) from the write and CPU times the samples record. The pipeline
+# benchmark generates a run of synthetic samples and times every stage of
+# profiler.sh after the sampler: writing the ndjson run, the delta tool,
+# the csv tool (delta and process tables) and the graph tool.
+#
+# The results are written to a JSON file tagged with the commit, a later
+# run compared to it reports the timings that got slower than a threshold
+# and exits with status 1 when there is one.
+#
+# Usage: python3 benchmark.py [-o benchmark.json] [-p 100,1000,10000] [-r 50]
+#                             [-n 1000] [-g v2] [-C BASELINE.json]
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import aggregate
+import breakdown
+import cgroup
+import export
+import fakeroot
+import graph
+import samplelog
+
+VERSION=1
+REPETITIONS=50
+PID_COUNTS=[100, 1000, 10000]
+SAMPLES=1000
+PROCESSES_PER_SAMPLE=20
+INTERVAL_NS=100*10**6
+THRESHOLD=10.0      # percent slower reported as a regression
+
+SCRIPT_DIR=os.path.dirname(os.path.abspath(__file__))
+SAMPLER=os.path.join(SCRIPT_DIR, "rudataall.py")
+NANOSECONDS=10**9
+
+# the sampler options of every replay of a synthetic host, and the timing
+# name and sample level of the collectors it times
+REPLAYS=[
+    (["-v", "-c", "-p", "--breakdown", ",".join(breakdown.DIMENSIONS)],
+     [("vm", "VM"), ("container", "Container"), ("process", "Process"), ("breakdown", "Breakdown")]),
+    (["-p", "--process-scope", "tree", "--root-pid", "1"], [("process_tree", "Process")]),
+]
+AGGREGATE_CONFIG=os.path.join(SCRIPT_DIR, "..", "cfg", "aggregate.cfg")
+GRAPH_CONFIG=os.path.join(SCRIPT_DIR, "..", "cfg", "graph.default.cfg")
+
+# the counters of a synthetic sample and their growth per sample
+VM_COUNTERS={
+    "vCpuTime": 18, "vCpuTimeUserMode": 12, "vCpuTimeKernelMode": 6, "vCpuIdleTime": 80,
+    "vCpuTimeIOWait": 1, "vCpuTimeIntSrvc": 0, "vCpuTimeSoftIntSrvc": 1, "vCpuNice": 0, "vCpuSteal": 0,
+    "vCpuContextSwitches": 90000, "vDiskSectorReads": 64, "vDiskSectorWrites": 256,
+    "vDiskSuccessfulReads": 4, "vDiskSuccessfulWrites": 16, "vDiskMergedReads": 1, "vDiskMergedWrites": 3,
+    "vDiskReadTime": 2, "vDiskWriteTime": 9, "vNetworkBytesRecvd": 150000, "vNetworkBytesSent": 90000,
+    "vPgFault": 2500, "vMajorPageFault": 0,
+}
+VM_LEVELS={"vMemoryTotal": 16384000, "vMemoryFree": 8192000, "vMemoryBuffers": 256000, "vMemoryCached": 2048000, "vCpuMhz": 2100.0, "vLoadAvg": 0.5}
+CONTAINER_COUNTERS={
+    "cCpuTime": 180000000, "cCpuTimeUserMode": 12, "cCpuTimeKernelMode": 6, "cPGFault": 2000, "cMajorPGFault": 0,
+    "cDiskSectorIO": 320, "cDiskReadBytes": 32768, "cDiskWriteBytes": 131072, "cNetworkBytesRecvd": 150000, "cNetworkBytesSent": 90000,
+}
+CONTAINER_LEVELS={"cMemoryUsed": 10**9, "cMemoryMaxUsed": 2 * 10**9}
+
+def get_commit():
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        return output.stdout.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def replay_sampler(root_dir, output_dir, options, samples):
+    """replay_sampler(root_dir, output_dir, options, samples)
+
+    The method runs rudataall.py with the options on the tree for as many
+    samples and returns the samples it wrote
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    command = [sys.executable, SAMPLER, output_dir, "--output-format", samplelog.NDJSON,
+               "--replay", root_dir, "--replay-count", str(samples)] + options
+    subprocess.run(command, cwd=output_dir, stdout=subprocess.DEVNULL, check=True)
+    records = []
+    for path in aggregate.find_run_files(output_dir):
+        records.extend(samplelog.read_records(path))
+    return records
+
+def summarize(wall_times, cpu_times):
+    wall = np.array(wall_times) / 1000
+    return {
+        "mean_us": round(float(wall.mean()), 3),
+        "median_us": round(float(np.median(wall)), 3),
+        "p95_us": round(float(np.percentile(wall, 95)), 3),
+        "min_us": round(float(wall.min()), 3),
+        "cpu_mean_us": round(float(np.mean(cpu_times)) / 1000, 3),
+    }
+
+def time_level(samples, level):
+    """time_level(samples, level)
+
+    The method summarizes the write and CPU times the samples recorded
+    for the level
+    """
+    wall_times = [sample[level + "_Write_Time"] * NANOSECONDS for sample in samples]
+    cpu_times = [sample[level + "_Cpu_Time"] * NANOSECONDS for sample in samples]
+    return summarize(wall_times, cpu_times)
+
+def benchmark_collectors(temp_dir, pid_counts, cpus, cgroup_version, repetitions):
+    """benchmark_collectors(temp_dir, pid_counts, cpus, cgroup_version, repetitions)
+
+    The method replays a synthetic host per process count through the
+    collectors of the sampler and returns their timings keyed by the
+    process count. The first sample of a replay opens the files and
+    caches the command lines, it is left out as the warm-up
+    """
+    results = {}
+    for pids in pid_counts:
+        root_dir = os.path.join(temp_dir, "host_{}".format(pids))
+        fakeroot.create_tree(root_dir, pids, cpus, cgroup_version)
+        timings = {}
+        for index, (options, levels) in enumerate(REPLAYS):
+            output_dir = os.path.join(temp_dir, "replay_{}_{}".format(pids, index))
+            samples = replay_sampler(root_dir, output_dir, options, repetitions + 1)[1:]
+            for name, level in levels:
+                timings[name] = time_level(samples, level)
+        results[str(pids)] = timings
+    return results
+
+def synthesize_sample(index, processes, generator):
+    """synthesize_sample(index, processes, generator)
+
+    The method returns the index-th sample of a synthetic run with the keys
+    of the VM, container and process levels, the counters growing by their
+    rate with a random noise
+    """
+    current_time = 1634567890 * 10**9 + index * INTERVAL_NS
+    timestamp = current_time / 10**9
+    sample = {"currentTime": current_time}
+    for key, rate in VM_COUNTERS.items():
+        sample[key] = index * rate + generator.randint(0, rate)
+        if key.startswith("vCpu"):
+            sample["t" + key] = timestamp
+    sample.update(VM_LEVELS)
+    for key, rate in CONTAINER_COUNTERS.items():
+        sample[key] = index * rate + generator.randint(0, rate)
+    sample["tcCpuTime"] = timestamp
+    sample.update(CONTAINER_LEVELS)
+    sample["cNumProcesses"] = processes
+    sample["pProcesses"] = [{
+        "pId": pid,
+        "pStartTime": 100 + pid,
+        "pCmdline": " ".join(fakeroot.COMMANDS[pid % len(fakeroot.COMMANDS)]),
+        "pName": os.path.basename(fakeroot.COMMANDS[pid % len(fakeroot.COMMANDS)][0]),
+        "pNumThreads": 1 + pid % 8,
+        "pCpuTimeUserMode": index * (pid % 5) + generator.randint(0, 3),
+        "pCpuTimeKernelMode": index * (pid % 3),
+        "pChildrenUserMode": 0,
+        "pChildrenKernelMode": 0,
+        "pPGFault": index * 10 * (pid % 7),
+        "pMajorPGFault": 0,
+        "pVoluntaryContextSwitches": index * 5,
+        "pInvoluntaryContextSwitches": index,
+        "pBlockIODelays": 0,
+        "pVirtualMemoryBytes": 104857600 + pid * 4096,
+        "pResidentSetSize": 10485760 + pid * 4096,
+    } for pid in range(1, processes + 1)]
+    sample["profiling_time"] = 0.001
+    return sample
+
+def time_stage(stages, name, samples, run):
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    stages[name] = {"seconds": round(seconds, 6), "samples_per_second": round(samples / seconds, 3) if seconds > 0 else None}
+
+def benchmark_pipeline(temp_dir, samples, processes, graphs=True):
+    """benchmark_pipeline(temp_dir, samples, processes, [graphs])
+
+    The method generates a run of synthetic samples and times the stages
+    of profiler.sh on it, from writing the samples to the graphs, and
+    returns the time and the throughput of every stage
+    """
+    run_dir = os.path.join(temp_dir, "run")
+    image_dir = os.path.join(temp_dir, "images")
+    os.makedirs(run_dir)
+    os.makedirs(image_dir)
+    with open(os.path.join(run_dir, "static.json"), 'w') as outfile:
+        json.dump({"cNumProcessors": fakeroot.CPUS, "vCpuType": "Synthetic CPU @ 2.10GHz"}, outfile, indent=4)
+    generator = random.Random(0)
+    records = [synthesize_sample(index, processes, generator) for index in range(samples)]
+    delta_file = os.path.join(run_dir, "delta.csv")
+    stages = {}
+
+    def write():
+        writer = samplelog.create_writer(run_dir, samplelog.NDJSON, 0)
+        for record in records:
+            writer.write(record)
+        writer.close()
+
+    def render():
+        metric_groups = graph.read_config(GRAPH_CONFIG)
+        df = graph.load_report(delta_file, metric_groups)
+        tasks = [(graph.plot_multiple, (metric_groups[key], key, index, image_dir)) for index, key in enumerate(metric_groups)]
+        graph.render_all(df, tasks, workers=1)
+
+    time_stage(stages, "write", samples, write)
+    time_stage(stages, "delta", samples, lambda: aggregate.aggregate_directory(run_dir, run_dir, AGGREGATE_CONFIG))
+    time_stage(stages, "csv", samples, lambda: export.export_directory(run_dir, delta_file, os.path.join(run_dir, "process.csv")))
+    if graphs:
+        time_stage(stages, "graph", samples, render)
+    return stages
+
+def get_timings(results, path=()):
+    """get_timings(results, [path])
+
+    The method yields the (path, seconds or microseconds) timings of a
+    result file that are compared between two runs
+    """
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from get_timings(value, path + (key,))
+        elif key in ["median_us", "seconds"] and isinstance(value, (int, float)):
+            yield path + (key,), value
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """compare(results, baseline, [threshold])
+
+    The method prints the timings of the results next to the ones of the
+    baseline and returns the timings slower by more than threshold percent
+    """
+    previous = dict(get_timings(baseline.get("results", {})))
+    if baseline.get("parameters") != results.get("parameters"):
+        print("the baseline was run with other parameters: {}".format(json.dumps(baseline.get("parameters"))))
+    regressions = []
+    print("{:<48} {:>14} {:>14} {:>9}".format("timing", "baseline", "current", "change"))
+    for path, value in get_timings(results.get("results", {})):
+        if path not in previous or not previous[path]:
+            continue
+        change = (value / previous[path] - 1) * 100
+        print("{:<48} {:>14.3f} {:>14.3f} {:>+8.1f}%".format("/".join(path), previous[path], value, change))
+        if change > threshold:
+            regressions.append(("/".join(path), change))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the collectors on a synthetic host and the post-processing of a synthetic run.')
+    parser.add_argument("-o", "--output-file", action="store", default="benchmark.json", help='JSON file of the results (default is benchmark.json)')
+    parser.add_argument("-p", "--pids", action="store", default=",".join(str(pids) for pids in PID_COUNTS), help='comma separated numbers of processes of the synthetic hosts (default is 100,1000,10000)')
+    parser.add_argument("-c", "--cpus", type=int, action="store", default=fakeroot.CPUS, help='number of CPUs of the synthetic hosts (default is 4)')
+    parser.add_argument("-g", "--cgroup-version", action="store", choices=[cgroup.V1, cgroup.V2], default=cgroup.V2, help='cgroup hierarchy of the synthetic hosts (default is v2)')
+    parser.add_argument("-r", "--repetitions", type=int, action="store", default=REPETITIONS, help='timed calls of every collector (default is 50)')
+    parser.add_argument("-n", "--samples", type=int, action="store", default=SAMPLES, help='samples of the synthetic run, 0 skips the pipeline (default is 1000)')
+    parser.add_argument("-P", "--processes", type=int, action="store", default=PROCESSES_PER_SAMPLE, help='processes of every sample of the synthetic run (default is 20)')
+    parser.add_argument("-G", "--no-graphs", action="store_true", default=False, help='leave the graph tool out of the pipeline')
+    parser.add_argument("-C", "--compare", action="store", metavar="BASELINE", help='results of an earlier run to compare to, slower timings exit with status 1')
+    parser.add_argument("-t", "--threshold", type=float, action="store", default=THRESHOLD, help='percent slower than the baseline reported as a regression (default is 10)')
+    args = parser.parse_args()
+
+    pid_counts = [int(pids) for pids in args.pids.split(",") if pids.strip()]
+    results = {
+        "version": VERSION,
+        "commit": get_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "host_cpus": os.cpu_count(),
+        "parameters": {
+            "pids": pid_counts,
+            "cpus": args.cpus,
+            "cgroup_version": args.cgroup_version,
+            "repetitions": args.repetitions,
+            "samples": args.samples,
+            "processes": args.processes,
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start = time.perf_counter()
+        results["results"]["collectors"] = benchmark_collectors(temp_dir, pid_counts, args.cpus, args.cgroup_version, args.repetitions)
+        print("timed the collectors on {} synthetic hosts in {:.1f} seconds".format(len(pid_counts), time.perf_counter() - start))
+        if args.samples > 1:
+            start = time.perf_counter()
+            results["results"]["pipeline"] = benchmark_pipeline(temp_dir, args.samples, args.processes, not args.no_graphs)
+            print("timed the pipeline on {} samples in {:.1f} seconds".format(args.samples, time.perf_counter() - start))
+
+    for pids, collectors in results["results"]["collectors"].items():
+        for name, timing in collectors.items():
+            print("{:>6} processes {:<13} median {:>12.1f} us  p95 {:>12.1f} us".format(pids, name, timing["median_us"], timing["p95_us"]))
+    for name, timing in results["results"].get("pipeline", {}).items():
+        print("pipeline {:<20} {:>10.3f} seconds  {:>12.1f} samples/second".format(name, timing["seconds"], timing["samples_per_second"] or 0))
+    with open(args.output_file, 'w') as outfile:
+        json.dump(results, outfile, indent=4)
+    print("wrote the results to {}".format(args.output_file))
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as infile:
+            regressions = compare(results, json.load(infile), args.threshold)
+        for name, change in regressions:
+            print("regression: {} is {:.1f}% slower".format(name, change))
+        if regressions:
+            sys.exit(1)
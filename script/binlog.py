@@ -0,0 +1,499 @@
+# --------------------------------------------------------------------------
+# The module stores the samples of a run in a compact binary layout. The
+# keys of the samples are written once, in a schema at the head of the run
+# file, and every sample follows as one fixed-width record of numbers, so a
+# reader maps the file and gets every metric as a NumPy view of the mapped
+# pages without parsing or copying anything.
+#
+#   RUN.bin          magic, schema length, schema (JSON), fixed-width records
+#   RUN.bin.proc     magic, schema length, schema (JSON), one record per
+#                    process of every sample, the sample keeping the number
+#                    of its processes under pProcesses
+#   RUN.bin.strings  the string table, one JSON string per line, the
+#                    records hold the index of their strings (cmdlines,
+#                    process names, metric types)
+#
+# A missing number is the smallest integer or NaN, a nested object is
+# inlined under the path of its keys, a list of numbers is a fixed-shape
+# column and a list of strings a constant of the schema. A sample that does
+# not fit the schema (a new key, another type or shape) ends the file and
+# the run goes on in a new one.
+#
+# Usage: python3 binlog.py benchmark RUN.ndjson
+#        (compares the size and the parse time of a run in both formats)
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import numpy as np
+
+MAGIC=b'PROFBIN\x01'
+HEADER=struct.Struct('<8sI')
+ALIGNMENT=8
+VERSION=1
+
+EXTENSION='.bin'
+PROCESS_SUFFIX='.proc'
+STRINGS_SUFFIX='.strings'
+PROCESS_LIST_KEY='pProcesses'
+
+# the column types: integer, float, boolean, string index, and list constant
+INTEGER='q'
+FLOAT='d'
+BOOLEAN='?'
+STRING='I'
+CONSTANT='constant'
+
+MISSING_INTEGER=-2**63
+MISSING_STRING=2**32 - 1
+MISSING_BOOLEAN=2   # stored in a signed byte, neither false nor true
+INT64_LIMIT=2**63
+
+BUFFER_SIZE=1024*1024
+
+class SchemaMismatch(Exception):
+    pass
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def get_shape(value):
+    """get_shape(value)
+
+    The method returns the shape and the type of a list of numbers, or
+    None when the list is not a rectangular list of numbers
+    """
+    if len(value) == 0:
+        return None
+    if all(is_number(item) for item in value):
+        return (len(value),), INTEGER if all(isinstance(item, int) for item in value) else FLOAT
+    if all(isinstance(item, list) for item in value):
+        inner = [get_shape(item) for item in value]
+        if inner[0] is None or any(shape != inner[0] for shape in inner) or len(inner[0][0]) != 1:
+            return None
+        kinds = set(kind for _shape, kind in inner)
+        return (len(value),) + inner[0][0], INTEGER if kinds == set([INTEGER]) else FLOAT
+    return None
+
+def describe(value):
+    """describe(value)
+
+    The method returns the schema entry of a value: its type and, for a
+    list, its shape or its constant value
+    """
+    if isinstance(value, bool):
+        return {"type": BOOLEAN}
+    if isinstance(value, int) and -INT64_LIMIT < value < INT64_LIMIT:
+        return {"type": INTEGER}
+    if is_number(value) or value is None:
+        return {"type": FLOAT}
+    if isinstance(value, str):
+        return {"type": STRING}
+    if isinstance(value, list):
+        shape = get_shape(value)
+        if shape is not None:
+            return {"type": shape[1], "shape": list(shape[0])}
+    return {"type": CONSTANT, "value": value}
+
+def walk(record, path=()):
+    """walk(record, [path])
+
+    The method yields the (path, value) leaves of a record in the order of
+    its keys, the nested objects inlined
+    """
+    for key, value in record.items():
+        if isinstance(value, dict) and value:
+            yield from walk(value, path + (key,))
+        else:
+            yield path + (key,), value
+
+def create_schema(record):
+    fields = []
+    for path, value in walk(record):
+        field = describe(value)
+        field["path"] = list(path)
+        fields.append(field)
+    return fields
+
+def get_dtype(fields):
+    """get_dtype(fields)
+
+    The method returns the NumPy record type of the schema fields, the
+    constants take no room in the records
+    """
+    columns = []
+    for field in fields:
+        if field["type"] == CONSTANT:
+            continue
+        kind = 'i1' if field["type"] == BOOLEAN else field["type"]
+        columns.append((get_name(field["path"]), '<' + kind, tuple(field.get("shape", ()))))
+    return np.dtype(columns)
+
+def get_name(path):
+    return ".".join(path)
+
+class Table:
+    """Table(path, fields)
+
+    The class appends the fixed-width records of one schema to a file
+    """
+
+    def __init__(self, path, fields):
+        self.fields = fields
+        self.paths = [tuple(field["path"]) for field in fields]
+        self.index = dict((path, position) for position, path in enumerate(self.paths))
+        self.dtype = get_dtype(fields)
+        self.packer = struct.Struct('<' + "".join(
+            ('b' if field["type"] == BOOLEAN else field["type"]) * int(np.prod(field.get("shape", ()), dtype=np.int64))
+            for field in fields if field["type"] != CONSTANT))
+        self.count = 0
+        self.file = open(path, 'wb', buffering=BUFFER_SIZE)
+        schema = json.dumps({"version": VERSION, "fields": fields}, separators=(',', ':')).encode("utf-8")
+        header = HEADER.pack(MAGIC, len(schema)) + schema
+        self.file.write(header + b'\0' * (-len(header) % ALIGNMENT))
+
+    def pack(self, leaves, strings):
+        """pack(leaves, strings)
+
+        The method packs the (path, value) leaves of a record, the strings
+        are replaced by their index in the string table. It raises
+        SchemaMismatch when a leaf does not fit the schema
+        """
+        values = [None] * len(self.fields)
+        for path, value in leaves:
+            position = self.index.get(path)
+            if position is None:
+                raise SchemaMismatch("new key {}".format(get_name(path)))
+            values[position] = value
+
+        packed = []
+        for field, value in zip(self.fields, values):
+            kind = field["type"]
+            if kind == CONSTANT:
+                if value is not None and value != field["value"]:
+                    raise SchemaMismatch("another value of {}".format(get_name(field["path"])))
+            elif "shape" in field:
+                if value is None:
+                    packed.extend([MISSING_INTEGER if kind == INTEGER else float("nan")] * int(np.prod(field["shape"])))
+                    continue
+                array = np.asarray(value)
+                if list(array.shape) != field["shape"] or (kind == INTEGER and array.dtype.kind != 'i'):
+                    raise SchemaMismatch("another shape of {}".format(get_name(field["path"])))
+                packed.extend(array.ravel().tolist())
+            elif value is None:
+                packed.append(MISSING_INTEGER if kind == INTEGER else MISSING_STRING if kind == STRING else MISSING_BOOLEAN if kind == BOOLEAN else float("nan"))
+            elif kind == INTEGER:
+                if not isinstance(value, int) or isinstance(value, bool) or not -INT64_LIMIT < value < INT64_LIMIT:
+                    raise SchemaMismatch("a non integer value of {}".format(get_name(field["path"])))
+                packed.append(value)
+            elif kind == FLOAT:
+                if not is_number(value):
+                    raise SchemaMismatch("a non numeric value of {}".format(get_name(field["path"])))
+                packed.append(value)
+            elif kind == STRING:
+                if not isinstance(value, str):
+                    raise SchemaMismatch("a non string value of {}".format(get_name(field["path"])))
+                packed.append(strings.get_index(value))
+            else:
+                if not isinstance(value, bool):
+                    raise SchemaMismatch("a non boolean value of {}".format(get_name(field["path"])))
+                packed.append(int(value))
+        return self.packer.pack(*packed)
+
+    def write(self, data):
+        self.file.write(data)
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class StringTable:
+    """StringTable(path)
+
+    The class appends every new string to the string table file once and
+    returns its index
+    """
+
+    def __init__(self, path):
+        self.indexes = {}
+        self.file = open(path, 'w', buffering=BUFFER_SIZE)
+
+    def get_index(self, value):
+        index = self.indexes.get(value)
+        if index is None:
+            index = len(self.indexes)
+            self.indexes[value] = index
+            self.file.write(json.dumps(value) + "\n")
+        return index
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class RunWriter:
+    """RunWriter(path)
+
+    The class writes the records of a run to path and the companion process
+    and string files. The schema is taken from the first record, and the
+    first process of the run for the process file. write() raises
+    SchemaMismatch, leaving the files unchanged, when a record does not fit
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.table = None
+        self.process_table = None
+        self.strings = StringTable(path + STRINGS_SUFFIX)
+
+    def write(self, record):
+        processes = record.get(PROCESS_LIST_KEY)
+        if isinstance(processes, list) and all(isinstance(process, dict) for process in processes):
+            # the sample keeps the number of its processes, their rows go to the process file
+            record = dict(record)
+            record[PROCESS_LIST_KEY] = len(processes)
+        else:
+            processes = []
+        if self.table is None:
+            fields = create_schema(record)
+            for field in fields:
+                if field["path"] == [PROCESS_LIST_KEY] and field["type"] == INTEGER:
+                    field["rows"] = PROCESS_SUFFIX
+            self.table = Table(self.path, fields)
+        if self.process_table is None and processes:
+            self.process_table = Table(self.path + PROCESS_SUFFIX, create_schema(processes[0]))
+
+        # pack everything before writing anything, a mismatch leaves the files consistent
+        data = self.table.pack(walk(record), self.strings)
+        process_data = [self.process_table.pack(walk(process), self.strings) for process in processes]
+        self.table.write(data)
+        for row in process_data:
+            self.process_table.write(row)
+
+    def flush(self):
+        # the strings first, the records never refer to a string not yet on disk
+        self.strings.flush()
+        for table in [self.process_table, self.table]:
+            if table is not None:
+                table.flush()
+
+    def close(self):
+        self.strings.close()
+        for table in [self.process_table, self.table]:
+            if table is not None:
+                table.close()
+
+def map_table(path):
+    """map_table(path)
+
+    The method maps a table file and returns its schema fields and its
+    records as a read-only NumPy array of the mapped pages, a record cut
+    by an interrupted run is left out
+    """
+    with open(path, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError("{} is not a binary run file".format(path))
+        buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, schema_size = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("{} is not a binary run file".format(path))
+    fields = json.loads(buffer[HEADER.size:HEADER.size + schema_size].decode("utf-8"))["fields"]
+    offset = HEADER.size + schema_size
+    offset += -offset % ALIGNMENT
+    dtype = get_dtype(fields)
+    count = (size - offset) // dtype.itemsize if dtype.itemsize > 0 else 0
+    return fields, np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+
+def read_strings(path):
+    strings = []
+    try:
+        with open(path, 'r') as infile:
+            for line in infile:
+                try:
+                    strings.append(json.loads(line))
+                except ValueError:
+                    break
+    except OSError:
+        pass
+    return strings
+
+class RunReader:
+    """RunReader(path)
+
+    The class maps a binary run. column() and process_column() return the
+    NumPy views of a metric over all the samples or all the process rows,
+    records() rebuilds the samples in their JSON layout
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fields, self.samples = map_table(path)
+        self.process_fields, self.processes = [], None
+        if os.path.exists(path + PROCESS_SUFFIX):
+            self.process_fields, self.processes = map_table(path + PROCESS_SUFFIX)
+        self.strings = read_strings(path + STRINGS_SUFFIX)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def column(self, name):
+        return self.samples[name]
+
+    def process_column(self, name):
+        return self.processes[name]
+
+    def get_string(self, index):
+        return self.strings[index] if index < len(self.strings) else None
+
+    def get_values(self, field, table):
+        """get_values(field, table)
+
+        The method returns the values of a field over all the rows of a
+        table as Python objects, None for a missing value
+        """
+        kind = field["type"]
+        if kind == CONSTANT:
+            return [field["value"]] * len(table)
+        column = table[get_name(field["path"])]
+        values = column.tolist()
+        if "shape" in field:
+            flat = column.reshape(len(column), -1)
+            missing = np.isnan(flat).all(axis=1) if kind == FLOAT else (flat == MISSING_INTEGER).all(axis=1)
+        elif kind == FLOAT:
+            missing = np.isnan(column)
+        elif kind == INTEGER:
+            missing = column == MISSING_INTEGER
+        elif kind == STRING:
+            missing = column == MISSING_STRING
+            values = [self.get_string(index) for index in values]
+        else:
+            missing = column == MISSING_BOOLEAN
+            values = [bool(value) for value in values]
+        for row in np.flatnonzero(missing).tolist():
+            values[row] = None
+        return values
+
+    def decode(self, fields, table):
+        """decode(fields, table)
+
+        The method returns the records of the rows of a table in the layout
+        they were written with, the missing values left out
+        """
+        columns = [(field["path"], self.get_values(field, table)) for field in fields]
+        records = []
+        for row in range(len(table)):
+            record = {}
+            for path, values in columns:
+                value = values[row]
+                if value is None:
+                    continue
+                target = record
+                for key in path[:-1]:
+                    target = target.setdefault(key, {})
+                target[path[-1]] = value
+            records.append(record)
+        return records
+
+    def records(self):
+        """records()
+
+        The method returns the samples of the run in their JSON layout, the
+        process list of a sample rebuilt from the process file
+        """
+        records = self.decode(self.fields, self.samples)
+        rows = [field for field in self.fields if "rows" in field]
+        if rows:
+            processes = self.decode(self.process_fields, self.processes) if self.processes is not None else []
+            start = 0
+            for record in records:
+                count = record.get(PROCESS_LIST_KEY)
+                if count is not None:
+                    record[PROCESS_LIST_KEY] = processes[start:start + count]
+                    start += count
+        return records
+
+def get_run_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ["", PROCESS_SUFFIX, STRINGS_SUFFIX] if os.path.exists(path + suffix))
+
+def convert_records(records, path):
+    """convert_records(records, path)
+
+    The method writes the records to a binary run, a record not fitting
+    the schema of the current file starts a new file named after it with
+    a numbered suffix. It returns the paths written
+    """
+    paths = [path]
+    writer = RunWriter(path)
+    try:
+        for record in records:
+            try:
+                writer.write(record)
+            except SchemaMismatch:
+                writer.close()
+                base, extension = os.path.splitext(path)
+                paths.append("{}_{}{}".format(base, len(paths), extension))
+                writer = RunWriter(paths[-1])
+                writer.write(record)
+    finally:
+        writer.close()
+    return paths
+
+def benchmark(ndjson_path):
+    """benchmark(ndjson_path)
+
+    The method converts an ndjson run to a temporary binary run and prints
+    their sizes, the time to parse every sample of both, and the time to
+    get one metric of every sample from both
+    """
+    with open(ndjson_path, 'r') as infile:
+        lines = [line for line in infile if line.strip()]
+    records = [json.loads(line) for line in lines]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "run.bin")
+        paths = convert_records(records, path)
+        if len(paths) > 1:
+            print("the run spans {} binary files, the benchmark uses the first one".format(len(paths)))
+
+        start = time.perf_counter()
+        with open(ndjson_path, 'r') as infile:
+            parsed = [json.loads(line) for line in infile if line.strip()]
+        json_parse = time.perf_counter() - start
+        start = time.perf_counter()
+        with open(ndjson_path, 'r') as infile:
+            json_column = np.array([json.loads(line).get("currentTime") for line in infile if line.strip()], dtype=np.float64)
+        json_metric = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reader = RunReader(path)
+        decoded = reader.records()
+        binary_parse = time.perf_counter() - start
+        start = time.perf_counter()
+        binary_column = RunReader(path).column("currentTime")
+        binary_metric = time.perf_counter() - start
+
+        print("samples: {} json, {} binary".format(len(parsed), len(decoded)))
+        print("size: {} bytes ndjson, {} bytes binary ({:.1f}x smaller)".format(
+            os.path.getsize(ndjson_path), get_run_size(path), os.path.getsize(ndjson_path) / get_run_size(path)))
+        print("parse every sample: {:.3f} seconds ndjson, {:.3f} seconds binary".format(json_parse, binary_parse))
+        print("read currentTime of every sample: {:.6f} seconds ndjson, {:.6f} seconds binary (zero-copy view: {})".format(
+            json_metric, binary_metric, not binary_column.flags.owndata))
+        print("same records: {}".format(decoded == records[:len(decoded)] and np.array_equal(json_column[:len(binary_column)], binary_column)))
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != "benchmark":
+        print("Usage: {} benchmark RUN.ndjson".format(sys.argv[0]))
+        sys.exit(1)
+    benchmark(sys.argv[2])
@@ -0,0 +1,149 @@
+# --------------------------------------------------------------------------
+# The module collects the optional per-CPU, per-disk and per-interface
+# breakdowns of the VM level. A breakdown is stored as one compact object
+# per dimension with a single timestamp: the names of the CPUs, disks or
+# interfaces, the names of the counters, and one row of counters per name.
+#
+#   "vCpuBreakdown": {"tvCpuBreakdown": 1634567890.1, "names": ["cpu0", ...],
+#                     "fields": ["user", ...], "values": [[1200, ...], ...]}
+#
+# The delta of two breakdowns is computed vector-wise, the rows matched by
+# name so a disk or an interface appearing during the run is left out of
+# the delta it is missing from.
+#
+# Usage: rudataall.py --breakdown cpu,disk,net ...
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import time
+import numpy as np
+import procfs
+
+CPU='cpu'
+DISK='disk'
+NETWORK='net'
+DIMENSIONS=[CPU, DISK, NETWORK]
+
+BREAKDOWN_KEYS={
+    CPU: "vCpuBreakdown",
+    DISK: "vDiskBreakdown",
+    NETWORK: "vNetworkBreakdown",
+}
+NAMES_KEY='names'
+FIELDS_KEY='fields'
+VALUES_KEY='values'
+
+# the times of a cpuN line of /proc/stat, in centiseconds
+CPU_FIELDS=["user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal"]
+# the counters of a /proc/diskstats line, the in-flight requests are a level and left out
+DISK_FIELDS=["reads", "readsMerged", "sectorsRead", "readTime", "writes", "writesMerged", "sectorsWritten", "writeTime", "ioTime"]
+DISK_COLUMNS=[0, 1, 2, 3, 4, 5, 6, 7, 9]
+# the counters of a /proc/net/dev line
+NETWORK_FIELDS=["bytesRecvd", "packetsRecvd", "errorsRecvd", "droppedRecvd", "bytesSent", "packetsSent", "errorsSent", "droppedSent"]
+NETWORK_COLUMNS=[0, 1, 2, 3, 8, 9, 10, 11]
+
+def parse_dimensions(text):
+    """parse_dimensions(text)
+
+    The method returns the dimensions of a comma separated list such as
+    cpu,disk,net, or raises ValueError for an unknown one
+    """
+    dimensions = [dimension.strip() for dimension in text.split(",") if dimension.strip()]
+    for dimension in dimensions:
+        if dimension not in DIMENSIONS:
+            raise ValueError("unknown breakdown '{}', expected {}".format(dimension, ", ".join(DIMENSIONS)))
+    return dimensions
+
+def to_centiseconds(ticks):
+    if procfs.CLOCK_TICKS == 100:
+        return ticks
+    return ticks * 100 / procfs.CLOCK_TICKS
+
+def get_columns(counters, columns):
+    return [counters[column] if column < len(counters) else 0 for column in columns]
+
+def encode(key, names, fields, rows, timestamp):
+    return {"t" + key: timestamp, NAMES_KEY: names, FIELDS_KEY: fields, VALUES_KEY: rows}
+
+def read_cpu_breakdown():
+    cpus = procfs.read_cpu_stat()
+    timestamp = time.time()
+    names = sorted(cpus, key=lambda name: int(name[3:]))
+    rows = [[to_centiseconds(ticks) for ticks in cpus[name][:len(CPU_FIELDS)]] for name in names]
+    return encode(BREAKDOWN_KEYS[CPU], names, CPU_FIELDS, rows, timestamp)
+
+def read_disk_breakdown(block_devices):
+    devices = procfs.read_diskstats()
+    timestamp = time.time()
+    names = [name for name, _major_minor in block_devices if name in devices]
+    rows = [get_columns(devices[name], DISK_COLUMNS) for name in names]
+    return encode(BREAKDOWN_KEYS[DISK], names, DISK_FIELDS, rows, timestamp)
+
+def read_network_breakdown():
+    interfaces = procfs.read_net_dev()
+    timestamp = time.time()
+    names = sorted(interfaces)
+    rows = [get_columns(interfaces[name], NETWORK_COLUMNS) for name in names]
+    return encode(BREAKDOWN_KEYS[NETWORK], names, NETWORK_FIELDS, rows, timestamp)
+
+def collect(dimensions, block_devices):
+    """collect(dimensions, block_devices)
+
+    The method returns the breakdowns of the dimensions keyed by their
+    sample key, block_devices are the whole disks of the host
+    """
+    breakdowns = {}
+    if CPU in dimensions:
+        breakdowns[BREAKDOWN_KEYS[CPU]] = read_cpu_breakdown()
+    if DISK in dimensions:
+        breakdowns[BREAKDOWN_KEYS[DISK]] = read_disk_breakdown(block_devices)
+    if NETWORK in dimensions:
+        breakdowns[BREAKDOWN_KEYS[NETWORK]] = read_network_breakdown()
+    return breakdowns
+
+def is_breakdown(value):
+    return isinstance(value, dict) and isinstance(value.get(NAMES_KEY), list) and isinstance(value.get(VALUES_KEY), list)
+
+def diff(first, second):
+    """diff(first, second)
+
+    The method returns the delta of two breakdowns, the rows of the names
+    of the first breakdown also found in the second, or None when their
+    counters differ
+    """
+    if first.get(FIELDS_KEY) != second.get(FIELDS_KEY):
+        return None
+    index = dict(zip(second[NAMES_KEY], range(len(second[NAMES_KEY]))))
+    rows = [(row, index[name]) for row, name in enumerate(first[NAMES_KEY]) if name in index]
+    names = [first[NAMES_KEY][row] for row, _other in rows]
+    deltas = []
+    if rows:
+        before = np.array([first[VALUES_KEY][row] for row, _other in rows])
+        after = np.array([second[VALUES_KEY][other] for _row, other in rows])
+        deltas = (after - before).tolist()
+    return {NAMES_KEY: names, FIELDS_KEY: first.get(FIELDS_KEY), VALUES_KEY: deltas}
+
+def get_rows(delta, interval):
+    """get_rows(delta, interval)
+
+    The method yields one row per name and counter of the breakdowns of a
+    delta record, with the per-second rate over the interval of the
+    breakdown timestamp
+    """
+    for key in sorted(delta):
+        value = delta[key]
+        if not is_breakdown(value):
+            continue
+        elapsed = delta.get("t" + key)
+        for name, counters in zip(value[NAMES_KEY], value[VALUES_KEY]):
+            for field, counter in zip(value[FIELDS_KEY], counters):
+                yield {
+                    "interval": interval,
+                    "breakdown": key,
+                    "name": name,
+                    "field": field,
+                    "delta": counter,
+                    "rate": counter / elapsed if isinstance(elapsed, (int, float)) and elapsed > 0 else None,
+                }
@@ -0,0 +1,302 @@
+# --------------------------------------------------------------------------
+# The module reads the container level metrics from the cgroup filesystem.
+# The cgroup version (v1, v2 or hybrid) is detected once at startup and
+# the files a backend needs are resolved once as well, so a sample never
+# probes a file that does not exist on the host.
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import os
+import procfs
+
+V1='v1'
+V2='v2'
+HYBRID='hybrid'
+
+# pressure stall information of cgroup v2, total stall time in microseconds
+PRESSURE_FILES={
+    "cpu.pressure": "cCpuPressure",
+    "memory.pressure": "cMemoryPressure",
+    "io.pressure": "cIoPressure",
+}
+
+def detect_version(cgroup_dir):
+    """detect_version(cgroup_dir)
+
+    The method returns v2 when the unified hierarchy is mounted on the
+    cgroup directory, hybrid when it is mounted below it next to the v1
+    controllers, v1 otherwise
+    """
+    if procfs.is_file(os.path.join(cgroup_dir, "cgroup.controllers")):
+        return V2
+    if procfs.is_file(os.path.join(cgroup_dir, "unified", "cgroup.controllers")):
+        return HYBRID
+    return V1
+
+def read_self_cgroups():
+    """read_self_cgroups()
+
+    The method returns /proc/self/cgroup as a dictionary mapping every
+    controller (an empty string for the unified hierarchy) to its path
+    """
+    paths = {}
+    for line in procfs.read_file("{}/self/cgroup".format(procfs.PROC_DIR)).splitlines():
+        fields = line.split(":", 2)
+        if len(fields) != 3:
+            continue
+        for controller in fields[1].split(","):
+            paths[controller.replace("name=", "")] = fields[2]
+    return paths
+
+def resolve_dir(mount_dir, path):
+    """resolve_dir(mount_dir, path)
+
+    The method returns the directory of the profiler cgroup below the mount
+    point, or the mount point itself when a cgroup namespace already made
+    the cgroup the root of the hierarchy
+    """
+    if path and path != "/":
+        directory = os.path.join(mount_dir, path.lstrip("/"))
+        if os.path.isdir(directory):
+            return directory
+    return mount_dir
+
+def existing_file(directory, file_name):
+    file_path = os.path.join(directory, file_name)
+    if procfs.is_file(file_path):
+        return file_path
+    return None
+
+def read_int(file_path, default_value=0):
+    if file_path is None:
+        return default_value
+    try:
+        return int(procfs.read_file(file_path, keep_open=True).split()[0])
+    except (IndexError, ValueError):
+        return default_value
+
+def parse_pressure(file_content):
+    """parse_pressure(file_content)
+
+    The method parses a *.pressure file into the total stall time of the
+    "some" and "full" lines in microseconds
+    """
+    totals = {}
+    for line in file_content.splitlines():
+        fields = line.split()
+        for field in fields[1:]:
+            if field.startswith("total="):
+                totals[fields[0]] = int(field[6:])
+    return totals
+
+class CgroupBackend:
+    """CgroupBackend(cgroup_dir, block_devices)
+
+    The base class of the backends, read() returns the container counters
+    with the same keys on every cgroup version
+    """
+
+    version = None
+
+    def __init__(self, cgroup_dir, block_devices):
+        self.cgroup_dir = cgroup_dir
+        self.major_minors = set(major_minor for _name, major_minor in block_devices)
+        self.pressure_files = {}
+
+    def resolve_pressure_files(self, unified_dir):
+        for file_name, key in PRESSURE_FILES.items():
+            file_path = existing_file(unified_dir, file_name)
+            if file_path is not None:
+                self.pressure_files[key] = file_path
+
+    def read_pressure(self):
+        """read_pressure()
+
+        The method returns the pressure stall totals of the cgroup, for
+        instance cCpuPressureSome and cIoPressureFull, empty on cgroup v1
+        """
+        pressure = {}
+        for key, file_path in self.pressure_files.items():
+            totals = parse_pressure(procfs.read_file(file_path, keep_open=True))
+            pressure[key + "Some"] = totals.get("some", 0)
+            pressure[key + "Full"] = totals.get("full", 0)
+        return pressure
+
+class CgroupV1(CgroupBackend):
+    """CgroupV1(cgroup_dir, block_devices, [unified_dir])
+
+    The backend of the cpuacct, memory, blkio and pids v1 controllers,
+    the pressure files are read from the unified hierarchy of a hybrid host
+    """
+
+    version = V1
+
+    def __init__(self, cgroup_dir, block_devices, unified_dir=None):
+        CgroupBackend.__init__(self, cgroup_dir, block_devices)
+        paths = read_self_cgroups()
+        cpuacct_dir = resolve_dir(os.path.join(cgroup_dir, "cpuacct"), paths.get("cpuacct"))
+        memory_dir = resolve_dir(os.path.join(cgroup_dir, "memory"), paths.get("memory"))
+        blkio_dir = resolve_dir(os.path.join(cgroup_dir, "blkio"), paths.get("blkio"))
+        pids_dir = resolve_dir(os.path.join(cgroup_dir, "pids"), paths.get("pids"))
+
+        self.cpu_usage_file = existing_file(cpuacct_dir, "cpuacct.usage")
+        self.cpu_stat_file = existing_file(cpuacct_dir, "cpuacct.stat")
+        self.cpu_percpu_file = existing_file(cpuacct_dir, "cpuacct.usage_percpu")
+        self.memory_stat_file = existing_file(memory_dir, "memory.stat")
+        self.memory_usage_file = existing_file(memory_dir, "memory.usage_in_bytes")
+        self.memory_max_usage_file = existing_file(memory_dir, "memory.max_usage_in_bytes")
+        self.sectors_file = existing_file(blkio_dir, "blkio.sectors")
+        self.io_bytes_file = existing_file(blkio_dir, "blkio.throttle.io_service_bytes")
+        self.tasks_file = existing_file(pids_dir, "tasks")
+        self.procs_dir = pids_dir if existing_file(pids_dir, "cgroup.procs") else cpuacct_dir
+        if unified_dir is not None:
+            self.version = HYBRID
+            self.resolve_pressure_files(resolve_dir(unified_dir, paths.get("")))
+
+    def read(self):
+        cpu_stat = {}
+        if self.cpu_stat_file is not None:
+            cpu_stat = procfs.parse_key_values(procfs.read_file(self.cpu_stat_file, keep_open=True))
+        memory_stat = {}
+        if self.memory_stat_file is not None:
+            memory_stat = procfs.parse_key_values(procfs.read_file(self.memory_stat_file, keep_open=True))
+
+        cpu_percpu = []
+        if self.cpu_percpu_file is not None:
+            cpu_percpu = [int(value) for value in procfs.read_file(self.cpu_percpu_file, keep_open=True).split()]
+
+        # data sample
+        # 8:0 53966
+        # 11:0 0
+        disk_sectors = 0
+        if self.sectors_file is not None:
+            for line in procfs.read_file(self.sectors_file, keep_open=True).splitlines():
+                fields = line.split()
+                if len(fields) == 2:
+                    disk_sectors += int(fields[1])
+
+        # data sample
+        # 259:0 Read 1024
+        # 259:0 Write 2048
+        disk_read_bytes = 0
+        disk_write_bytes = 0
+        if self.io_bytes_file is not None:
+            for line in procfs.read_file(self.io_bytes_file, keep_open=True).splitlines():
+                fields = line.split()
+                if len(fields) != 3 or fields[0] not in self.major_minors:
+                    continue
+                if fields[1] == "Read":
+                    disk_read_bytes += int(fields[2])
+                elif fields[1] == "Write":
+                    disk_write_bytes += int(fields[2])
+
+        num_processes = 0
+        if self.tasks_file is not None:
+            num_processes = len(procfs.read_file(self.tasks_file, keep_open=True).split())
+
+        return {
+            "cpu_time": read_int(self.cpu_usage_file),
+            "cpu_percpu": cpu_percpu,
+            # cpuacct.stat is in USER_HZ, that is centiseconds
+            "cpu_user": cpu_stat.get("user", 0),
+            "cpu_kernel": cpu_stat.get("system", 0),
+            "pgfault": memory_stat.get("pgfault", 0),
+            "pgmajfault": memory_stat.get("pgmajfault", 0),
+            "disk_sectors": disk_sectors,
+            "disk_read_bytes": disk_read_bytes,
+            "disk_write_bytes": disk_write_bytes,
+            "memory_used": read_int(self.memory_usage_file),
+            "memory_max_used": read_int(self.memory_max_usage_file),
+            "num_processes": num_processes,
+        }
+
+class CgroupV2(CgroupBackend):
+    """CgroupV2(cgroup_dir, block_devices)
+
+    The backend of the unified hierarchy, it reads cpu.stat, memory.current,
+    memory.peak, memory.stat, io.stat, pids.current and the pressure files
+    """
+
+    version = V2
+
+    def __init__(self, cgroup_dir, block_devices):
+        CgroupBackend.__init__(self, cgroup_dir, block_devices)
+        unified_dir = resolve_dir(cgroup_dir, read_self_cgroups().get(""))
+
+        self.cpu_stat_file = existing_file(unified_dir, "cpu.stat")
+        self.memory_current_file = existing_file(unified_dir, "memory.current")
+        self.memory_peak_file = existing_file(unified_dir, "memory.peak")
+        self.memory_stat_file = existing_file(unified_dir, "memory.stat")
+        self.io_stat_file = existing_file(unified_dir, "io.stat")
+        self.pids_current_file = existing_file(unified_dir, "pids.current")
+        self.procs_file = existing_file(unified_dir, "cgroup.procs")
+        self.procs_dir = unified_dir
+        self.memory_max_used = 0
+        self.resolve_pressure_files(unified_dir)
+
+    def read(self):
+        cpu_stat = {}
+        if self.cpu_stat_file is not None:
+            cpu_stat = procfs.parse_key_values(procfs.read_file(self.cpu_stat_file, keep_open=True))
+        memory_stat = {}
+        if self.memory_stat_file is not None:
+            memory_stat = procfs.parse_key_values(procfs.read_file(self.memory_stat_file, keep_open=True))
+
+        # data sample
+        # 8:0 rbytes=1024 wbytes=2048 rios=1 wios=2 dbytes=0 dios=0
+        disk_read_bytes = 0
+        disk_write_bytes = 0
+        if self.io_stat_file is not None:
+            for line in procfs.read_file(self.io_stat_file, keep_open=True).splitlines():
+                fields = line.split()
+                if len(fields) == 0 or fields[0] not in self.major_minors:
+                    continue
+                for field in fields[1:]:
+                    key, _, value = field.partition("=")
+                    if key == "rbytes":
+                        disk_read_bytes += int(value)
+                    elif key == "wbytes":
+                        disk_write_bytes += int(value)
+
+        # memory.peak needs linux 5.19, track the peak seen by the profiler before
+        memory_used = read_int(self.memory_current_file)
+        self.memory_max_used = max(self.memory_max_used, memory_used)
+        if self.memory_peak_file is not None:
+            self.memory_max_used = read_int(self.memory_peak_file)
+
+        if self.pids_current_file is not None:
+            num_processes = read_int(self.pids_current_file)
+        elif self.procs_file is not None:
+            num_processes = len(procfs.read_file(self.procs_file, keep_open=True).split())
+        else:
+            num_processes = 0
+
+        return {
+            "cpu_time": cpu_stat.get("usage_usec", 0) * 1000,
+            # cgroup v2 does not account the CPU time per processor
+            "cpu_percpu": [],
+            "cpu_user": cpu_stat.get("user_usec", 0) // 10000,
+            "cpu_kernel": cpu_stat.get("system_usec", 0) // 10000,
+            "pgfault": memory_stat.get("pgfault", 0),
+            "pgmajfault": memory_stat.get("pgmajfault", 0),
+            "disk_sectors": (disk_read_bytes + disk_write_bytes) // 512,
+            "disk_read_bytes": disk_read_bytes,
+            "disk_write_bytes": disk_write_bytes,
+            "memory_used": memory_used,
+            "memory_max_used": self.memory_max_used,
+            "num_processes": num_processes,
+        }
+
+def create_backend(cgroup_dir, block_devices):
+    """create_backend(cgroup_dir, block_devices)
+
+    The method detects the cgroup version once and returns its backend
+    """
+    version = detect_version(cgroup_dir)
+    if version == V2:
+        return CgroupV2(cgroup_dir, block_devices)
+    if version == HYBRID:
+        return CgroupV1(cgroup_dir, block_devices, os.path.join(cgroup_dir, "unified"))
+    return CgroupV1(cgroup_dir, block_devices)
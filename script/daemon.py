@@ -0,0 +1,322 @@
+# --------------------------------------------------------------------------
+# The module keeps one sampler process alive for many profiling requests.
+# The daemon is controlled through a local Unix socket or a TCP port (one
+# text command per line, one reply line per command) or through signals:
+#
+#   sample        take one sample now                  (SIGUSR1)
+#   start [ms]    start a time series                  (SIGUSR2 toggles)
+#   stop          stop the time series, take a sample  (SIGUSR2 toggles)
+#   status        report the daemon state in JSON
+#   dump          write the last samples to a file     (SIGQUIT)
+#   quit          stop the daemon                      (SIGTERM, SIGINT)
+#
+# The control address is the path of a Unix socket or a HOST:PORT pair.
+# profiler.sh talks to it from the shell (socat, or bash's /dev/tcp for a
+# TCP port) so bracketing a job does not start a Python interpreter.
+#
+# Usage as a client: python3 daemon.py ADDRESS COMMAND [ARGUMENT]
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import json
+import os
+import selectors
+import signal
+import socket
+import sys
+import scheduler
+
+READ_SIZE=4096
+# a client sending more than this without a newline is disconnected
+MAX_LINE=4096
+
+def is_unix_address(address):
+    return "/" in address or ":" not in address
+
+def create_server(address):
+    """create_server(address)
+
+    The method returns a listening, non-blocking socket on the path of a
+    Unix socket or on a HOST:PORT pair
+    """
+    if is_unix_address(address):
+        if os.path.exists(address):
+            os.remove(address)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(address)
+    else:
+        host, _separator, port = address.rpartition(":")
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host or "127.0.0.1", int(port)))
+    server.listen()
+    server.setblocking(False)
+    return server
+
+def create_client(address):
+    if is_unix_address(address):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(address)
+    else:
+        host, _separator, port = address.rpartition(":")
+        client = socket.create_connection((host or "127.0.0.1", int(port)))
+    return client
+
+class SamplerDaemon:
+    """SamplerDaemon(address, sample, [interval], [policy], [dump], [enforce])
+
+    The class serves the control channel on a Unix socket path or a
+    HOST:PORT pair and calls sample(jitter, missed,
+    interval) for every requested sample, sample() returns the profiling
+    time of that sample and dump() the file the last samples were written to.
+    enforce(series) is called after every sample of the time series
+    """
+
+    def __init__(self, address, sample, interval=0, policy=scheduler.STRICT, dump=None, enforce=None):
+        self.address = address
+        self.sample = sample
+        self.dump = dump
+        self.enforce = enforce
+        self.interval = interval
+        self.policy = policy
+        self.series = None
+        self.running = False
+        self.samples = 0
+        self.startup_latency = None
+        self.last_series = None
+        self.pending_signals = []
+        # the bytes received from every connected client not yet ending a line
+        self.clients = {}
+
+    def take_sample(self, jitter=0, missed=0, interval=0):
+        """take_sample([jitter], [missed], [interval])
+
+        The method takes one sample and measures the startup-to-first-sample
+        latency on the first call
+        """
+        profiling_time = self.sample(jitter, missed, interval)
+        self.samples += 1
+        if self.startup_latency is None:
+            self.startup_latency = get_startup_latency()
+            print("startup-to-first-sample latency: {} seconds".format(self.startup_latency), flush=True)
+        return profiling_time
+
+    def start_series(self, interval=None):
+        if interval is None:
+            interval = self.interval
+        if interval <= 0:
+            raise ValueError("the time series interval must be positive")
+        self.interval = interval
+        self.series = scheduler.Scheduler(interval, self.policy)
+        self.take_sample(*self.series.wait(), self.series.last_interval_ns)
+
+    def stop_series(self):
+        if self.series is not None:
+            self.last_series = self.series.summary()
+            self.series = None
+            self.take_sample()
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "series": self.series is not None,
+            "interval": self.interval,
+            "samples": self.samples,
+            "startup_latency": self.startup_latency,
+            "schedule": self.series.summary() if self.series is not None else self.last_series,
+        }
+
+    def handle_command(self, line):
+        """handle_command(line)
+
+        The method runs one control command and returns the reply line
+        """
+        words = line.split()
+        if len(words) == 0:
+            return "error empty command"
+        command = words[0]
+        try:
+            if command == "sample":
+                return "ok {}".format(self.take_sample())
+            elif command == "start":
+                self.start_series(int(words[1]) if len(words) > 1 else None)
+                return "ok"
+            elif command == "stop":
+                self.stop_series()
+                return "ok"
+            elif command == "status":
+                return "ok {}".format(json.dumps(self.status()))
+            elif command == "dump":
+                if self.dump is None:
+                    return "error the sample ring is disabled"
+                return "ok {}".format(self.dump())
+            elif command == "quit":
+                self.running = False
+                return "ok"
+        except ValueError:
+            return "error invalid argument '{}'".format(" ".join(words[1:]))
+        except OSError as error:
+            return "error {}".format(error)
+        return "error unknown command '{}'".format(command)
+
+    def handle_signal(self, signum, _frame):
+        self.pending_signals.append(signum)
+
+    def process_signals(self):
+        while self.pending_signals:
+            signum = self.pending_signals.pop(0)
+            if signum == signal.SIGUSR1:
+                self.take_sample()
+            elif signum == signal.SIGQUIT:
+                if self.dump is not None:
+                    print("dumped the last samples to {}".format(self.dump()), flush=True)
+            elif signum == signal.SIGUSR2:
+                if self.series is not None:
+                    self.stop_series()
+                elif self.interval > 0:
+                    self.start_series()
+            else:
+                self.running = False
+
+    def serve(self):
+        """serve()
+
+        The method takes the first sample, then listens on the control
+        socket until the quit command or a termination signal arrives. The
+        clients are served by the same selector as the time series, a slow
+        or idle client never holds a sample back
+        """
+        server = create_server(self.address)
+
+        # wake up the selector when a signal arrives
+        wakeup_reader, wakeup_writer = socket.socketpair()
+        wakeup_reader.setblocking(False)
+        wakeup_writer.setblocking(False)
+        signal.set_wakeup_fd(wakeup_writer.fileno(), warn_on_full_buffer=False)
+        for signum in [signal.SIGUSR1, signal.SIGUSR2, signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGQUIT]:
+            signal.signal(signum, self.handle_signal)
+
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ)
+        selector.register(wakeup_reader, selectors.EVENT_READ)
+
+        self.running = True
+        self.take_sample()
+        try:
+            while self.running:
+                timeout = None
+                if self.series is not None:
+                    timeout = max(0, self.series.remaining())
+                for key, _events in selector.select(timeout):
+                    if key.fileobj is server:
+                        self.accept_client(server, selector)
+                    elif key.fileobj in self.clients:
+                        self.read_client(key.fileobj, selector)
+                    else:
+                        try:
+                            wakeup_reader.recv(4096)
+                        except BlockingIOError:
+                            pass
+                self.process_signals()
+                if self.series is not None and self.series.remaining() <= 0:
+                    self.take_sample(*self.series.wait(), self.series.last_interval_ns)
+                    if self.enforce is not None:
+                        self.enforce(self.series)
+        finally:
+            signal.set_wakeup_fd(-1)
+            for connection in list(self.clients):
+                self.close_client(connection, selector)
+            selector.close()
+            server.close()
+            wakeup_reader.close()
+            wakeup_writer.close()
+            if is_unix_address(self.address) and os.path.exists(self.address):
+                os.remove(self.address)
+
+    def accept_client(self, server, selector):
+        try:
+            connection, _address = server.accept()
+        except BlockingIOError:
+            return
+        connection.setblocking(False)
+        self.clients[connection] = b""
+        selector.register(connection, selectors.EVENT_READ)
+
+    def close_client(self, connection, selector):
+        selector.unregister(connection)
+        del self.clients[connection]
+        connection.close()
+
+    def read_client(self, connection, selector):
+        """read_client(connection, selector)
+
+        The method reads what the client sent without blocking and answers
+        every complete command line, the connection is closed when the
+        client closes it, sends an overlong line or the daemon quits
+        """
+        try:
+            data = connection.recv(READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        buffer = self.clients[connection] + data
+        lines = buffer.split(b"\n")
+        # a command without newline is taken when the client closes the connection
+        buffer = lines.pop() if data else b""
+        if not data and lines[-1:] == [b""]:
+            lines.pop()
+        try:
+            for line in lines:
+                # a reply line is a few hundred bytes, it fits the socket buffer
+                connection.sendall((self.handle_command(line.decode("utf-8", "replace")) + "\n").encode("utf-8"))
+                if not self.running:
+                    break
+        except OSError:
+            data = b""
+        if not data or not self.running or len(buffer) > MAX_LINE:
+            self.close_client(connection, selector)
+        else:
+            self.clients[connection] = buffer
+
+def get_startup_latency():
+    """get_startup_latency()
+
+    The method returns the seconds elapsed since this process was created,
+    based on the start time field of /proc/self/stat
+    """
+    try:
+        with open("/proc/self/stat", "r") as file_pointer:
+            stat = file_pointer.read()
+        with open("/proc/uptime", "r") as file_pointer:
+            uptime = float(file_pointer.read().split()[0])
+    except OSError:
+        return None
+    start_ticks = int(stat[stat.rindex(')') + 2:].split()[19])
+    return round(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 3)
+
+def send_command(address, command):
+    """send_command(address, command)
+
+    The method sends one command to the sampler daemon and returns its reply
+    """
+    with create_client(address) as client:
+        client.sendall((command + "\n").encode("utf-8"))
+        reply = b""
+        while not reply.endswith(b"\n"):
+            data = client.recv(4096)
+            if not data:
+                break
+            reply += data
+    return reply.decode("utf-8").strip()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: {} ADDRESS sample|start [ms]|stop|status|dump|quit".format(sys.argv[0]))
+        sys.exit(1)
+    reply = send_command(sys.argv[1], " ".join(sys.argv[2:]))
+    print(reply)
+    if not reply.startswith("ok"):
+        sys.exit(1)
@@ -0,0 +1,153 @@
+# --------------------------------------------------------------------------
+# The module reduces long time series to about as many points as the plot
+# has pixels before they are drawn. The min/max method keeps the lowest
+# and the highest point of every pixel column so no spike disappears, the
+# lttb method (largest triangle three buckets) keeps the points shaping
+# the curve the most. Both graph generators use it, and the reduced series
+# are cached per report file, metric and resolution. A new version of the
+# report replaces the cached series of the older one.
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import hashlib
+import os
+import numpy as np
+
+MINMAX='minmax'
+LTTB='lttb'
+METHODS=[MINMAX, LTTB]
+
+CACHE_DIR_NAME='.downsample_cache'
+
+def minmax(x, y, width):
+    """minmax(x, y, width)
+
+    The method splits the series in width buckets and keeps the minimum
+    and the maximum of every bucket in their original order
+    """
+    count = len(x)
+    if count <= 2 * width:
+        return x, y
+    edges = np.linspace(0, count, width + 1).astype(np.int64)
+    indices = np.empty(2 * width, dtype=np.int64)
+    for bucket in range(width):
+        start, end = edges[bucket], edges[bucket + 1]
+        low = start + np.argmin(y[start:end])
+        high = start + np.argmax(y[start:end])
+        indices[2 * bucket] = min(low, high)
+        indices[2 * bucket + 1] = max(low, high)
+    return x[indices], y[indices]
+
+def lttb(x, y, width):
+    """lttb(x, y, width)
+
+    The method keeps the first and the last point and, in each of the
+    width - 2 buckets between them, the point forming the largest triangle
+    with the point kept in the previous bucket and the mean of the next
+    """
+    count = len(x)
+    if count <= width or width < 3:
+        return x, y
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    every = (count - 2) / (width - 2)
+    indices = np.empty(width, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = count - 1
+    selected = 0
+    for bucket in range(width - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, count)
+        if end >= next_end:
+            mean_x, mean_y = x[-1], y[-1]
+        else:
+            mean_x, mean_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs((x[selected] - mean_x) * (y[start:end] - y[selected])
+                       - (x[selected] - x[start:end]) * (mean_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+    return x[indices], y[indices]
+
+def downsample(x, y, width, method=MINMAX):
+    """downsample(x, y, width, [method])
+
+    The method returns the series reduced for a plot of width pixels, the
+    missing values are left out
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    present = ~np.isnan(y)
+    x, y = x[present], y[present]
+    if method == LTTB:
+        return lttb(x, y, width)
+    if method == MINMAX:
+        return minmax(x, y, width)
+    raise ValueError("unknown downsampling method '{}'".format(method))
+
+def get_hash(key):
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def get_cache_path(report_file, x_name, metric, width, method):
+    """get_cache_path(report_file, x_name, metric, width, method)
+
+    The method returns the cache file of a reduced series, named
+    <series>.<version>.npz: the series hashes the report path, metric,
+    width and method, the version the size and the modification time of
+    the report so a new report never reads the series of an older one
+    """
+    stat = os.stat(report_file)
+    series_key = "{}|{}|{}|{}|{}".format(os.path.abspath(report_file), x_name, metric, width, method)
+    version_key = "{}|{}".format(stat.st_size, stat.st_mtime_ns)
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(report_file)), CACHE_DIR_NAME)
+    return os.path.join(cache_dir, "{}.{}.npz".format(get_hash(series_key), get_hash(version_key)[:16]))
+
+def remove_stale(cache_path):
+    """remove_stale(cache_path)
+
+    The method deletes the cached versions of the same series made from
+    older versions of the report, the temporary files of other writers
+    are left alone
+    """
+    cache_dir, name = os.path.split(cache_path)
+    series = name.split(".")[0]
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return
+    for other in names:
+        parts = other.split(".")
+        if len(parts) == 3 and parts[0] == series and other != name:
+            try:
+                os.remove(os.path.join(cache_dir, other))
+            except OSError:
+                pass
+
+def cached_downsample(report_file, x_name, metric, x, y, width, method=MINMAX):
+    """cached_downsample(report_file, x_name, metric, x, y, width, [method])
+
+    The method returns the reduced series of a metric of the report file
+    from the cache, and reduces and caches it on the first call
+    """
+    try:
+        cache_path = get_cache_path(report_file, x_name, metric, width, method)
+    except OSError:
+        return downsample(x, y, width, method)
+    try:
+        with np.load(cache_path) as cached:
+            return cached["x"], cached["y"]
+    except (OSError, KeyError, ValueError):
+        pass
+    x, y = downsample(x, y, width, method)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # write under a temporary name, parallel renderers may share the cache
+        temp_path = "{}.{}.npz".format(cache_path[:-4], os.getpid())
+        np.savez(temp_path, x=x, y=y)
+        os.replace(temp_path, cache_path)
+        remove_stale(cache_path)
+    except OSError:
+        pass
+    return x, y
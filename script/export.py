@@ -0,0 +1,398 @@
+# --------------------------------------------------------------------------
+# The module exports the delta values of a run to column oriented files.
+# The delta records are streamed to one buffered CSV writer, which writes
+# the same lines the csv tool of profiler.sh wrote with one jq call per
+# delta file, and to Parquet and Feather files when pyarrow is installed.
+# The process list of every sample is exported as a separate long table
+# with one row per sample time and process id.
+#
+# The delta rows get the per-second rate of every counter and the CPU
+# utilization of the CPU times in percent of cNumProcessors, unless the
+# rates are left out to write the exact lines of the former csv tool. The
+# per-CPU, per-disk and per-interface vectors of the deltas are exported
+# as a long table of their own.
+#
+# Usage: python3 export.py -i INPUT_DIR [-o delta.csv] [-p process.csv]
+#                          [-b breakdown.csv] [-f csv,parquet,feather] [-n]
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import aggregate
+import breakdown
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CSV='csv'
+PARQUET='parquet'
+FEATHER='feather'
+EXPORT_FORMATS=[CSV, PARQUET, FEATHER]
+
+DELTA_FILE_PATTERN='delta_????_??_??_??_??_??*.*json'
+SAMPLE_TIME_KEY='currentTime'
+PROCESS_ID_KEY='pId'
+PROCESS_LIST_KEY='pProcesses'
+
+BUFFER_SIZE=1024*1024
+BATCH_SIZE=10000   # rows of a parquet row group and of a feather record batch
+
+def jq_raw(value):
+    """jq_raw(value)
+
+    The method returns a value the way jq -r prints it
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    if isinstance(value, (int, float)):
+        return aggregate.jq_number(value)
+    return json.dumps(value, indent=2, ensure_ascii=False)
+
+def csv_value(value):
+    """csv_value(value)
+
+    The method returns a value the way the @csv filter of jq writes it,
+    except for the integers, which are written exactly instead of rounded
+    to a double so that the nanosecond sample times stay a join key
+    """
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return ""
+    if isinstance(value, int):
+        return str(value)
+    return aggregate.jq_number(value)
+
+def read_static(input_dir):
+    """read_static(input_dir)
+
+    The method returns the fields and values of static.json in the order
+    the csv tool lists them, keys sorted and objects inlined, or two empty
+    lists when the file does not exist
+    """
+    try:
+        with open(os.path.join(input_dir, "static.json"), 'r') as infile:
+            record = json.load(infile)
+    except (OSError, ValueError):
+        print("could not find static file (static.json) in {}".format(input_dir), file=sys.stderr)
+        return [], []
+
+    fields = []
+    values = []
+    def add(record):
+        for key in sorted(record):
+            if isinstance(record[key], dict):
+                add(record[key])
+            else:
+                fields.append(key)
+                values.append(record[key])
+    add(record)
+    return fields, values
+
+def read_deltas(input_dir):
+    """read_deltas(input_dir)
+
+    The method yields the delta records of the input directory in the
+    order of their file names, the records of an ndjson delta file in
+    the order of its lines
+    """
+    for path in sorted(glob.glob(os.path.join(input_dir, DELTA_FILE_PATTERN))):
+        with open(path, 'r') as infile:
+            if path.endswith(".ndjson"):
+                for line in infile:
+                    if line.strip():
+                        yield aggregate.parse_delta(line)
+            else:
+                yield aggregate.parse_delta(infile.read())
+
+def read_samples(input_dir):
+    """read_samples(input_dir)
+
+    The method yields the samples of the input directory, the sample files
+    in the order of their names followed by the records of the ndjson and
+    binary run files
+    """
+    for path in sorted(glob.glob(os.path.join(input_dir, aggregate.PROFILING_FILE_PATTERN))):
+        for _path, record in aggregate.load_samples([path]):
+            yield record
+    for path in aggregate.find_run_files(input_dir):
+        for record in aggregate.load_run(path):
+            yield record
+
+def read_process_rows(input_dir):
+    """read_process_rows(input_dir)
+
+    The method yields one row per process of every sample of the input
+    directory, keyed by the sample time and the process id
+    """
+    for record in read_samples(input_dir):
+        for process in record.get(PROCESS_LIST_KEY, []):
+            row = {SAMPLE_TIME_KEY: record.get(SAMPLE_TIME_KEY)}
+            row.update(process)
+            yield row
+
+def strip_breakdowns(deltas):
+    """strip_breakdowns(deltas)
+
+    The method yields the delta records without their breakdown vectors,
+    which are exported as a separate table
+    """
+    for delta in deltas:
+        for key in [key for key, value in delta.items() if breakdown.is_breakdown(value)]:
+            del delta[key]
+        yield delta
+
+def read_breakdown_rows(input_dir):
+    """read_breakdown_rows(input_dir)
+
+    The method yields one row per delta record, breakdown, name and
+    counter of the input directory, the interval is the position of the
+    delta record in the delta table
+    """
+    for interval, delta in enumerate(read_deltas(input_dir)):
+        yield from breakdown.get_rows(delta, interval)
+
+class CsvWriter:
+    """CsvWriter(path, [prefix_fields], [prefix_values])
+
+    The class writes the rows with one buffered file, the columns are the
+    prefix fields followed by the keys of the first row, sorted like the
+    keys of jq when sort_keys is set, and then the keys first seen in a
+    later row. The lines are spooled to a temporary file and copied below
+    the header on close, the lines written before a key was seen get an
+    empty value for it
+    """
+
+    def __init__(self, path, prefix_fields=[], prefix_values=[], sort_keys=True):
+        self.path = path
+        self.file = tempfile.TemporaryFile('w+', buffering=BUFFER_SIZE)
+        self.prefix_fields = "".join(field + "," for field in prefix_fields)
+        self.prefix_values = "".join(jq_raw(value) + "," for value in prefix_values)
+        self.sort_keys = sort_keys
+        self.fields = None
+        self.known_fields = set()
+        # the number of lines written with every number of columns, in order
+        self.segments = []
+
+    def add_fields(self, fields):
+        fields = [field for field in fields if field not in self.known_fields]
+        self.fields.extend(sorted(fields) if self.sort_keys else fields)
+        self.known_fields.update(fields)
+
+    def write(self, row):
+        if self.fields is None:
+            self.fields = []
+            self.add_fields(row)
+        elif not self.known_fields.issuperset(row):
+            self.add_fields(row)
+        if not self.segments or self.segments[-1][1] != len(self.fields):
+            self.segments.append([0, len(self.fields)])
+        self.segments[-1][0] += 1
+        self.file.write(self.prefix_values + ",".join(csv_value(row.get(field)) for field in self.fields) + "\n")
+
+    def close(self):
+        self.file.seek(0)
+        with open(self.path, 'w', buffering=BUFFER_SIZE) as outfile:
+            outfile.write(self.prefix_fields + ",".join(self.fields or []) + "\n")
+            if len(self.segments) == 1:
+                shutil.copyfileobj(self.file, outfile, BUFFER_SIZE)
+            else:
+                for lines, columns in self.segments:
+                    copy_lines(self.file, outfile, lines, "," * (len(self.fields) - columns))
+        self.file.close()
+
+def copy_lines(infile, outfile, lines, padding):
+    """copy_lines(infile, outfile, lines, padding)
+
+    The method copies as many CSV lines with the padding appended, a
+    quoted value holding a line break is kept on its line
+    """
+    for _ in range(lines):
+        line = infile.readline()
+        while line.count('"') % 2:
+            line += infile.readline()
+        outfile.write(line[:-1] + padding + "\n")
+
+class ArrowWriter:
+    """ArrowWriter(path, export_format, [prefix_fields], [prefix_values], [integer_fields])
+
+    The class writes the rows to a Parquet or a Feather file in batches of
+    BATCH_SIZE rows, so a run is never held in memory as a whole. Numbers
+    are stored as doubles except for the integer fields, the schema is
+    taken from the keys of the first batch and a key first seen in a
+    later batch is left out with a warning
+    """
+
+    def __init__(self, path, export_format, prefix_fields=[], prefix_values=[], integer_fields=[]):
+        self.path = path
+        self.export_format = export_format
+        self.prefix = list(zip(prefix_fields, prefix_values))
+        self.integer_fields = set(integer_fields)
+        self.rows = []
+        self.schema = None
+        self.writer = None
+        self.dropped_fields = set()
+
+    def column_type(self, field, values):
+        if field in self.integer_fields:
+            return pyarrow.int64()
+        kinds = set(type(value) for value in values if value is not None)
+        if kinds and kinds <= set([int, float]):
+            return pyarrow.float64()
+        if kinds == set([bool]):
+            return pyarrow.bool_()
+        return pyarrow.string()
+
+    def write_batch(self):
+        if self.schema is None:
+            fields = list(dict.fromkeys(field for row in self.rows for field in row))
+        else:
+            fields = self.schema.names[len(self.prefix):]
+            dropped = set(field for row in self.rows for field in row) - set(fields) - self.dropped_fields
+            if dropped:
+                print("{}: leaving out the columns missing from the first {} rows: {}".format(self.path, BATCH_SIZE, ", ".join(sorted(dropped))), file=sys.stderr)
+                self.dropped_fields.update(dropped)
+        columns = dict((field, [row.get(field) for row in self.rows]) for field in fields)
+        if self.schema is None:
+            schema_fields = [(field, self.column_type(field, [value])) for field, value in self.prefix]
+            schema_fields += [(field, self.column_type(field, columns[field])) for field in fields]
+            self.schema = pyarrow.schema(schema_fields)
+            if self.export_format == PARQUET:
+                self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+            else:
+                self.writer = pyarrow.ipc.new_file(self.path, self.schema)
+        arrays = [to_array([value] * len(self.rows), data_type) for (_field, value), data_type in zip(self.prefix, self.schema.types)]
+        for field, data_type in zip(fields, self.schema.types[len(self.prefix):]):
+            arrays.append(to_array(columns[field], data_type))
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= BATCH_SIZE:
+            self.write_batch()
+
+    def close(self):
+        if self.rows:
+            self.write_batch()
+        if self.writer is not None:
+            self.writer.close()
+
+def to_array(values, data_type):
+    if data_type == pyarrow.string():
+        values = [None if value is None else jq_raw(value) for value in values]
+    return pyarrow.array(values, type=data_type)
+
+def create_writers(path, export_formats, prefix_fields=[], prefix_values=[], sort_keys=True, integer_fields=[]):
+    """create_writers(path, export_formats, ...)
+
+    The method returns one writer per export format, the Parquet and the
+    Feather files are named after the CSV file
+    """
+    writers = []
+    base_path = os.path.splitext(path)[0]
+    for export_format in export_formats:
+        if export_format == CSV:
+            writers.append(CsvWriter(path, prefix_fields, prefix_values, sort_keys))
+        elif pyarrow is None:
+            print("pyarrow is not installed, skipping the {} export".format(export_format), file=sys.stderr)
+        else:
+            writers.append(ArrowWriter(base_path + "." + export_format, export_format, prefix_fields, prefix_values, integer_fields))
+    return writers
+
+def export_rows(rows, writers):
+    """export_rows(rows, writers)
+
+    The method streams the rows to all the writers and returns the number
+    of rows written
+    """
+    count = 0
+    try:
+        for row in rows:
+            for writer in writers:
+                writer.write(row)
+            count += 1
+    finally:
+        for writer in writers:
+            writer.close()
+    return count
+
+def add_rates(deltas, processors=None):
+    """add_rates(deltas, [processors])
+
+    The method yields the delta records with their per-second rates and
+    CPU utilizations appended
+    """
+    for delta in deltas:
+        delta.update(aggregate.compute_rates(delta, processors))
+        yield delta
+
+def export_directory(input_dir, csv_file, process_file=None, export_formats=[CSV], rates=True, breakdown_file=None):
+    """export_directory(input_dir, csv_file, [process_file], [export_formats], [rates], [breakdown_file])
+
+    The method exports the delta records with the static fields and, when
+    a process file is given, the process table. The rates are normalized
+    by the cNumProcessors of static.json. The breakdown vectors of the
+    deltas go to the breakdown file when one is given. It returns the
+    number of delta rows, process rows and breakdown rows
+    """
+    deltas = strip_breakdowns(read_deltas(input_dir))
+    static_fields, static_values = read_static(input_dir)
+    if rates:
+        deltas = add_rates(deltas, dict(zip(static_fields, static_values)).get("cNumProcessors"))
+    first = next(deltas, None)
+    if first is None:
+        raise ValueError("could not find any delta files in {}".format(input_dir))
+    writers = create_writers(csv_file, export_formats, static_fields, static_values)
+    delta_rows = export_rows(itertools.chain([first], deltas), writers)
+
+    process_rows = 0
+    if process_file is not None:
+        writers = create_writers(process_file, export_formats, sort_keys=False, integer_fields=[SAMPLE_TIME_KEY, PROCESS_ID_KEY])
+        process_rows = export_rows(read_process_rows(input_dir), writers)
+
+    breakdown_rows = 0
+    if breakdown_file is not None:
+        writers = create_writers(breakdown_file, export_formats, sort_keys=False, integer_fields=["interval"])
+        breakdown_rows = export_rows(read_breakdown_rows(input_dir), writers)
+    return delta_rows, process_rows, breakdown_rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export the delta values and the process table of a run.')
+    parser.add_argument("-i", "--input-directory", action="store", default=".", help='directory of the delta files, static.json and the profiling files (default is the current directory)')
+    parser.add_argument("-o", "--csv-output-file", action="store", default="delta.csv", help='CSV file of the delta values, the Parquet and Feather files take its name (default is delta.csv)')
+    parser.add_argument("-p", "--process-output-file", action="store", help='CSV file of the process table, one row per sample and process')
+    parser.add_argument("-f", "--export-formats", action="store", default=CSV, help='comma separated formats among {} (default is csv)'.format(", ".join(EXPORT_FORMATS)))
+    parser.add_argument("-b", "--breakdown-output-file", action="store", help='CSV file of the per-CPU, per-disk and per-interface deltas, one row per interval, name and counter')
+    parser.add_argument("-n", "--no-rates", action="store_true", default=False, help='leave out the per-second rate and CPU utilization columns, the columns of the former csv tool')
+    args = parser.parse_args()
+
+    export_formats = args.export_formats.split(",")
+    for export_format in export_formats:
+        if export_format not in EXPORT_FORMATS:
+            parser.error("unknown export format '{}'".format(export_format))
+    try:
+        delta_rows, process_rows, breakdown_rows = export_directory(args.input_directory, args.csv_output_file, args.process_output_file, export_formats, not args.no_rates, args.breakdown_output_file)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+    print("exported {} delta rows, {} process rows and {} breakdown rows".format(delta_rows, process_rows, breakdown_rows))
@@ -0,0 +1,239 @@
+# --------------------------------------------------------------------------
+# The module writes a synthetic host below a directory: the procfs files
+# (stat, vmstat, meminfo, net/dev, diskstats, cpuinfo, the sys/kernel files
+# and the stat, status and cmdline of every process), the sysfs CPU, cache,
+# NUMA and block device files, and a cgroup v1 or v2 hierarchy holding all
+# the processes.
+# The readers of procfs.py and cgroup.py take the tree for a host when
+# procfs.PROC_DIR and procfs.SYS_DIR point below it, so the cost of a
+# sample can be measured offline for any number of processes and CPUs.
+#
+# The counters grow with the step of the tree, writing the tree again with
+# the next step turns it into the next sample of the same host. With
+# --samples the trees of consecutive steps are written below numbered
+# directories, the layout rudataall.py --replay reads.
+#
+#   ROOT/proc/...  ROOT/sys/...  ROOT/sys/fs/cgroup/...  ROOT/etc/hostname
+#   ROOT/000000/proc/...  ROOT/000001/proc/...                (--samples)
+#
+# Usage: python3 fakeroot.py ROOT_DIR [-p PIDS] [-n CPUS] [-g v1|v2] [--step STEP]
+#                            [-s SAMPLES]
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import argparse
+import os
+import random
+import cgroup
+import replay
+
+PIDS=100
+CPUS=4
+DISKS=["vda"]
+INTERFACES=["lo", "eth0"]
+THREADS_PER_CORE=2
+BOOT_ID="00000000-0000-4000-8000-000000000000"
+BOOT_TIME=1634567890
+HOSTNAME="fakeroot"
+KERNEL_RELEASE="5.15.0-fakeroot"
+KERNEL_VERSION="#1 SMP Mon Oct 18 00:00:00 UTC 2021"
+COMMANDS=[
+    ["/usr/bin/python3", "worker.py", "--queue", "default"],
+    ["/usr/sbin/nginx", "-g", "daemon off;"],
+    ["/usr/lib/jvm/java-17/bin/java", "-Xmx2g", "-jar", "service.jar"],
+    ["/bin/bash", "-c", "sleep 3600"],
+    ["/usr/local/bin/a-process-with-a-long-name", "--verbose"],
+]
+# the cache levels of every CPU: index, level, type, size and the CPUs sharing it
+CACHES=[(0, 1, "Data", "32K", 1), (1, 1, "Instruction", "32K", 1), (2, 2, "Unified", "1024K", 1), (3, 3, "Unified", "32768K", 0)]
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as outfile:
+        outfile.write(content)
+
+def get_pids(pids):
+    # the first process is the init process, the profiled tree hangs below it
+    return list(range(1, pids + 1))
+
+def get_counter(rate, step, offset=0):
+    return offset + rate * step
+
+def write_proc_stat(proc_dir, cpus, pids, step):
+    lines = []
+    totals = [0] * 10
+    for cpu in range(cpus):
+        times = [get_counter(rate, step, 100 * rate * (cpu + 1)) for rate in [40, 1, 15, 40, 2, 0, 2, 0, 0, 0]]
+        totals = [total + value for total, value in zip(totals, times)]
+        lines.append("cpu{} {}".format(cpu, " ".join(str(value) for value in times)))
+    lines.insert(0, "cpu  {}".format(" ".join(str(value) for value in totals)))
+    lines += [
+        "intr {} 0 0".format(get_counter(5000, step, 100000)),
+        "ctxt {}".format(get_counter(8000, step, 200000)),
+        "btime {}".format(BOOT_TIME),
+        "processes {}".format(pids + step),
+        "procs_running 2",
+        "procs_blocked 0",
+        "softirq {} 0 0".format(get_counter(3000, step, 50000)),
+    ]
+    write_file(os.path.join(proc_dir, "stat"), "\n".join(lines) + "\n")
+
+def write_proc_files(proc_dir, cpus, step):
+    write_file(os.path.join(proc_dir, "vmstat"), "".join("{} {}\n".format(key, get_counter(rate, step, 1000)) for key, rate in [
+        ("nr_free_pages", 0), ("pgpgin", 40), ("pgpgout", 80), ("pswpin", 0), ("pswpout", 0),
+        ("pgfault", 2500), ("pgmajfault", 3)]))
+    write_file(os.path.join(proc_dir, "meminfo"), "".join("{:<16}{:>12} kB\n".format(key + ":", value) for key, value in [
+        ("MemTotal", 16384000), ("MemFree", 8192000 - step % 1000), ("MemAvailable", 12288000), ("Buffers", 256000),
+        ("Cached", 2048000), ("SwapCached", 0), ("Active", 4096000), ("Inactive", 2048000), ("SwapTotal", 0),
+        ("SwapFree", 0), ("Shmem", 64000), ("Slab", 256000), ("SReclaimable", 128000)]))
+
+    lines = ["Inter-|   Receive                                                |  Transmit",
+             " face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed"]
+    for index, interface in enumerate(INTERFACES):
+        received = [get_counter(rate * (index + 1), step) for rate in [150000, 120, 0, 0, 0, 0, 0, 0]]
+        sent = [get_counter(rate * (index + 1), step) for rate in [90000, 80, 0, 0, 0, 0, 0, 0]]
+        lines.append("{:>6}: {}".format(interface, " ".join(str(value) for value in received + sent)))
+    write_file(os.path.join(proc_dir, "net", "dev"), "\n".join(lines) + "\n")
+
+    lines = []
+    for index, disk in enumerate(DISKS):
+        counters = [get_counter(rate, step, 1000) for rate in [20, 1, 320, 15, 40, 5, 640, 30, 0, 45, 60, 0, 0, 0, 0, 0, 0]]
+        counters[8] = 0     # requests in flight
+        lines.append("{:>4} {:>7} {} {}".format(253, 16 * index, disk, " ".join(str(value) for value in counters)))
+        lines.append("{:>4} {:>7} {}1 {}".format(253, 16 * index + 1, disk, " ".join(str(value // 2) for value in counters)))
+    write_file(os.path.join(proc_dir, "diskstats"), "\n".join(lines) + "\n")
+
+    write_file(os.path.join(proc_dir, "cpuinfo"), "".join(
+        "processor\t: {}\nmodel name\t: Synthetic CPU @ 2.10GHz\ncpu MHz\t\t: 2100.000\n\n".format(cpu) for cpu in range(cpus)))
+    write_file(os.path.join(proc_dir, "loadavg"), "0.50 0.40 0.30 2/{} {}\n".format(100, 1000 + step))
+    write_file(os.path.join(proc_dir, "sys", "kernel", "random", "boot_id"), BOOT_ID + "\n")
+    for name, value in [("ostype", "Linux"), ("hostname", HOSTNAME), ("osrelease", KERNEL_RELEASE), ("version", KERNEL_VERSION), ("arch", "x86_64")]:
+        write_file(os.path.join(proc_dir, "sys", "kernel", name), value + "\n")
+
+def write_process(proc_dir, pid, parent, command, step, seed):
+    process_dir = os.path.join(proc_dir, str(pid))
+    name = os.path.basename(command[0])[:15]
+    rate = 1 + (pid * 7 + seed) % 5
+    fields = ["S", parent, pid, pid, 0, -1, 4194304,
+              get_counter(rate * 10, step, pid), 0, get_counter(rate // 3, step), 0,
+              get_counter(rate, step, pid), get_counter(rate // 2, step), 0, 0, 20, 0,
+              1 + pid % 8, 0, 100 + pid, 104857600 + pid * 4096, 2560 + pid % 1000]
+    fields += [0] * (52 - 2 - len(fields))
+    fields[39] = get_counter(rate // 4, step)
+    write_file(os.path.join(process_dir, "stat"), "{} ({}) {}\n".format(pid, name, " ".join(str(field) for field in fields)))
+    write_file(os.path.join(process_dir, "status"), "".join("{}:\t{}\n".format(key, value) for key, value in [
+        ("Name", name), ("State", "S (sleeping)"), ("Pid", pid), ("PPid", parent), ("Threads", 1 + pid % 8),
+        ("VmRSS", "{} kB".format((2560 + pid % 1000) * 4)),
+        ("voluntary_ctxt_switches", get_counter(rate * 5, step)),
+        ("nonvoluntary_ctxt_switches", get_counter(rate, step))]))
+    write_file(os.path.join(process_dir, "cmdline"), "\0".join(command) + "\0")
+
+def write_processes(proc_dir, pids, step, seed):
+    generator = random.Random(seed)
+    children = {}
+    for pid in get_pids(pids):
+        parent = 0 if pid == 1 else generator.randint(1, pid - 1)
+        children.setdefault(parent, []).append(pid)
+        write_process(proc_dir, pid, parent, COMMANDS[pid % len(COMMANDS)], step, seed)
+    for pid in get_pids(pids):
+        write_file(os.path.join(proc_dir, str(pid), "task", str(pid), "children"), " ".join(str(child) for child in children.get(pid, [])))
+
+def write_sys_files(sys_dir, cpus):
+    cpu_dir = os.path.join(sys_dir, "devices", "system", "cpu")
+    cores = max(1, cpus // THREADS_PER_CORE)
+    for cpu in range(cpus):
+        core = cpu % cores
+        # the hardware threads of a core are numbered cores apart, as on x86
+        siblings = ",".join(str(thread) for thread in range(core, cpus, cores))
+        for index, level, kind, size, shared in CACHES:
+            index_dir = os.path.join(cpu_dir, "cpu{}".format(cpu), "cache", "index{}".format(index))
+            write_file(os.path.join(index_dir, "level"), "{}\n".format(level))
+            write_file(os.path.join(index_dir, "type"), kind + "\n")
+            write_file(os.path.join(index_dir, "size"), size + "\n")
+            write_file(os.path.join(index_dir, "shared_cpu_list"), (siblings if shared else "0-{}".format(cpus - 1)) + "\n")
+        topology_dir = os.path.join(cpu_dir, "cpu{}".format(cpu), "topology")
+        write_file(os.path.join(topology_dir, "physical_package_id"), "0\n")
+        write_file(os.path.join(topology_dir, "core_id"), "{}\n".format(core))
+        write_file(os.path.join(topology_dir, "thread_siblings_list"), siblings + "\n")
+    write_file(os.path.join(sys_dir, "devices", "system", "node", "node0", "cpulist"), "0-{}\n".format(cpus - 1))
+    for index, disk in enumerate(DISKS):
+        write_file(os.path.join(sys_dir, "block", disk, "dev"), "253:{}\n".format(16 * index))
+
+def write_cgroup(cgroup_dir, version, cpus, pids, step):
+    processes = "".join("{}\n".format(pid) for pid in get_pids(pids))
+    cpu_time = get_counter(400000, step, 10**6) * cpus
+    if version == cgroup.V2:
+        files = {
+            "cgroup.controllers": "cpuset cpu io memory pids\n",
+            "cgroup.procs": processes,
+            "cpu.stat": "usage_usec {}\nuser_usec {}\nsystem_usec {}\n".format(cpu_time, cpu_time * 3 // 4, cpu_time // 4),
+            "memory.current": "{}\n".format(get_counter(4096, step, 10**9)),
+            "memory.peak": "{}\n".format(get_counter(4096, step, 2 * 10**9)),
+            "memory.stat": "anon 100000000\nfile 50000000\npgfault {}\npgmajfault {}\n".format(get_counter(2000, step), get_counter(2, step)),
+            "io.stat": "".join("253:{} rbytes={} wbytes={} rios={} wios={} dbytes=0 dios=0\n".format(
+                16 * index, get_counter(163840, step), get_counter(327680, step), get_counter(20, step), get_counter(40, step))
+                for index in range(len(DISKS))),
+            "pids.current": "{}\n".format(pids),
+        }
+        for file_name in cgroup.PRESSURE_FILES:
+            files[file_name] = "some avg10=0.00 avg60=0.00 avg300=0.00 total={}\nfull avg10=0.00 avg60=0.00 avg300=0.00 total={}\n".format(
+                get_counter(100, step), get_counter(50, step))
+    else:
+        files = {
+            "cpuacct/cpuacct.usage": "{}\n".format(cpu_time * 1000),
+            "cpuacct/cpuacct.stat": "user {}\nsystem {}\n".format(cpu_time * 3 // 40000, cpu_time // 40000),
+            "cpuacct/cpuacct.usage_percpu": " ".join(str(cpu_time * 1000 // cpus) for _cpu in range(cpus)) + "\n",
+            "cpuacct/cgroup.procs": processes,
+            "memory/memory.stat": "cache 50000000\nrss 100000000\npgfault {}\npgmajfault {}\n".format(get_counter(2000, step), get_counter(2, step)),
+            "memory/memory.usage_in_bytes": "{}\n".format(get_counter(4096, step, 10**9)),
+            "memory/memory.max_usage_in_bytes": "{}\n".format(get_counter(4096, step, 2 * 10**9)),
+            "blkio/blkio.sectors": "".join("253:{} {}\n".format(16 * index, get_counter(960, step)) for index in range(len(DISKS))),
+            "blkio/blkio.throttle.io_service_bytes": "".join("253:{0} Read {1}\n253:{0} Write {2}\n".format(
+                16 * index, get_counter(163840, step), get_counter(327680, step)) for index in range(len(DISKS))),
+            "pids/tasks": processes,
+            "pids/cgroup.procs": processes,
+        }
+    for file_name, content in files.items():
+        write_file(os.path.join(cgroup_dir, file_name), content)
+
+def create_tree(root_dir, pids=PIDS, cpus=CPUS, cgroup_version=cgroup.V2, step=0, seed=0):
+    """create_tree(root_dir, [pids], [cpus], [cgroup_version], [step], [seed])
+
+    The method writes the synthetic host of the step below root_dir, with
+    pids processes, cpus CPUs and a cgroup v1 or v2 hierarchy, and returns
+    the proc, sys and cgroup directories. The process tree is the same for
+    the same seed
+    """
+    proc_dir = os.path.join(root_dir, "proc")
+    sys_dir = os.path.join(root_dir, "sys")
+    cgroup_dir = os.path.join(sys_dir, "fs", "cgroup")
+    write_proc_stat(proc_dir, cpus, pids, step)
+    write_proc_files(proc_dir, cpus, step)
+    write_processes(proc_dir, pids, step, seed)
+    # the sampler runs in the root cgroup of the synthetic host
+    write_file(os.path.join(proc_dir, "self", "cgroup"), "0::/\n" if cgroup_version == cgroup.V2 else
+               "4:pids:/\n3:blkio:/\n2:memory:/\n1:cpu,cpuacct:/\n")
+    write_file(os.path.join(root_dir, "etc", "hostname"), HOSTNAME + "\n")
+    write_sys_files(sys_dir, cpus)
+    write_cgroup(cgroup_dir, cgroup_version, cpus, pids, step)
+    return proc_dir, sys_dir, cgroup_dir
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='write a synthetic procfs, sysfs and cgroup tree.')
+    parser.add_argument("root_dir", action="store", help='directory the proc and sys trees are written below')
+    parser.add_argument("-p", "--pids", type=int, action="store", default=PIDS, help='number of processes (default is 100)')
+    parser.add_argument("-n", "--cpus", type=int, action="store", default=CPUS, help='number of CPUs (default is 4)')
+    parser.add_argument("-g", "--cgroup-version", action="store", choices=[cgroup.V1, cgroup.V2], default=cgroup.V2, help='cgroup hierarchy (default is v2)')
+    parser.add_argument("--step", type=int, action="store", default=0, help='sample of the synthetic host, the counters grow with it (default is 0)')
+    parser.add_argument("-s", "--samples", type=int, action="store", default=0, help='write the trees of as many steps from STEP on below numbered directories, to be replayed (default is 0, a single tree)')
+    parser.add_argument("--seed", type=int, action="store", default=0, help='seed of the process tree (default is 0)')
+    args = parser.parse_args()
+    if args.samples > 0:
+        for sample in range(args.samples):
+            create_tree(os.path.join(args.root_dir, replay.TREE_NAME.format(sample)), args.pids, args.cpus, args.cgroup_version, args.step + sample, args.seed)
+        print("wrote {} samples of {} processes and {} CPUs below {}".format(args.samples, args.pids, args.cpus, args.root_dir))
+    else:
+        proc_dir, sys_dir, cgroup_dir = create_tree(args.root_dir, args.pids, args.cpus, args.cgroup_version, args.step, args.seed)
+        print("wrote {} processes and {} CPUs to {} and {}".format(args.pids, args.cpus, proc_dir, sys_dir))
@@ -3,95 +3,89 @@ Created on Aug 25, 2021
 @author: varikmp
 '''
 
+import os
 import sys
-import matplotlib.pyplot as plt
+import time
+import multiprocessing
+import matplotlib
+# render to files only, no display is needed in the container
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
 #import plotly.graph_objects as go
 import numpy as np
 import pandas as pd
+import downsample
 from pandas.api.types import is_string_dtype
 from pandas.api.types import is_numeric_dtype
 
 config = dict()
 config['report_file'] = 'delta.csv'
 
-def plot_single(report_file, group, key, image_dir):
-    df = pd.read_csv(report_file)
-    df['TimeSteps'] = np.arange(0, len(df))
-    unit = group["unit"]
-    fields = group["metrics"]
-    
-    for field in fields:
-        metric = field[:-1]
-        metric = metric.lstrip()
-        if metric[0] == '#':
-            continue
-        if metric not in df.columns:
-            print('Could not find the metric "{}"'.format(metric))
-            continue
-        if is_numeric_dtype(df[metric]):
-            # plot the line segments
-            plt.plot(df['TimeSteps'], df[metric], label=metric)
-
-            ax = plt.gca()
-            ax.spines["top"].set_visible(False)
-            ax.spines["bottom"].set_visible(False)
-            ax.spines["left"].set_visible(False)
-            ax.spines["right"].set_visible(False)
-            ax.set_facecolor('#e5ecf6')
-            ax.xaxis.tick_bottom()
-            ax.yaxis.tick_left()
-
-            # print(metric)
-            min_val = df[metric].min()
-            max_val = df[metric].max()
-            ax.set_xlim(xmin=0, xmax=len(df)-1)
-            if min_val != max_val:
-                ax.set_ylim(ymin=df[metric].min(), ymax=df[metric].max())
-
-            plt.title(metric)
-            plt.ylabel(unit)
-            plt.xlabel('Time Steps')
-        
-            # linestyle = '-', '--', '-.', ':', 'None', ' ', '', 'solid', 'dashed', 'dashdot', 'dotted'
-            plt.grid(color = 'white', linestyle = 'solid', linewidth = 1)
-            plt.grid(True)
-            plt.savefig('{}/{}'.format(image_dir, metric), bbox_inches='tight', dpi=100, transparent=False)
-            plt.clf()
+DPI=100
+TIME_KEY='currentTime'
+ELAPSED_KEY='ElapsedTime'
 
-# plot the graph from the report file
-def plot_multiple(report_file, group, key, idx, image_dir = None, fields = None):
-    df = pd.read_csv(report_file)
-    df['TimeSteps'] = np.arange(0, len(df))
-    unit = group["unit"]
-    fields = group["metrics"]
-    
-    if fields is None:
-        fields = df.columns
+# the data frame shared by the rendering processes, and the report it was read from
+report_data = None
+report_file = None
+downsample_method = downsample.MINMAX
+
+def read_config(config_file):
+    """read_config(config_file)
+
+    The method returns the metric groups of the graph configuration file,
+    each with its unit and the names of its metrics
+    """
+    group_name = "Unknown"
+    metric_groups = {}
+    metric_groups[group_name] = {}
+    metric_groups[group_name]["unit"] = "Unspecified"
+    metric_groups[group_name]["metrics"] = []
+    with open(config_file, 'r') as infile:
+        for line in infile:
+            line = line.rstrip("\r\n")
+            if line.startswith("###"):
+                data = line[3:].split(",")
+                group_name = data[0]
+                metric_groups[group_name] = {}
+                if len(data) > 1:
+                    metric_groups[group_name]["unit"] = data[1]
+                else:
+                    metric_groups[group_name]["unit"] = "Unspecified"
+                metric_groups[group_name]["metrics"] = []
+            elif line.startswith("#"):
+                continue
+            else:
+                metric = line.strip()
+                if len(metric) > 0 and metric[0] != '#':
+                    metric_groups[group_name]["metrics"].append(metric)
+    metric_groups.pop("Unknown", None)
+    return metric_groups
+
+def load_report(report_file, metric_groups):
+    """load_report(report_file, metric_groups)
+
+    The method parses the report file once, keeping only the columns of
+    the metrics referenced by the configuration. The rows are placed at
+    the seconds elapsed since the first sample, the sum of the currentTime
+    deltas, or at their index when the report has no currentTime
+    """
+    metrics = set([TIME_KEY])
+    for group in metric_groups.values():
+        metrics.update(group["metrics"])
+    df = pd.read_csv(report_file, usecols=lambda column: column in metrics)
+    if TIME_KEY in df.columns and is_numeric_dtype(df[TIME_KEY]):
+        df[ELAPSED_KEY] = df[TIME_KEY].fillna(0).cumsum() / 10**9
     else:
-        metrics = []
-        for field in fields:
-            if field[:-1] in list(df.columns):
-                metrics.append(field[:-1])
+        df[ELAPSED_KEY] = np.arange(0, len(df))
+    return df
 
-    for metric in metrics:
-        if is_numeric_dtype(df[metric]):
-            lower_bound = df[metrics[0]].min()
-            upper_bound = df[metrics[0]].max()
-    
-    for metric in metrics:
-        if is_numeric_dtype(df[metric]):
-            # plot the line segments
-            plt.plot(df['TimeSteps'], df[metric], label=metric)
-            # update the boundary
-            min_value = df[metric].min()
-            max_value = df[metric].max()
-            if lower_bound > min_value:
-                lower_bound = min_value
-            if upper_bound < max_value:
-                upper_bound = max_value
-    
+def set_time_axis(ax, df):
+    ax.set_xlim(xmin=0, xmax=df[ELAPSED_KEY].max())
+    ax.set_xlabel('Time (seconds)' if TIME_KEY in df.columns else 'Time Steps')
+
+def style_axes(ax):
     # https://newbedev.com/how-to-remove-frame-from-matplotlib-pyplot-figure-vs-matplotlib-figure-frameon-false-problematic-in-matplotlib
-    ax = plt.gca()
     ax.spines["top"].set_visible(False)
     ax.spines["bottom"].set_visible(False)
     ax.spines["left"].set_visible(False)
@@ -99,38 +93,139 @@ def plot_multiple(report_file, group, key, idx, image_dir = None, fields = None)
     ax.set_facecolor('#e5ecf6')
     ax.xaxis.tick_bottom()
     ax.yaxis.tick_left()
-    
+
+    # linestyle = '-', '--', '-.', ':', 'None', ' ', '', 'solid', 'dashed', 'dashdot', 'dotted'
+    ax.grid(True, color = 'white', linestyle = 'solid', linewidth = 1)
+
+def get_series(df, metric, fig):
+    """get_series(df, metric, fig)
+
+    The method returns the elapsed times and the values of a metric
+    reduced to the pixel width of the figure
+    """
+    width = int(fig.get_figwidth() * DPI)
+    if report_file is None:
+        return downsample.downsample(df[ELAPSED_KEY].values, df[metric].values, width, downsample_method)
+    return downsample.cached_downsample(report_file, ELAPSED_KEY, metric, df[ELAPSED_KEY].values, df[metric].values, width, downsample_method)
+
+def plot_single(df, group, key, image_dir, metric):
+    """plot_single(df, group, key, image_dir, metric)
+
+    The method plots one metric of a group to its own image and returns
+    the image path, None when the metric cannot be plotted
+    """
+    unit = group["unit"]
+    if metric not in df.columns:
+        print('Could not find the metric "{}"'.format(metric))
+        return None
+    if not is_numeric_dtype(df[metric]):
+        return None
+
+    fig = Figure()
+    ax = fig.add_subplot()
+    # plot the line segments
+    ax.plot(*get_series(df, metric, fig), label=metric)
+    style_axes(ax)
+
+    min_val = df[metric].min()
+    max_val = df[metric].max()
+    set_time_axis(ax, df)
+    if min_val != max_val:
+        ax.set_ylim(ymin=min_val, ymax=max_val)
+
+    ax.set_title(metric)
+    ax.set_ylabel(unit)
+
+    image_file = '{}/{}'.format(image_dir, metric)
+    fig.savefig(image_file, bbox_inches='tight', dpi=DPI, transparent=False)
+    return image_file
+
+# plot the graph from the report file
+def plot_multiple(df, group, key, idx, image_dir = "."):
+    """plot_multiple(df, group, key, idx, [image_dir])
+
+    The method plots all the metrics of a group on one image and returns
+    the image path, None when no metric of the group can be plotted
+    """
+    unit = group["unit"]
+    metrics = [metric for metric in group["metrics"] if metric in df.columns and is_numeric_dtype(df[metric])]
+    if len(metrics) == 0:
+        return None
+
+    fig = Figure()
+    ax = fig.add_subplot()
+    lower_bound = df[metrics[0]].min()
+    upper_bound = df[metrics[0]].max()
+    for metric in metrics:
+        # plot the line segments
+        ax.plot(*get_series(df, metric, fig), label=metric)
+        # update the boundary
+        lower_bound = min(lower_bound, df[metric].min())
+        upper_bound = max(upper_bound, df[metric].max())
+    style_axes(ax)
+
     # https://jakevdp.github.io/PythonDataScienceHandbook/04.10-customizing-ticks.html
     #ax.yaxis.set_major_locator(plt.LinearLocator(numticks=9))
     #ax.yaxis.set_major_locator(plt.MultipleLocator(base=5))
-    
-    #plt.ylabel(y_axis)
 
-    plt.legend()
-    plt.title(key)
-    plt.ylabel(unit)
-    plt.xlabel('Time Steps')
+    ax.legend()
+    ax.set_title(key)
+    ax.set_ylabel(unit)
 
-    ax.set_xlim(xmin=0, xmax=len(df)-1)
-    ax.set_ylim(ymin=lower_bound, ymax=upper_bound)
-    
-    # linestyle = '-', '--', '-.', ':', 'None', ' ', '', 'solid', 'dashed', 'dashdot', 'dotted'
-    plt.grid(color = 'white', linestyle = 'solid', linewidth = 1)
-    plt.grid(True)
-    
-    if image_dir is not None:
-        plt.savefig('{}/{}'.format(image_dir, "profiler_{}.png".format(idx)), bbox_inches='tight', dpi=100, transparent=False)
-    else:
-        plt.show()
-    plt.clf()
+    set_time_axis(ax, df)
+    # a flat group keeps the default limits, identical limits only warn
+    if lower_bound != upper_bound:
+        ax.set_ylim(ymin=lower_bound, ymax=upper_bound)
+
+    image_file = '{}/{}'.format(image_dir, "profiler_{}.png".format(idx))
+    fig.savefig(image_file, bbox_inches='tight', dpi=DPI, transparent=False)
+    return image_file
+
+def share_report(df, file_name=None, method=downsample.MINMAX):
+    global report_data, report_file, downsample_method
+    report_data = df
+    report_file = file_name
+    downsample_method = method
+
+def render(task):
+    """render(task)
+
+    The method renders one figure in a worker process from the shared
+    data frame, task is the plotting method followed by its arguments
+    """
+    plot, arguments = task
+    return plot(report_data, *arguments)
+
+def render_all(df, tasks, workers=None, file_name=None, method=downsample.MINMAX):
+    """render_all(df, tasks, [workers], [file_name], [method])
+
+    The method renders the figures in a pool of processes, the data frame
+    is sent once to every process rather than once per figure. The series
+    are downsampled with the method and cached next to the report file
+    """
+    # an unknown method would only fail inside the workers
+    if method not in downsample.METHODS:
+        raise ValueError("unknown downsampling method '{}'".format(method))
+    if workers is None:
+        workers = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    workers = max(1, min(workers, len(tasks)))
+    if workers == 1:
+        share_report(df, file_name, method)
+        return [render(task) for task in tasks]
+    with multiprocessing.Pool(workers, initializer=share_report, initargs=(df, file_name, method)) as pool:
+        return pool.map(render, tasks)
 
 if __name__ == '__main__':
-    
+
     delta_file = "./delta.csv"
     config_file = "./graph.default.cfg"
     image_dir = "./"
 
     is_single_plot = None
+    method = os.environ.get("DOWNSAMPLE_METHOD", downsample.MINMAX)
+    if method not in downsample.METHODS:
+        print("unknown downsampling method '{}' in DOWNSAMPLE_METHOD, use one of {}".format(method, ", ".join(downsample.METHODS)))
+        sys.exit(1)
     count = len(sys.argv)
     if count > 1:
         delta_file = sys.argv[1]
@@ -141,32 +236,28 @@ if __name__ == '__main__':
     if count > 4:
         is_single_plot = sys.argv[4]
 
-    group_name = "Unknown"
-    metric_groups = {}
-    metric_groups[group_name] = {}
-    metric_groups[group_name]["unit"] = "Unspecified"
-    metric_groups[group_name]["metrics"] = []
-    with open(config_file, 'r') as infile:
-        for line in infile:
-            if line.startswith("###"):
-                data = line[3:-1].split(",")
-                group_name = data[0]
-                metric_groups[group_name] = {}
-                if len(data) > 1:
-                    metric_groups[group_name]["unit"] = data[1]
-                else:
-                    metric_groups[group_name]["unit"] = "Unspecified"
-                metric_groups[group_name]["metrics"] = []
-            elif line.startswith("#"):
-                continue
-            else:
-                metric_groups[group_name]["metrics"].append(line)
-    metric_groups.pop("Unknown", None)
+    timings = {}
+    start = time.perf_counter()
+    metric_groups = read_config(config_file)
+    timings["config"] = time.perf_counter() - start
 
+    start = time.perf_counter()
+    df = load_report(delta_file, metric_groups)
+    timings["load"] = time.perf_counter() - start
+
+    tasks = []
     if is_single_plot is not None:
         for key in metric_groups.keys():
-            plot_single(delta_file, metric_groups[key], key, image_dir)
+            for metric in metric_groups[key]["metrics"]:
+                tasks.append((plot_single, (metric_groups[key], key, image_dir, metric)))
     else:
         for idx, key in enumerate(metric_groups.keys()):
-            plot_multiple(delta_file, metric_groups[key], key, idx, image_dir)
+            tasks.append((plot_multiple, (metric_groups[key], key, idx, image_dir)))
+
+    start = time.perf_counter()
+    images = [image for image in render_all(df, tasks, file_name=delta_file, method=method) if image is not None]
+    timings["render"] = time.perf_counter() - start
 
+    print("rendered {} images from {} rows and {} columns".format(len(images), len(df), len(df.columns) - 1))
+    for stage, seconds in timings.items():
+        print("{}: {:.3f} seconds".format(stage, seconds))
@@ -0,0 +1,109 @@
+# --------------------------------------------------------------------------
+# The module caches the static host information of static.json, the kernel,
+# CPU model, cache sizes and CPU topology, which cannot change before the
+# host reboots. The first run after a boot probes the host and stores the
+# fingerprint under a name made of the boot id and the kernel release,
+# every other run of the same boot copies it instead of probing again.
+#
+# The cache directory is PROFILER_CACHE_DIR, or profiler in the cache
+# directory of the user ($XDG_CACHE_HOME or ~/.cache). It is created
+# private to the user and not trusted unless the user owns it and nobody
+# else may write to it, so another user cannot plant a fingerprint. A new
+# fingerprint replaces the ones of the previous boots.
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import glob
+import json
+import os
+import re
+import stat
+import procfs
+
+CACHE_DIR_VARIABLE='PROFILER_CACHE_DIR'
+CACHE_DIR_NAME='profiler'
+CACHE_FILE_PATTERN='static_*.json'
+BOOT_ID_KEY='boot_id'
+RELEASE_KEY='release'
+INVALID_NAME_CHARACTERS=re.compile(r'[^a-zA-Z0-9_.-]')
+
+def get_cache_dir():
+    user_cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.environ.get(CACHE_DIR_VARIABLE) or os.path.join(user_cache_dir, CACHE_DIR_NAME)
+
+def is_private_dir(cache_dir):
+    """is_private_dir(cache_dir)
+
+    The method creates the cache directory readable by the user only when
+    it does not exist, and tells whether it is a directory the user owns
+    that neither the group nor the others may write to
+    """
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        status = os.lstat(cache_dir)
+    except OSError:
+        return False
+    return stat.S_ISDIR(status.st_mode) and status.st_uid == os.getuid() and not status.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def get_host_key():
+    """get_host_key()
+
+    The method returns the (boot id, kernel release) pair the fingerprint
+    of the host is valid for, the boot id is empty when the kernel does
+    not expose it
+    """
+    return procfs.read_boot_id(), os.uname().release
+
+def get_cache_path(cache_dir, host_key):
+    name = "static_{}_{}.json".format(*host_key)
+    return os.path.join(cache_dir, INVALID_NAME_CHARACTERS.sub("_", name))
+
+def read_fingerprint(cache_path, host_key):
+    try:
+        with open(cache_path, 'r') as infile:
+            record = json.load(infile)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(record, dict):
+        return None
+    # two keys may share a name once their invalid characters are replaced
+    if (record.pop(BOOT_ID_KEY, None), record.pop(RELEASE_KEY, None)) != host_key:
+        return None
+    return record
+
+def write_fingerprint(cache_path, host_key, fingerprint):
+    record = dict(fingerprint)
+    record[BOOT_ID_KEY], record[RELEASE_KEY] = host_key
+    try:
+        # write under a temporary name, the runs of a host may start together
+        temp_path = "{}.{}".format(cache_path, os.getpid())
+        with open(temp_path, 'w') as outfile:
+            json.dump(record, outfile, indent=4)
+        os.replace(temp_path, cache_path)
+        # the fingerprints of the previous boots are never read again
+        for path in glob.glob(os.path.join(os.path.dirname(cache_path), CACHE_FILE_PATTERN)):
+            if path != cache_path:
+                os.remove(path)
+    except OSError:
+        pass
+
+def get_fingerprint(probe, cache_dir=None):
+    """get_fingerprint(probe, [cache_dir])
+
+    The method returns the fingerprint of the host from the cache, or
+    calls probe() and caches its result when the host rebooted or its
+    kernel changed since it was stored. Without a boot id, or without a
+    private cache directory, the host is probed every time
+    """
+    host_key = get_host_key()
+    cache_dir = cache_dir or get_cache_dir()
+    if not host_key[0] or not is_private_dir(cache_dir):
+        return probe()
+    cache_path = get_cache_path(cache_dir, host_key)
+    fingerprint = read_fingerprint(cache_path, host_key)
+    if fingerprint is None:
+        fingerprint = probe()
+        write_fingerprint(cache_path, host_key, fingerprint)
+    return fingerprint
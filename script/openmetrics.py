@@ -0,0 +1,224 @@
+# --------------------------------------------------------------------------
+# The module serves the latest samples of the sampler over HTTP in the
+# OpenMetrics text format, so a local scraper can watch a run while it is
+# profiled. The sampler only copies the numbers of every sample into an
+# in-memory ring buffer, the page is rendered by the server thread when it
+# is scraped, so polling never delays the time series.
+#
+# The v* and c* values are exposed as gauges, the p* values summed over
+# all the processes of the sample, and the collection times of the VM,
+# container and process collectors as histograms over the whole run.
+#
+# Usage: rudataall.py --metrics-listen 127.0.0.1:9100 ...
+#        rudataall.py --metrics-listen /tmp/profiler.sock ...
+#        curl http://127.0.0.1:9100/metrics
+#        curl --unix-socket /tmp/profiler.sock http://localhost/metrics
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import collections
+import http.server
+import os
+import re
+import socketserver
+import threading
+
+METRIC_PREFIX='profiler_'
+CONTENT_TYPE='application/openmetrics-text; version=1.0.0; charset=utf-8'
+HISTORY_SIZE=600
+
+# the sample keys of the collection time of every collector
+COLLECTOR_TIMES={
+    "vm": "VM_Write_Time",
+    "container": "Container_Write_Time",
+    "process": "Process_Write_Time",
+}
+# the upper bounds (seconds) of the histogram buckets
+BUCKETS=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+
+PROCESS_LIST_KEY='pProcesses'
+PROCESS_IGNORED_KEYS=set(["pId", "pStartTime"])
+INVALID_NAME_CHARACTERS=re.compile(r'[^a-zA-Z0-9_]')
+
+def get_metric_name(key):
+    return METRIC_PREFIX + INVALID_NAME_CHARACTERS.sub("_", key)
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def get_gauges(sample):
+    """get_gauges(sample)
+
+    The method returns the v*, c* and summed p* numbers of a sample, the
+    nested c* objects are inlined and the t* timestamps left out
+    """
+    gauges = {}
+    def add(record):
+        for key, value in record.items():
+            if isinstance(value, dict):
+                add(value)
+            elif key[:1] in ("v", "c") and is_number(value):
+                gauges[key] = value
+    add(sample)
+
+    processes = sample.get(PROCESS_LIST_KEY)
+    if processes is not None:
+        gauges["pNumProcesses"] = len(processes)
+        for process in processes:
+            for key, value in process.items():
+                if key not in PROCESS_IGNORED_KEYS and is_number(value):
+                    gauges[key] = gauges.get(key, 0) + value
+    return gauges
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+class Histogram:
+    """Histogram([buckets])
+
+    The class counts the observations per cumulative bucket
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = []
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, format_value(bound), count))
+        lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, self.count))
+        lines.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+        lines.append('{}_sum{{{}}} {}'.format(name, labels, format_value(self.sum)))
+        return lines
+
+class MetricsRing:
+    """MetricsRing([size])
+
+    The class keeps the gauges of the last size samples and the collector
+    time histograms of the run, record() is called by the sampler and
+    render() by the server thread
+    """
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.samples = collections.deque(maxlen=size)
+        self.histograms = dict((collector, Histogram()) for collector in COLLECTOR_TIMES)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def record(self, sample):
+        gauges = get_gauges(sample)
+        timestamp = sample.get("currentTime")
+        with self.lock:
+            self.samples.append((timestamp, gauges))
+            self.count += 1
+            for collector, key in COLLECTOR_TIMES.items():
+                if is_number(sample.get(key)):
+                    self.histograms[collector].observe(sample[key])
+
+    def history(self):
+        with self.lock:
+            return list(self.samples)
+
+    def render(self):
+        """render()
+
+        The method returns the OpenMetrics page of the latest sample
+        """
+        with self.lock:
+            timestamp, gauges = self.samples[-1] if self.samples else (None, {})
+            count = self.count
+            histogram_lines = []
+            for collector, histogram in self.histograms.items():
+                histogram_lines += histogram.render(METRIC_PREFIX + "collector_seconds", 'collector="{}"'.format(collector))
+
+        lines = []
+        lines.append("# TYPE {}samples counter".format(METRIC_PREFIX))
+        lines.append("# HELP {}samples samples taken by the sampler".format(METRIC_PREFIX))
+        lines.append("{}samples_total {}".format(METRIC_PREFIX, count))
+        if timestamp is not None:
+            lines.append("# TYPE {}sample_timestamp_seconds gauge".format(METRIC_PREFIX))
+            lines.append("# HELP {}sample_timestamp_seconds time of the latest sample".format(METRIC_PREFIX))
+            lines.append("{}sample_timestamp_seconds {}".format(METRIC_PREFIX, format_value(timestamp / 10**9)))
+        for key in sorted(gauges):
+            name = get_metric_name(key)
+            lines.append("# TYPE {} gauge".format(name))
+            lines.append("{} {}".format(name, format_value(gauges[key])))
+        lines.append("# TYPE {}collector_seconds histogram".format(METRIC_PREFIX))
+        lines.append("# UNIT {}collector_seconds seconds".format(METRIC_PREFIX))
+        lines.append("# HELP {}collector_seconds time to collect the metrics of a level".format(METRIC_PREFIX))
+        lines.extend(histogram_lines)
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.ring.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # the clients of a Unix socket have no address
+        return str(self.client_address)
+
+    def log_message(self, format, *args):
+        pass
+
+class TcpMetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class UnixMetricsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # a socket left over by a previous sampler would fail the bind
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+class MetricsServer:
+    """MetricsServer(address, ring)
+
+    The class serves the ring from a background thread, the address is a
+    HOST:PORT pair or the path of a Unix socket
+    """
+
+    def __init__(self, address, ring):
+        self.ring = ring
+        if "/" in address or ":" not in address:
+            self.server = UnixMetricsServer(address, MetricsHandler)
+        else:
+            host, _separator, port = address.rpartition(":")
+            self.server = TcpMetricsServer((host or "127.0.0.1", int(port)), MetricsHandler)
+        self.server.ring = ring
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if isinstance(self.server, UnixMetricsServer):
+            try:
+                os.remove(self.server.server_address)
+            except OSError:
+                pass
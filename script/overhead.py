@@ -0,0 +1,145 @@
+# --------------------------------------------------------------------------
+# The module measures the sampler itself. Every sample records the CPU
+# time of the sampler process, from the process CPU clock, and its
+# resident memory, open file descriptors, read and write system calls and
+# context switches, read from its own /proc/self files kept open between
+# samples.
+#
+# With an overhead budget, the CPU the sampler used over the last samples,
+# and at least the last second, is compared to the largest share of one
+# core it may take. The window starts after the first sample so that the
+# interpreter startup and the first reads are not charged to it. Past the
+# budget the level that cost the most CPU time is dropped, and once one
+# level is left the time series interval is widened. Every decision is
+# appended to overhead.ndjson in the output directory.
+#
+# Usage: rudataall.py --overhead-budget 5 ...
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import collections
+import json
+import os
+import time
+import procfs
+
+BUDGET_WINDOW=5     # samples the CPU of the sampler is measured over
+BUDGET_SECONDS=1.0  # shortest time the CPU of the sampler is measured over
+WIDEN_FACTOR=2.0
+DECISION_FILE='overhead.ndjson'
+
+# the actions taken past the budget
+DROP_LEVEL='drop_level'
+WIDEN_INTERVAL='widen_interval'
+
+CPU_TIME_KEY='Sampler_Cpu_Time'
+DECISIONS_KEY='Overhead_Decisions'
+
+def read_self_usage():
+    """read_self_usage()
+
+    The method returns the CPU time (seconds, from the process CPU clock
+    rather than the clock ticks of /proc/self/stat), resident memory (kB),
+    open file descriptors, read and write system calls and context
+    switches of the current process, the counters since it started
+    """
+    self_dir = procfs.SELF_DIR
+    status = procfs.parse_key_values(procfs.read_file(self_dir + "/status", keep_open=True))
+    io = procfs.parse_key_values(procfs.read_file(self_dir + "/io", keep_open=True))
+    try:
+        open_files = len(os.listdir(self_dir + "/fd"))
+    except OSError:
+        open_files = 0
+    return {
+        CPU_TIME_KEY: time.process_time(),
+        "Sampler_Memory_RSS": status.get("VmRSS", 0),
+        "Sampler_Open_Files": open_files,
+        "Sampler_Syscalls": io.get("syscr", 0) + io.get("syscw", 0),
+        "Sampler_Context_Switches": status.get("voluntary_ctxt_switches", 0) + status.get("nonvoluntary_ctxt_switches", 0),
+    }
+
+class OverheadBudget:
+    """OverheadBudget(max_cpu_percent, [window], [seconds])
+
+    The class keeps the CPU the sampler used over the last window samples,
+    and at least the last seconds, within max_cpu_percent of one core.
+    update() takes every new sample and returns the decision taken, None
+    when the sampler is within budget. The first sample is left out
+    """
+
+    def __init__(self, max_cpu_percent, window=BUDGET_WINDOW, seconds=BUDGET_SECONDS):
+        if max_cpu_percent <= 0:
+            raise ValueError("the overhead budget must be a positive percentage")
+        self.max_cpu_percent = max_cpu_percent
+        self.window = window
+        self.span = int(seconds * 10**9)
+        self.samples = collections.deque()
+        self.started = False
+        self.decisions = 0
+
+    def get_span(self, first=0):
+        return self.samples[-1][0] - self.samples[first][0]
+
+    def get_cpu_percent(self):
+        (first_time, first_cpu, _costs), (last_time, last_cpu, _costs) = self.samples[0], self.samples[-1]
+        if last_time <= first_time:
+            return 0
+        return (last_cpu - first_cpu) / ((last_time - first_time) / 10**9) * 100
+
+    def get_costliest_level(self, levels):
+        costs = dict((level, 0) for level in levels)
+        for _time, _cpu, level_costs in list(self.samples)[1:]:
+            for level in levels:
+                costs[level] += level_costs.get(level, 0)
+        return max(levels, key=lambda level: costs[level])
+
+    def update(self, sample, levels, interval):
+        """update(sample, levels, interval)
+
+        The method measures the sample, levels are the levels still
+        collected and interval the time series interval in milliseconds
+        """
+        if not isinstance(sample.get("currentTime"), int) or CPU_TIME_KEY not in sample:
+            return None
+        if not self.started:
+            self.started = True
+            return None
+        level_costs = dict((level, sample.get(level + "_Cpu_Time", 0)) for level in levels)
+        self.samples.append((sample["currentTime"], sample[CPU_TIME_KEY], level_costs))
+        # drop the oldest samples the window and the span do without
+        while len(self.samples) > self.window + 1 and self.get_span(1) >= self.span:
+            self.samples.popleft()
+        if len(self.samples) <= self.window or self.get_span() < self.span:
+            return None
+        cpu_percent = self.get_cpu_percent()
+        if cpu_percent <= self.max_cpu_percent:
+            return None
+
+        decision = {
+            "currentTime": sample["currentTime"],
+            "cpu_percent": round(cpu_percent, 3),
+            "budget_percent": self.max_cpu_percent,
+        }
+        if len(levels) > 1:
+            decision["action"] = DROP_LEVEL
+            decision["level"] = self.get_costliest_level(levels)
+        elif interval > 0:
+            decision["action"] = WIDEN_INTERVAL
+            decision["interval"] = interval * WIDEN_FACTOR
+        else:
+            return None
+        # measure again from the samples taken after the decision
+        self.samples.clear()
+        self.decisions += 1
+        return decision
+
+def log_decision(output_dir, decision):
+    """log_decision(output_dir, decision)
+
+    The method appends a decision to the overhead file of the output
+    directory, the decisions are rare and the line is written at once
+    """
+    with open(os.path.join(output_dir, DECISION_FILE), 'a') as outfile:
+        outfile.write(json.dumps(decision, separators=(',', ':')) + "\n")
@@ -1,8 +1,11 @@
 from plotly.subplots import make_subplots
 import os, sys
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
 import plotly.graph_objects as go
+import plotly.io as pio
 import argparse
+import downsample
 
 import math
 from os import path
@@ -10,14 +13,30 @@ from os import path
 #usage: python plotly_graph_generation.py csv_file graphing_method sample_delta metrics(file or space delimited list, if file include --infile)
 
 #implemented graphing methods
-def export_graphs_as_images(fig, file_name, title):
-	file_name=file_name.split('.',1)[0]
-	if not os.path.exists(file_name +"_images"):
-		os.mkdir(file_name +"_images")
-	fig.write_image(file_name +"_images/"+title +".png")
-	print("saved image: " +title +".png to " + os.path.abspath(file_name +"_images"))
-	
-
+#writes all the images in one batch, one kaleido session renders every figure
+def export_graphs_as_images(figs, file_name, titles):
+	image_dir=file_name.split('.',1)[0] +"_images"
+	if not os.path.exists(image_dir):
+		os.mkdir(image_dir)
+	image_files=[image_dir +"/" +title +".png" for title in titles]
+	if hasattr(pio, "write_images"):
+		pio.write_images(figs, image_files)
+	else:
+		#older plotly versions keep the kaleido process alive between the calls
+		for fig, image_file in zip(figs, image_files):
+			fig.write_image(image_file)
+	print("saved {} images to {}".format(len(image_files), os.path.abspath(image_dir)))
+
+#writes one self-contained html page plotting every metric with webgl traces
+def export_graphs_as_html(series, html_file):
+	fig = make_subplots(rows=len(series), cols=1, shared_xaxes=True, vertical_spacing=min(0.02, 1.0 / len(series)), subplot_titles=list(series))
+	for row, (metric, (series_x, series_y)) in enumerate(series.items(), start=1):
+		fig.add_trace(go.Scattergl(x=series_x, y=series_y, name=metric), row=row, col=1)
+		fig['layout']['yaxis{}'.format(row)].update(title=metric)
+	fig['layout']['xaxis{}'.format(len(series))].update(title="Time(seconds)")
+	fig.update_layout(height=250 * len(series), showlegend=False)
+	fig.write_html(html_file, include_plotlyjs=True)
+	print("saved {} graphs to {}".format(len(series), os.path.abspath(html_file)))
 
 def read_metrics_file(metrics, data_frame):
 	if (len(metrics) == 1 and path.exists(metrics[0])):
@@ -51,43 +70,56 @@ def graphs_rows_cols(metrics_count):
 	elif (metrics_count >=5):
 		return 3;
 
+#reduces a metric to about the pixel width of its plot, keeping the peaks
+def get_series(metric, width):
+	if (not is_numeric_dtype(data_frame[metric])):
+		return data_frame['currentTime'].values, data_frame[metric].values
+	x_name = "elapsedTime/{}".format(args.sampling_interval)
+	return downsample.cached_downsample(args.csv_file, x_name, metric, data_frame['currentTime'].values, data_frame[metric].values, width, args.downsample_method)
+
 def makegraphs(metrics, df):#, graph_function):
-	start =0
-	metrics_count=len(metrics) 
-	row_col_length = graphs_rows_cols(metrics_count)
-	length = row_col_length * row_col_length
-	x = ((float(metrics_count) / length))
-	for i in range(int(math.ceil(x))):
-		sliced_metrics = slice_for_x(metrics, start, length)
-		fig = make_subplots(rows=row_col_length, cols=row_col_length, subplot_titles=sliced_metrics)
-
-		current_row=1
-		current_col=1
-		axiscounter=1
-
-		for x in sliced_metrics:
-		
-			
-			fig.add_trace(go.Scatter(x=data_frame['currentTime'], y=data_frame[x]),
-				row=current_row, col=current_col)
-			current_col = current_col +1
-			if (current_col == row_col_length +1):
-				current_col =1
-				current_row +=1
-			currentXAxis='xaxis{}'.format(axiscounter)
-			currentYAxis='yaxis{}'.format(axiscounter)
-
-			fig['layout'][currentXAxis].update(title="Time(seconds)")
-			fig['layout'][currentYAxis].update(title=x)
-			axiscounter+=1
-
-
-			#this code will create the current trace as a seperate fig so that it can be saved as its own image.
-			#This is necessary because we can only export figs as images, and current each figure being dynamically created
-			#is showing multiple at a time.
-			#this code can be moved or implemented differently, for example if we want to give the user to either A export images, or B save images.
+	#the series of every metric is downsampled once, all the figures share it
+	series = dict((x, get_series(x, args.width)) for x in metrics)
+
+	if (args.dynamic_creation):
+		start =0
+		metrics_count=len(metrics) 
+		row_col_length = graphs_rows_cols(metrics_count)
+		length = row_col_length * row_col_length
+		x = ((float(metrics_count) / length))
+		for i in range(int(math.ceil(x))):
+			sliced_metrics = slice_for_x(metrics, start, length)
+			fig = make_subplots(rows=row_col_length, cols=row_col_length, subplot_titles=sliced_metrics)
+
+			current_row=1
+			current_col=1
+			axiscounter=1
+
+			for x in sliced_metrics:
+				series_x, series_y = series[x]
+				fig.add_trace(go.Scattergl(x=series_x, y=series_y),
+					row=current_row, col=current_col)
+				current_col = current_col +1
+				if (current_col == row_col_length +1):
+					current_col =1
+					current_row +=1
+				currentXAxis='xaxis{}'.format(axiscounter)
+				currentYAxis='yaxis{}'.format(axiscounter)
+
+				fig['layout'][currentXAxis].update(title="Time(seconds)")
+				fig['layout'][currentYAxis].update(title=x)
+				axiscounter+=1
+
+			start += length
+			fig.show()
+
+	#one figure per metric so that each can be saved as its own image, the images are exported in one batch
+	if (not args.no_images):
+		export_figs = []
+		for x in metrics:
+			series_x, series_y = series[x]
 			export_fig = go.Figure(
-				data=[go.Scatter(x=data_frame['currentTime'], y=data_frame[x])],
+				data=[go.Scatter(x=series_x, y=series_y)],
 				layout=go.Layout(
 					title=go.layout.Title(text=x)
 				)
@@ -95,18 +127,22 @@ def makegraphs(metrics, df):#, graph_function):
 			)
 			export_fig['layout']['xaxis'].update(title="Time(seconds)")
 			export_fig['layout']['yaxis'].update(title=x)
-			export_graphs_as_images(export_fig, df.name, x)
-			
-		start += length
-		if (args.dynamic_creation):
-			fig.show()
+			export_figs.append(export_fig)
+		export_graphs_as_images(export_figs, df.name, metrics)
+
+	if (args.html_file):
+		export_graphs_as_html(series, args.html_file)
 
 
 #cmdline parser
 parser = argparse.ArgumentParser(description="generates plotly graphs")
 parser.add_argument('csv_file', action='store', help='csv file')
 parser.add_argument("-s", "--sampling_interval", type=int, nargs='?', action="store", help='determines sampling size')
+parser.add_argument("-w", "--width", type=int, default=1000, action="store", help='pixel width of an exported image, the series are downsampled to about as many points (default is 1000)')
+parser.add_argument("-m", "--downsample_method", choices=downsample.METHODS, default=downsample.MINMAX, action="store", help='downsampling method, minmax keeps the extremes of every pixel column and lttb the shape of the curve (default is minmax)')
 parser.add_argument("-d", "--dynamic_creation", action="store_true", help='determines sampling size')
+parser.add_argument("--html_file", action="store", help='writes all the metrics to one self-contained html dashboard')
+parser.add_argument("--no_images", action="store_true", help='does not export the png images')
 parser.add_argument('metrics', type=str, nargs='*', help='list of metrics to graph over')
 parser.add_argument('--infile', dest='read_metrics', action='store_const', const=read_metrics_file, default=read_cmdline_metrics, help='reads metrics from a file or from command line')
 args= parser.parse_args()
@@ -116,7 +152,9 @@ data_frame = pd.read_csv(args.csv_file)
 data_frame.head()
 
 
-data_frame['currentTime'] = data_frame['currentTime'] - data_frame['currentTime'][0]
+# the currentTime of a delta row is the length of its interval in nanoseconds, the
+# rows are placed at the seconds elapsed since the first sample
+data_frame['currentTime'] = data_frame['currentTime'].fillna(0).cumsum() / 10**9
 data_frame=data_frame.iloc[::args.sampling_interval]
 data_frame.name=args.csv_file
 
@@ -0,0 +1,183 @@
+# --------------------------------------------------------------------------
+# The module aggregates the process list of the samples, which the delta
+# tool leaves out. The processes of two consecutive samples are joined on
+# their process id and start time, so a reused process id is never taken
+# for the same process, and the CPU, context switch, page fault and block
+# IO delay counters are turned into per-process deltas of the interval. A
+# process missing from the previous sample started during the interval
+# and is counted from zero.
+#
+# The tool writes the top processes of every interval ranked by a delta
+# (pCpuTime, user plus kernel mode, by default) and optionally the deltas
+# of all the processes.
+#
+# Usage: python3 processdelta.py -i INPUT_DIR [-o process_top.csv] [-n 10]
+#                                [-s pCpuTime] [-d process_delta.csv]
+#                                [-f csv,parquet,feather]
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import argparse
+import operator
+import os
+import sys
+import numpy as np
+import export
+
+PROCESS_START_KEY='pStartTime'
+PROCESS_NAME_KEY='pName'
+INTERVAL_KEY='intervalTime'
+RANK_KEY='rank'
+CPU_TIME_KEY='pCpuTime'
+
+# the counters of a process turned into deltas, pCpuTime is computed from the first two
+DELTA_FIELDS=[
+    "pCpuTimeUserMode",
+    "pCpuTimeKernelMode",
+    "pChildrenUserMode",
+    "pChildrenKernelMode",
+    "pVoluntaryContextSwitches",
+    "pInvoluntaryContextSwitches",
+    "pPGFault",
+    "pMajorPGFault",
+    "pBlockIODelays",
+]
+SORT_FIELDS=[CPU_TIME_KEY] + DELTA_FIELDS
+TOP_COUNT=10
+
+get_key = operator.itemgetter(export.PROCESS_ID_KEY, PROCESS_START_KEY)
+get_counters = operator.itemgetter(*DELTA_FIELDS)
+
+class ProcessTable:
+    """ProcessTable(sample)
+
+    The class holds the processes of one sample: their (pid, start time)
+    keys, a hash index of the keys and the counters as one matrix
+    """
+
+    def __init__(self, sample):
+        processes = sample.get(export.PROCESS_LIST_KEY, [])
+        self.time = sample.get(export.SAMPLE_TIME_KEY)
+        try:
+            self.keys = list(map(get_key, processes))
+            counters = list(map(get_counters, processes))
+        except KeyError:
+            # a process list written by another version of the sampler
+            self.keys = [(process.get(export.PROCESS_ID_KEY), process.get(PROCESS_START_KEY)) for process in processes]
+            counters = [[process.get(field) for field in DELTA_FIELDS] for process in processes]
+        self.names = [process.get(PROCESS_NAME_KEY) for process in processes]
+        self.index = dict(zip(self.keys, range(len(self.keys))))
+        # a missing counter is not a number and leaves the delta of its process empty
+        self.values = np.array(counters, dtype=np.float64).reshape(len(processes), len(DELTA_FIELDS))
+
+def join_tables(previous, current):
+    """join_tables(previous, current)
+
+    The method returns the deltas of the processes of the current sample,
+    one row per process with pCpuTime as the first column
+    """
+    rows = np.array([previous.index.get(key, -1) for key in current.keys], dtype=np.int64)
+    deltas = current.values.copy()
+    matched = rows >= 0
+    deltas[matched] -= previous.values[rows[matched]]
+    cpu_time = deltas[:, 0] + deltas[:, 1]
+    return np.column_stack([cpu_time, deltas])
+
+def compute_intervals(samples):
+    """compute_intervals(samples)
+
+    The method yields (previous, current, deltas) for every pair of
+    consecutive samples holding a process list
+    """
+    previous = None
+    for sample in samples:
+        if export.PROCESS_LIST_KEY not in sample:
+            continue
+        current = ProcessTable(sample)
+        if previous is not None:
+            yield previous, current, join_tables(previous, current)
+        previous = current
+
+def get_rows(previous, current, deltas, order, rank=False):
+    interval = None
+    if previous.time is not None and current.time is not None:
+        interval = (current.time - previous.time) / 10**9
+    for position, row in enumerate(order):
+        pid, start_time = current.keys[row]
+        fields = {export.SAMPLE_TIME_KEY: current.time, INTERVAL_KEY: interval}
+        if rank:
+            fields[RANK_KEY] = position + 1
+        fields[export.PROCESS_ID_KEY] = pid
+        fields[PROCESS_START_KEY] = start_time
+        fields[PROCESS_NAME_KEY] = current.names[row]
+        for field, value in zip(SORT_FIELDS, deltas[row].tolist()):
+            fields[field] = value
+        yield fields
+
+def get_top_rows(previous, current, deltas, sort_field=CPU_TIME_KEY, count=TOP_COUNT):
+    """get_top_rows(previous, current, deltas, [sort_field], [count])
+
+    The method yields the rows of the count processes with the largest
+    delta of the sort field, ranked from one
+    """
+    column = deltas[:, SORT_FIELDS.index(sort_field)]
+    if count < len(column):
+        candidates = np.argpartition(-column, count)[:count]
+    else:
+        candidates = np.arange(len(column))
+    # the largest first, ties in the order of the process list
+    order = candidates[np.lexsort((candidates, -column[candidates]))]
+    return get_rows(previous, current, deltas, order, rank=True)
+
+def export_process_deltas(input_dir, top_file, sort_field=CPU_TIME_KEY, count=TOP_COUNT, delta_file=None, export_formats=[export.CSV]):
+    """export_process_deltas(input_dir, top_file, [sort_field], [count], [delta_file], [export_formats])
+
+    The method streams the intervals of the input directory to the top
+    table and, when a delta file is given, to the table of all process
+    deltas. It returns the number of intervals and of top rows
+    """
+    integer_fields = [export.SAMPLE_TIME_KEY, export.PROCESS_ID_KEY, PROCESS_START_KEY]
+    top_writers = export.create_writers(top_file, export_formats, sort_keys=False, integer_fields=integer_fields + [RANK_KEY])
+    delta_writers = []
+    if delta_file is not None:
+        delta_writers = export.create_writers(delta_file, export_formats, sort_keys=False, integer_fields=integer_fields)
+
+    intervals = 0
+    top_rows = 0
+    try:
+        for previous, current, deltas in compute_intervals(export.read_samples(input_dir)):
+            for row in get_top_rows(previous, current, deltas, sort_field, count):
+                for writer in top_writers:
+                    writer.write(row)
+                top_rows += 1
+            if delta_writers:
+                for row in get_rows(previous, current, deltas, range(len(current.keys))):
+                    for writer in delta_writers:
+                        writer.write(row)
+            intervals += 1
+    finally:
+        for writer in top_writers + delta_writers:
+            writer.close()
+    return intervals, top_rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compute the per-process deltas of a run and rank the processes of every interval.')
+    parser.add_argument("-i", "--input-directory", action="store", default=".", help='directory of the profiling files (default is the current directory)')
+    parser.add_argument("-o", "--top-output-file", action="store", default="process_top.csv", help='CSV file of the top processes of every interval (default is process_top.csv)')
+    parser.add_argument("-n", "--count", type=int, action="store", default=TOP_COUNT, help='number of processes ranked per interval (default is 10)')
+    parser.add_argument("-s", "--sort-field", action="store", choices=SORT_FIELDS, default=CPU_TIME_KEY, help='delta the processes are ranked by (default is pCpuTime, user plus kernel mode)')
+    parser.add_argument("-d", "--delta-output-file", action="store", help='CSV file of the deltas of all the processes of every interval')
+    parser.add_argument("-f", "--export-formats", action="store", default=export.CSV, help='comma separated formats among {} (default is csv)'.format(", ".join(export.EXPORT_FORMATS)))
+    args = parser.parse_args()
+
+    export_formats = args.export_formats.split(",")
+    for export_format in export_formats:
+        if export_format not in export.EXPORT_FORMATS:
+            parser.error("unknown export format '{}'".format(export_format))
+    if not os.path.isdir(args.input_directory):
+        print("could not find the input directory {}".format(args.input_directory), file=sys.stderr)
+        sys.exit(1)
+    intervals, top_rows = export_process_deltas(args.input_directory, args.top_output_file, args.sort_field, args.count, args.delta_output_file, export_formats)
+    print("ranked the processes of {} intervals, {} top rows".format(intervals, top_rows))
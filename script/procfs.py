@@ -0,0 +1,617 @@
+# --------------------------------------------------------------------------
+# The module reads the procfs and sysfs virtual files used by the profiler
+# directly into parsed structures so that taking a sample never forks
+# a subprocess (cat, grep, lsblk) on the sampling path. All the files are
+# read below a root directory, / by default, which set_root() moves to a
+# recorded or synthetic tree, and the files read can be recorded so that
+# a sample can be replayed later.
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import os
+import threading
+
+ROOT_DIR='/'
+PROC_DIR='/proc'
+SYS_DIR='/sys'
+# the sampler's own process, it does not move with the root
+SELF_DIR='/proc/self'
+READ_SIZE=65536
+CLOCK_TICKS=os.sysconf("SC_CLK_TCK")
+PAGE_SIZE=os.sysconf("SC_PAGE_SIZE")
+# the files of /proc/sys/kernel in the order of the fields of uname -a
+KERNEL_FILES=["ostype", "hostname", "osrelease", "version", "arch"]
+
+# file descriptors of the virtual files kept open between samples, keyed by
+# the thread and the path so that the collector threads never share one
+open_files={}
+open_files_lock=threading.Lock()
+# length of the last content of every file kept open
+read_sizes={}
+
+# command line and executable name of the processes keyed by (pid, start time)
+process_cache={}
+
+# the files read while recording keyed by path, their content or the list
+# of the subdirectories of a directory, None when not recording
+recording=None
+
+def set_root(root_dir):
+    """set_root(root_dir)
+
+    The method makes the virtual files be read below another root, a
+    recorded or synthetic tree holding proc and sys directories, the
+    files kept open below the previous root are closed
+    """
+    global ROOT_DIR, PROC_DIR, SYS_DIR
+    close_files()
+    ROOT_DIR = root_dir
+    PROC_DIR = os.path.join(root_dir, "proc")
+    SYS_DIR = os.path.join(root_dir, "sys")
+
+def start_recording():
+    """start_recording()
+
+    The method records the files read from now on
+    """
+    global recording
+    recording = {}
+
+def stop_recording():
+    """stop_recording()
+
+    The method stops recording and returns the files read since
+    start_recording()
+    """
+    global recording
+    files, recording = recording, None
+    return files or {}
+
+def record_dir(dir_path, names):
+    if recording is not None:
+        recording[dir_path] = list(names)
+
+def is_file(file_path):
+    """is_file(file_path)
+
+    The method tells whether the file exists, while recording the file is
+    read as well so that a replay finds it
+    """
+    if not os.path.isfile(file_path):
+        return False
+    if recording is not None:
+        read_file(file_path)
+    return True
+
+def read_file(file_path, default_value="", keep_open=False):
+    """read_file(file_path, [default_value], [keep_open])
+
+    The method returns the content of the virtual file, or the default
+    value if the file does not exist, cannot be read or is empty. With
+    keep_open the file descriptor stays open and the next call re-reads
+    it from offset zero, which regenerates the content of a procfs file
+    without another open() and close()
+    """
+    try:
+        if keep_open:
+            file_content = read_open_file(file_path)
+        else:
+            with open(file_path, "r", errors="replace") as file_pointer:
+                file_content = file_pointer.read()
+    except OSError:
+        return default_value
+    if recording is not None:
+        recording[file_path] = file_content
+    if len(file_content) == 0:
+        return default_value
+    return file_content
+
+def read_open_file(file_path):
+    key = (threading.get_ident(), file_path)
+    fd = open_files.get(key)
+    if fd is None:
+        fd = os.open(file_path, os.O_RDONLY)
+        with open_files_lock:
+            open_files[key] = fd
+    # a procfs file reports no size, one pread sized to its last content
+    # reads it in a single snapshot, a short read is the end of the file
+    size = read_sizes.get(file_path, 0) + READ_SIZE
+    chunks = []
+    offset = 0
+    while True:
+        chunk = os.pread(fd, size, offset)
+        chunks.append(chunk)
+        offset += len(chunk)
+        if len(chunk) < size:
+            break
+    read_sizes[file_path] = offset
+    return b"".join(chunks).decode("utf-8", "replace")
+
+def close_files():
+    """close_files()
+
+    The method closes every file descriptor kept open by read_file() in
+    any thread
+    """
+    with open_files_lock:
+        for fd in open_files.values():
+            os.close(fd)
+        open_files.clear()
+        read_sizes.clear()
+
+def parse_key_values(file_content):
+    """parse_key_values(file_content)
+
+    The method parses the "key value" lines of /proc/vmstat or a cgroup
+    memory.stat file into a dictionary of integers
+    """
+    values = {}
+    for line in file_content.splitlines():
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        try:
+            values[fields[0].rstrip(':')] = int(fields[1])
+        except ValueError:
+            pass
+    return values
+
+def read_vmstat():
+    """read_vmstat()
+
+    The method returns /proc/vmstat as a dictionary of counters
+    """
+    return parse_key_values(read_file("{}/vmstat".format(PROC_DIR), keep_open=True))
+
+def read_net_dev():
+    """read_net_dev()
+
+    The method returns /proc/net/dev as a dictionary mapping the interface
+    name to its list of counters (bytes received first, bytes sent ninth)
+    """
+    interfaces = {}
+    for line in read_file("{}/net/dev".format(PROC_DIR), keep_open=True).splitlines()[2:]:
+        name, _, counters = line.partition(':')
+        try:
+            interfaces[name.strip()] = [int(value) for value in counters.split()]
+        except ValueError:
+            pass
+    return interfaces
+
+def read_cpu_stat():
+    """read_cpu_stat()
+
+    The method returns the cpuN lines of /proc/stat as a dictionary mapping
+    the CPU name to its list of times in clock ticks (user first)
+    """
+    cpus = {}
+    for line in read_file("{}/stat".format(PROC_DIR), keep_open=True).splitlines():
+        if not line.startswith("cpu") or line.startswith("cpu "):
+            continue
+        fields = line.split()
+        try:
+            cpus[fields[0]] = [int(value) for value in fields[1:]]
+        except ValueError:
+            pass
+    return cpus
+
+def read_diskstats():
+    """read_diskstats()
+
+    The method returns /proc/diskstats as a dictionary mapping the device
+    name to its list of counters (reads completed first, writes completed fifth)
+    """
+    devices = {}
+    for line in read_file("{}/diskstats".format(PROC_DIR), keep_open=True).splitlines():
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        try:
+            devices[fields[2]] = [int(value) for value in fields[3:]]
+        except ValueError:
+            pass
+    return devices
+
+STAT_KEYS=("cpu", "ctxt", "btime")
+
+def read_stat(keys=STAT_KEYS):
+    """read_stat([keys])
+
+    The method returns the given lines of /proc/stat as a dictionary mapping
+    the first field (cpu for the total of all CPUs, ctxt, btime, ...) to
+    its list of counters, the other lines are not parsed
+    """
+    stat = {}
+    for line in read_file("{}/stat".format(PROC_DIR), keep_open=True).splitlines():
+        name, _, counters = line.partition(' ')
+        if name in keys:
+            try:
+                stat[name] = [int(value) for value in counters.split()]
+            except ValueError:
+                pass
+    return stat
+
+def read_meminfo():
+    """read_meminfo()
+
+    The method returns /proc/meminfo as a dictionary of sizes in kB
+    """
+    return parse_key_values(read_file("{}/meminfo".format(PROC_DIR), keep_open=True))
+
+def read_loadavg():
+    """read_loadavg()
+
+    The method returns the load averages of the last 1, 5 and 15 minutes
+    """
+    try:
+        return [float(value) for value in read_file("{}/loadavg".format(PROC_DIR), keep_open=True).split()[:3]]
+    except ValueError:
+        return [0.0, 0.0, 0.0]
+
+def read_cpu_mhz():
+    """read_cpu_mhz()
+
+    The method returns the current frequency in MHz averaged over the CPUs,
+    from /proc/cpuinfo or, when it does not list it (arm), from the
+    cpufreq policies of sysfs
+    """
+    frequencies = []
+    for line in read_file("{}/cpuinfo".format(PROC_DIR), keep_open=True).splitlines():
+        key, _, value = line.partition(':')
+        if key.strip().lower() == "cpu mhz":
+            frequencies.append(float(value))
+    if not frequencies:
+        cpufreq_dir = "{}/devices/system/cpu/cpufreq".format(SYS_DIR)
+        try:
+            policies = [name for name in os.listdir(cpufreq_dir) if name.startswith("policy")]
+        except OSError:
+            policies = []
+        record_dir(cpufreq_dir, policies)
+        for policy in policies:
+            try:
+                frequencies.append(int(read_file("{}/{}/scaling_cur_freq".format(cpufreq_dir, policy), keep_open=True)) / 1000)
+            except ValueError:
+                pass
+    if not frequencies:
+        return 0.0
+    return sum(frequencies) / len(frequencies)
+
+def list_storage_devices():
+    """list_storage_devices()
+
+    The method returns the names of all the block devices of /sys/block,
+    loop and device-mapper devices included, the set of devices psutil
+    sums the disk counters of, named as in /proc/diskstats
+    """
+    block_dir = "{}/block".format(SYS_DIR)
+    try:
+        names = os.listdir(block_dir)
+    except OSError:
+        return []
+    record_dir(block_dir, names)
+    return [name.replace('!', '/') for name in names]
+
+class CounterWrap:
+    """CounterWrap()
+
+    The class keeps the counters of every device growing the way the
+    nowrap option of psutil does, when a counter goes down (it wrapped
+    around or the device was reset) its last value is added to it from
+    then on
+    """
+    def __init__(self):
+        self.last = {}
+        self.offsets = {}
+
+    def update(self, name, counters):
+        """update(name, counters)
+
+        The method returns the counters of the device corrected for the
+        wraps seen so far
+        """
+        last = self.last.get(name)
+        offsets = self.offsets.setdefault(name, [0] * len(counters))
+        if last is not None:
+            for index, (old, new) in enumerate(zip(last, counters)):
+                if new < old:
+                    offsets[index] += old
+        self.last[name] = counters
+        return [value + offset for value, offset in zip(counters, offsets)]
+
+def read_cpu_model(default_value="unknown"):
+    """read_cpu_model([default_value])
+
+    The method returns the first model name listed in /proc/cpuinfo
+    """
+    for line in read_file("{}/cpuinfo".format(PROC_DIR)).splitlines():
+        key, _, value = line.partition(':')
+        if key.strip() == "model name":
+            return value.strip()
+    return default_value
+
+def list_cpu_dirs():
+    """list_cpu_dirs()
+
+    The method returns the sysfs directories of all the CPUs, cpu0 to
+    cpuN, sorted by CPU number
+    """
+    cpu_dir = "{}/devices/system/cpu".format(SYS_DIR)
+    try:
+        names = os.listdir(cpu_dir)
+    except OSError:
+        return []
+    numbers = sorted(int(name[3:]) for name in names if name.startswith("cpu") and name[3:].isdigit())
+    record_dir(cpu_dir, ["cpu{}".format(number) for number in numbers])
+    return ["{}/cpu{}".format(cpu_dir, number) for number in numbers]
+
+def parse_size(text):
+    """parse_size(text)
+
+    The method parses a sysfs size such as 32K or 8M into bytes
+    """
+    text = text.strip()
+    units = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+    if text[-1:] in units:
+        return int(text[:-1]) * units[text[-1]]
+    return int(text)
+
+def read_cpu_caches(cpu_dirs):
+    """read_cpu_caches(cpu_dirs)
+
+    The method returns the total size of every cache level (L1d, L1i, L2,
+    L3, ...) in bytes. A cache shared by several CPUs is listed under each
+    of them, its shared_cpu_list is read first and the cache is only read
+    and counted for the first CPU listing it
+    """
+    caches = {}
+    seen = set()
+    for cpu_dir in cpu_dirs:
+        try:
+            index_names = os.listdir("{}/cache".format(cpu_dir))
+        except OSError:
+            continue
+        index_names = sorted(name for name in index_names if name.startswith("index"))
+        record_dir("{}/cache".format(cpu_dir), index_names)
+        for index_name in index_names:
+            index_dir = "{}/cache/{}".format(cpu_dir, index_name)
+            shared_cpu_list = read_file("{}/shared_cpu_list".format(index_dir)).strip()
+            if (index_name, shared_cpu_list) in seen:
+                continue
+            seen.add((index_name, shared_cpu_list))
+            try:
+                level = int(read_file("{}/level".format(index_dir)))
+                size = parse_size(read_file("{}/size".format(index_dir), "0"))
+            except ValueError:
+                continue
+            cache_type = read_file("{}/type".format(index_dir)).strip()
+            cache_key = "L{}{}".format(level, {"Data": "d", "Instruction": "i"}.get(cache_type, ""))
+            caches[cache_key] = caches.get(cache_key, 0) + size
+    return caches
+
+def read_cpu_topology(cpu_dirs):
+    """read_cpu_topology(cpu_dirs)
+
+    The method returns the number of NUMA nodes, sockets, physical cores
+    and hardware threads per core of the host, the cores are told apart
+    by their lists of thread siblings
+    """
+    packages = set()
+    cores = set()
+    threads_per_core = 1
+    for cpu_dir in cpu_dirs:
+        topology_dir = "{}/topology".format(cpu_dir)
+        package = read_file("{}/physical_package_id".format(topology_dir)).strip()
+        siblings = read_file("{}/thread_siblings_list".format(topology_dir)).strip()
+        if package:
+            packages.add(package)
+        if siblings:
+            cores.add(siblings)
+            threads_per_core = max(threads_per_core, len(parse_cpu_list(siblings)))
+
+    node_dir = "{}/devices/system/node".format(SYS_DIR)
+    try:
+        nodes = [name for name in os.listdir(node_dir) if name.startswith("node") and name[4:].isdigit()]
+    except OSError:
+        nodes = []
+    record_dir(node_dir, nodes)
+    return {
+        # a kernel without NUMA support has a single node
+        "vNumaNodes": max(1, len(nodes)),
+        "vCpuSockets": len(packages),
+        "vCpuCores": len(cores),
+        "vCpuThreadsPerCore": threads_per_core,
+    }
+
+def parse_cpu_list(text):
+    """parse_cpu_list(text)
+
+    The method expands a sysfs CPU list such as 0-3,8-11 into CPU numbers
+    """
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+def read_kernel_info():
+    """read_kernel_info()
+
+    The method returns the line uname -a prints, the operating system,
+    host name, release, version and architecture of the kernel, from
+    /proc/sys/kernel so that another root reports its own kernel. The
+    files a tree does not hold are left out
+    """
+    fields = [read_file("{}/sys/kernel/{}".format(PROC_DIR, name)).strip() for name in KERNEL_FILES]
+    if fields[0] == "Linux":
+        # the operating system uname prints last
+        fields.append("GNU/Linux")
+    return " ".join(field for field in fields if field)
+
+def read_boot_id(default_value=""):
+    """read_boot_id([default_value])
+
+    The method returns the random identifier the kernel draws at every boot
+    """
+    return read_file("{}/sys/kernel/random/boot_id".format(PROC_DIR), default_value).strip()
+
+def get_block_devices():
+    """get_block_devices()
+
+    The method returns the list of (name, "major:minor") pairs of the whole
+    disks on the host, the same set "lsblk -a | grep disk" reports, by
+    scanning /sys/block. Loop, device-mapper, software RAID and optical
+    devices are skipped. The result does not change while profiling so
+    callers should resolve it once at startup.
+    """
+    block_dir = "{}/block".format(SYS_DIR)
+    try:
+        names = os.listdir(block_dir)
+    except OSError:
+        return []
+
+    record_dir(block_dir, names)
+    devices = []
+    # sorted by name like lsblk, the first disk is the same on every scan
+    for name in sorted(names):
+        if name.startswith(("loop", "dm-", "md", "sr")):
+            continue
+        major_minor = read_file("{}/{}/dev".format(block_dir, name)).strip()
+        if major_minor:
+            devices.append((name, major_minor))
+    return devices
+
+def list_pids():
+    """list_pids()
+
+    The method returns the sorted process ids listed in /proc
+    """
+    try:
+        names = [name for name in os.listdir(PROC_DIR) if name.isdigit()]
+    except OSError:
+        return []
+    record_dir(PROC_DIR, names)
+    return sorted(int(name) for name in names)
+
+def list_cgroup_pids(cgroup_path):
+    """list_cgroup_pids(cgroup_path)
+
+    The method returns the sorted process ids of a cgroup (v1 or v2) and of
+    all its descendant cgroups, cgroup.procs only lists the processes
+    attached directly to one cgroup
+    """
+    pids = set()
+    for directory, _subdirectories, files in os.walk(cgroup_path):
+        if "cgroup.procs" not in files:
+            continue
+        for line in read_file("{}/cgroup.procs".format(directory)).split():
+            pids.add(int(line))
+    return sorted(pids)
+
+def list_child_pids(root_pid):
+    """list_child_pids(root_pid)
+
+    The method returns the sorted process ids of the process tree rooted
+    at root_pid (the root included) by following the children files of
+    /proc/<pid>/task/<tid>, a process that has exited is left out
+    """
+    pids = set()
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            tids = os.listdir("{}/{}/task".format(PROC_DIR, pid))
+        except OSError:
+            continue
+        record_dir("{}/{}/task".format(PROC_DIR, pid), tids)
+        pids.add(pid)
+        for tid in tids:
+            for child in read_file("{}/{}/task/{}/children".format(PROC_DIR, pid, tid)).split():
+                if int(child) not in pids:
+                    pending.append(int(child))
+    return sorted(pids)
+
+def read_process(pid):
+    """read_process(pid)
+
+    The method parses /proc/<pid>/stat and /proc/<pid>/status of one process
+    and returns its counters in a dictionary, or None when the process
+    has exited. The command line does not change during the life of a
+    process, it is read once and cached by (pid, start time)
+    """
+    stat = read_file("{}/{}/stat".format(PROC_DIR, pid))
+    status = read_file("{}/{}/status".format(PROC_DIR, pid))
+    if not stat or not status:
+        return None
+
+    # the name may contain spaces and parentheses, the fields follow the last ')'
+    name_end = stat.rindex(')')
+    fields = stat[name_end + 2:].split()
+    start_time = int(fields[19])
+
+    voluntary_ctxt_switches = 0
+    nonvoluntary_ctxt_switches = 0
+    for line in status.splitlines():
+        if line.startswith("voluntary_ctxt_switches:"):
+            voluntary_ctxt_switches = int(line.split()[1])
+        elif line.startswith("nonvoluntary_ctxt_switches:"):
+            nonvoluntary_ctxt_switches = int(line.split()[1])
+
+    key = (pid, start_time)
+    static = process_cache.get(key)
+    if static is None:
+        cmdline = read_file("{}/{}/cmdline".format(PROC_DIR, pid))
+        if cmdline.endswith('\0'):
+            cmdline = cmdline[:-1]
+        arguments = cmdline.split('\0')
+        static = (" ".join(arguments), os.path.basename(arguments[0]))
+        process_cache[key] = static
+
+    # the kernel truncates the name to 15 characters, the full name is
+    # recovered from the command line the same way psutil does
+    name = stat[stat.index('(') + 1:name_end]
+    if len(name) >= 15 and static[1].startswith(name):
+        name = static[1]
+
+    return {
+        "pid": pid,
+        "start_time": start_time,
+        "cmdline": static[0],
+        "name": name,
+        "ppid": int(fields[1]),
+        "minflt": int(fields[7]),
+        "majflt": int(fields[9]),
+        "utime": int(fields[11]),
+        "stime": int(fields[12]),
+        "cutime": int(fields[13]),
+        "cstime": int(fields[14]),
+        "num_threads": int(fields[17]),
+        "vsize": int(fields[20]),
+        "rss": int(fields[21]) * PAGE_SIZE,
+        "blkio_ticks": int(fields[39]),
+        "voluntary_ctxt_switches": voluntary_ctxt_switches,
+        "nonvoluntary_ctxt_switches": nonvoluntary_ctxt_switches,
+    }
+
+def read_processes(pids):
+    """read_processes(pids)
+
+    The method reads the given processes and drops the cached static
+    fields of the processes that are gone
+    """
+    processes = []
+    for pid in pids:
+        try:
+            process = read_process(pid)
+        except (ValueError, IndexError):
+            process = None
+        if process is not None:
+            processes.append(process)
+
+    alive = set((process["pid"], process["start_time"]) for process in processes)
+    for key in [key for key in process_cache if key not in alive]:
+        del process_cache[key]
+    return processes
@@ -14,10 +14,28 @@
 #     2022/05/24 : varikmp - report the sample collection time in ms
 #     2022/06/24 : varikmp - add option for metric level setup
 #     2025/10/16 : varikmp - swap the order of two time steps
+#     2026/10/18 : wlloyd  - add a persistent sampler daemon
+#                          - add the ndjson output format
+#                          - compute the aggregate values of a run in one python process
+#                          - export the delta values and the process table in one python process
+#                          - add the batch tool aggregating all runs below a directory
+#                          - add the downsampling method of the graph tool
+#                          - serve the live samples in OpenMetrics format
+#                          - compute the deltas while sampling, keyframes and sample ring
+#                          - collect the metric levels in parallel threads
+#                          - add the process tool ranking the process deltas
+#                          - add the adaptive time steps
+#                          - export the per-second rates and CPU utilizations
+#                          - record the sampler overhead and enforce an overhead budget
+#                          - add the per-CPU, per-disk and per-interface breakdowns
+#                          - add the binary output format
+#                          - read the virtual files below a root, record and replay them
+#                          - default to the ndjson output format below one second
 #======================================================================
 #  OPTION
 #    PROFILER_OUTPUT_DIR # specify the output directory
 #    PROFILER_TIME_STEPS # specify the time step each milliseconds
+#    SAMPLER_SOCKET      # specify the control socket (path or HOST:PORT) of the sampler daemon
 #======================================================================
 
 RED='\e[91m'
@@ -28,12 +46,37 @@ WHITE_SPACE="[[:space:]]"
 
 function usage()
 {
-    echo "Usage: $0 [profile|aggregate|csv|graph]"
+    echo "Usage: $0 [profile|sampler|aggregate|csv|batch|process|graph]"
     echo "       profile: to profile a set of commands"
     echo "         -o   --output-directory       : specify the output directory for profiling data in JSON format"
     echo "         -m   --metric-level           : specify the metric level to profile (v for VM, c for container, and p for process)"
     echo "         -t   --time-steps             : specify the time steps (in milliseconds) to profile during the command execution"
     echo "         -c   --clean-up               : clean up the profiling files from the previous run"
+    echo "         -s   --sampler-socket         : take the samples through a running sampler daemon (its own output directory is used)"
+    echo "         -p   --process-scope          : specify the processes to profile (all, cgroup for the container processes, tree for the command process tree)"
+    echo "         -f   --output-format          : specify the output format (json for one file per sample, ndjson for one file per run, binary for fixed-width records per run, default is json or ndjson below 1000 ms)"
+    echo "         -l   --metrics-listen         : serve the latest samples in OpenMetrics format on HOST:PORT or a Unix socket path"
+    echo "         -e   --persist                : specify what the time series writes (raw samples, delta values computed while sampling, or both)"
+    echo "         -k   --keyframe-interval      : write the raw sample of every n-th sample only"
+    echo "         -b   --ring-size              : keep the last samples in memory, dumped to a file on SIGQUIT"
+    echo "         -x   --concurrent             : collect the VM, container and process levels of a sample in parallel threads"
+    echo "         -B   --overhead-budget        : largest CPU percent of one core the sampler may use, the costliest level is dropped then the interval widened"
+    echo "         -D   --breakdown              : also collect the comma separated per-CPU, per-disk and per-interface counters (cpu,disk,net)"
+    echo "         -a   --adaptive               : adapt the time steps to the metric rates within MIN:MAX milliseconds (for example 10:1000)"
+    echo "       sampler: start a persistent sampler daemon in the background"
+    echo "         -o   --output-directory       : specify the output directory for profiling data in JSON format"
+    echo "         -m   --metric-level           : specify the metric level to profile (v for VM, c for container, and p for process)"
+    echo "         -t   --time-steps             : specify the default time steps (in milliseconds) of a time series"
+    echo "         -s   --sampler-socket         : specify the Unix socket path or the HOST:PORT controlling the sampler daemon"
+    echo "         -p   --process-scope          : specify the processes to profile (all, cgroup for the container processes)"
+    echo "         -f   --output-format          : specify the output format (json for one file per sample, ndjson for one file per run, binary for fixed-width records per run, default is json or ndjson below 1000 ms)"
+    echo "         -l   --metrics-listen         : serve the latest samples in OpenMetrics format on HOST:PORT or a Unix socket path"
+    echo "         -e   --persist                : specify what the time series writes (raw samples, delta values computed while sampling, or both)"
+    echo "         -k   --keyframe-interval      : write the raw sample of every n-th sample only"
+    echo "         -b   --ring-size              : keep the last samples in memory, dumped to a file on SIGQUIT"
+    echo "         -x   --concurrent             : collect the VM, container and process levels of a sample in parallel threads"
+    echo "         -B   --overhead-budget        : largest CPU percent of one core the sampler may use, the costliest level is dropped then the interval widened"
+    echo "         -D   --breakdown              : also collect the comma separated per-CPU, per-disk and per-interface counters (cpu,disk,net)"
     echo "       delta: calculate the aggregate values"
     echo "         -i   --input-directory        : specify the input directory for calculating aggregate values in JSON format"
     echo "         -o   --output-directory       : specify the output directory for calculating aggregate values in JSON format"
@@ -43,18 +86,40 @@ function usage()
     echo "         -i   --input-directory        : specify the input directory of aggregate files"
     echo "         -o   --csv-output-file        : specify the output file for CSV file generation"
     echo "         -p   --process-output-file    : specify the output file for CSV file generation"
+    echo "         -f   --export-formats         : specify the comma separated export formats (csv, parquet and feather need pyarrow)"
     echo "         -w   --overwrite              : overwrite the CSV file from the previous run"
+    echo "         -n   --no-rates               : leave out the per-second rate and CPU utilization columns"
+    echo "         -b   --breakdown-output-file  : specify the output file of the per-CPU, per-disk and per-interface deltas"
+    echo "       batch: run the delta and csv tools on every run below a directory in parallel"
+    echo "         -i   --input-directory        : specify the root directory of the runs"
+    echo "         -o   --summary-output-file    : specify the CSV file of the merged run summaries"
+    echo "         -a   --aggregate-config-file  : specify the aggregate configuration file"
+    echo "         -j   --workers                : specify the number of worker processes (default is the number of cores)"
+    echo "         -f   --force                  : aggregate all runs even when their inputs did not change"
+    echo "       process: compute the per-process deltas and rank the processes of every interval"
+    echo "         -i   --input-directory        : specify the input directory of the profiling files"
+    echo "         -o   --top-output-file        : specify the CSV file of the top processes of every interval"
+    echo "         -n   --count                  : specify the number of processes ranked per interval (default is 10)"
+    echo "         -s   --sort-field             : specify the delta the processes are ranked by (default is pCpuTime)"
+    echo "         -d   --delta-output-file      : specify the CSV file of the deltas of all processes"
+    echo "         -f   --export-formats         : specify the comma separated export formats (csv, parquet and feather need pyarrow)"
     echo "       graph: generate graphs from aggregate CSV file"
     echo "         -r   --csv-input-file         : specify the aggregate CSV file"
     echo "         -m   --metric-input-file      : specify the metric file specifying metrics for graphing"
     echo "         -g   --graph-output-directory : specify the output directory for graph images"
     echo "         -s   --single-plot            : plot single curve on a graph"
+    echo "         -d   --downsample-method      : specify the downsampling method of long series, minmax or lttb (default is minmax)"
     echo "Example:"
     echo "       $0 profile -o ./test -c -t 1 \"sleep 3\""
+    echo "       $0 sampler -o ./test -t 100 -s /tmp/sampler.sock"
+    echo "       $0 profile -s /tmp/sampler.sock -t 100 \"sleep 3\""
+    echo "       $0 sampler -o ./test -s 127.0.0.1:9200"
     echo "       $0 delta -i test/ -o test/"
     echo "       $0 delta -i test/ -o test/ -a /test/aggregate.cfg"
     echo "       $0 csv -w -i test/"
     echo "       $0 csv -w -i test/ -o test/delta.csv"
+    echo "       $0 batch -i runs/ -o runs/summary.csv"
+    echo "       $0 process -i test/ -o test/process_top.csv -n 5"
     echo "       $0 graph -r delta.csv -g test/ -m graph.cfg"
     echo "       $0 graph -r delta.csv -g test/ -m graph.cfg -s"
 }
@@ -70,19 +135,54 @@ function error()
 
 # TODO: need to have a function that check if all packages installed
 # python3: psutil
-# ubuntu: bc jq
+# ubuntu: bc jq socat
+
+function sampler_command()
+{
+    # send one command to the sampler daemon from the shell, a HOST:PORT
+    # through bash's /dev/tcp and a Unix socket through socat, so that no
+    # python interpreter is started per command
+    local REPLY
+    if [[ "$1" != */* ]] && [[ "$1" == *:* ]]
+    then
+        local HOST=${1%:*}
+        exec {SAMPLER_FD}<>/dev/tcp/${HOST:-127.0.0.1}/${1##*:} || return 1
+        echo "$2" >&$SAMPLER_FD
+        read -r -u $SAMPLER_FD REPLY
+        exec {SAMPLER_FD}>&-
+    elif command -v socat > /dev/null
+    then
+        # wait for the reply as long as the sample takes after sending the command
+        REPLY=$(echo "$2" | socat -t 600 - UNIX-CONNECT:$1)
+    else
+        REPLY=$(python3 ./daemon.py $1 $2)
+    fi
+    [[ "$REPLY" == ok* ]]
+}
+
+function is_sampler_address()
+{
+    # a Unix socket must exist, a TCP port must accept a connection
+    if [[ "$1" != */* ]] && [[ "$1" == *:* ]]
+    then
+        sampler_command $1 status
+    else
+        [ -S "$1" ]
+    fi
+}
 
 function profile()
 {
 	# assign the default metric levels: VM, Container, and Process
 	METRIC_LEVEL=vcp
+	PROCESS_SCOPE=all
 	
     # clean up status file from the previous work
     echo "" > status.log
 
     # capture the arguments
     echo -e "[$GREEN""INFO "$BLANK"] profiling commands ..."; shift
-    eval set -- "$(getopt -a --options o:m:t:cd -- "$@")"
+    eval set -- "$(getopt -a --options o:m:t:s:p:f:l:e:k:b:xB:D:a:cd -- "$@")"
     while true
     do
         ARGUMENT=$1
@@ -101,6 +201,39 @@ function profile()
             -t|--time-steps)
                 PROFILER_TIME_STEPS=$2
                 shift 2;;
+            -s|--sampler-socket)
+                SAMPLER_SOCKET=$2
+                shift 2;;
+            -p|--process-scope)
+                PROCESS_SCOPE=$2
+                shift 2;;
+            -f|--output-format)
+                OUTPUT_FORMAT_OPTION="--output-format $2"
+                shift 2;;
+            -l|--metrics-listen)
+                METRICS_OPTION="--metrics-listen $2"
+                shift 2;;
+            -e|--persist)
+                PERSIST_OPTIONS="$PERSIST_OPTIONS --persist $2"
+                shift 2;;
+            -k|--keyframe-interval)
+                PERSIST_OPTIONS="$PERSIST_OPTIONS --keyframe-interval $2"
+                shift 2;;
+            -b|--ring-size)
+                PERSIST_OPTIONS="$PERSIST_OPTIONS --ring-size $2"
+                shift 2;;
+            -x|--concurrent)
+                CONCURRENT_OPTION="--concurrent"
+                shift 1;;
+            -B|--overhead-budget)
+                OVERHEAD_OPTION="--overhead-budget $2"
+                shift 2;;
+            -D|--breakdown)
+                BREAKDOWN_OPTION="--breakdown $2"
+                shift 2;;
+            -a|--adaptive)
+                ADAPTIVE_OPTIONS="--adaptive --min-interval ${2%%:*} --max-interval ${2##*:}"
+                shift 2;;
             -c|--clean-up)
                 DO_CLEAN_UP=1
                 shift 1;;
@@ -157,18 +290,43 @@ function profile()
     fi
 
     # start profiling
-    if [ -z "$PROFILER_COMMAND_SET" ]
+    if [ ! -z "$SAMPLER_SOCKET" ]
+    then
+        # the sampler daemon is already running, only send it commands
+        if ! is_sampler_address $SAMPLER_SOCKET
+        then
+            echo -e "[$RED""ERROR"$BLANK"] could not find the sampler socket $RED$SAMPLER_SOCKET$BLANK"
+            echo "failed" > status.log
+            exit 1
+        fi
+        if [ -z "$PROFILER_COMMAND_SET" ]
+        then
+            sampler_command $SAMPLER_SOCKET sample
+            STATUS=$?
+        elif [ $(echo "$PROFILER_TIME_STEPS > 0" | bc -l) -le 0 ]
+        then
+            sampler_command $SAMPLER_SOCKET sample
+            eval "$@"
+            STATUS=$?
+            sampler_command $SAMPLER_SOCKET sample
+        else
+            sampler_command $SAMPLER_SOCKET "start $PROFILER_TIME_STEPS"
+            eval "$@"
+            STATUS=$?
+            sampler_command $SAMPLER_SOCKET stop
+        fi
+    elif [ -z "$PROFILER_COMMAND_SET" ]
     then
         # generate a single profiling file
-        python3 ./rudataall.py -$METRIC_LEVEL $PROFILER_OUTPUT_DIR
+        python3 ./rudataall.py -$METRIC_LEVEL --process-scope $PROCESS_SCOPE $OUTPUT_FORMAT_OPTION $CONCURRENT_OPTION $OVERHEAD_OPTION $BREAKDOWN_OPTION $PROFILER_OUTPUT_DIR
         STATUS=$? # must be always zero
     elif [ $(echo "$PROFILER_TIME_STEPS > 0" | bc -l) -le 0 ]
     then
         # execute the set of commands
-        python3 ./rudataall.py -$METRIC_LEVEL $PROFILER_OUTPUT_DIR
+        python3 ./rudataall.py -$METRIC_LEVEL --process-scope $PROCESS_SCOPE $OUTPUT_FORMAT_OPTION $CONCURRENT_OPTION $OVERHEAD_OPTION $BREAKDOWN_OPTION $PROFILER_OUTPUT_DIR
         eval "$@"
         STATUS=$?
-        python3 ./rudataall.py -$METRIC_LEVEL $PROFILER_OUTPUT_DIR
+        python3 ./rudataall.py -$METRIC_LEVEL --process-scope $PROCESS_SCOPE $OUTPUT_FORMAT_OPTION $CONCURRENT_OPTION $OVERHEAD_OPTION $BREAKDOWN_OPTION $PROFILER_OUTPUT_DIR
     else
         # execute the set of commands and capture the process id
         eval "$@" & PID=$!
@@ -186,7 +344,7 @@ function profile()
         
         # https://github.com/wlloyduw/ContainerProfiler/blob/david/ubuntu/entrypoint.sh
         echo $PID > profile.pid
-        python3 ./rudataall.py -$METRIC_LEVEL $PROFILER_OUTPUT_DIR $PROFILER_TIME_STEPS
+        python3 ./rudataall.py -$METRIC_LEVEL --process-scope $PROCESS_SCOPE $OUTPUT_FORMAT_OPTION $METRICS_OPTION $PERSIST_OPTIONS $CONCURRENT_OPTION $OVERHEAD_OPTION $BREAKDOWN_OPTION $ADAPTIVE_OPTIONS $PROFILER_OUTPUT_DIR $PROFILER_TIME_STEPS
         STATUS=$?
     fi
 
@@ -202,6 +360,91 @@ function profile()
     fi
 }
 
+function sampler()
+{
+	# assign the default metric levels: VM, Container, and Process
+	METRIC_LEVEL=vcp
+	PROCESS_SCOPE=all
+	PROFILER_TIME_STEPS=0
+
+    # capture the arguments
+    echo -e "[$GREEN""INFO "$BLANK"] starting the sampler daemon ..."; shift
+    eval set -- "$(getopt -a --options o:m:t:s:p:f:l:e:k:b:xB:D: -- "$@")"
+    while true
+    do
+        case "$1" in
+            -o|--output-directory)
+                PROFILER_OUTPUT_DIR=$2
+                shift 2;;
+            -m|--metric-level)
+                METRIC_LEVEL=$2
+                shift 2;;
+            -t|--time-steps)
+                PROFILER_TIME_STEPS=$2
+                shift 2;;
+            -s|--sampler-socket)
+                SAMPLER_SOCKET=$2
+                shift 2;;
+            -p|--process-scope)
+                PROCESS_SCOPE=$2
+                shift 2;;
+            -f|--output-format)
+                OUTPUT_FORMAT_OPTION="--output-format $2"
+                shift 2;;
+            -l|--metrics-listen)
+                METRICS_OPTION="--metrics-listen $2"
+                shift 2;;
+            -e|--persist)
+                PERSIST_OPTIONS="$PERSIST_OPTIONS --persist $2"
+                shift 2;;
+            -k|--keyframe-interval)
+                PERSIST_OPTIONS="$PERSIST_OPTIONS --keyframe-interval $2"
+                shift 2;;
+            -b|--ring-size)
+                PERSIST_OPTIONS="$PERSIST_OPTIONS --ring-size $2"
+                shift 2;;
+            -x|--concurrent)
+                CONCURRENT_OPTION="--concurrent"
+                shift 1;;
+            -B|--overhead-budget)
+                OVERHEAD_OPTION="--overhead-budget $2"
+                shift 2;;
+            -D|--breakdown)
+                BREAKDOWN_OPTION="--breakdown $2"
+                shift 2;;
+            --)
+                break;;
+        esac
+    done
+
+    # check if the output directory is unset or not existed
+    if [ -z "$PROFILER_OUTPUT_DIR" ] || [ ! -d "$PROFILER_OUTPUT_DIR" ]
+    then
+        echo -e "[$YELLOW""WARN "$BLANK"] could not find the output directory $YELLOW$PROFILER_OUTPUT_DIR$BLANK"
+        echo -e "[$YELLOW""WARN "$BLANK"] set it to the current directory $YELLOW$(pwd)$BLANK"
+        PROFILER_OUTPUT_DIR="$(pwd)"
+    fi
+
+    # check if the socket is unset
+    if [ -z "$SAMPLER_SOCKET" ]
+    then
+        SAMPLER_SOCKET="$(pwd)/sampler.sock"
+        echo -e "[$YELLOW""WARN "$BLANK"] did not specify the sampler socket, set it to $YELLOW$SAMPLER_SOCKET$BLANK"
+    fi
+
+    python3 ./rudataall.py -$METRIC_LEVEL --process-scope $PROCESS_SCOPE $OUTPUT_FORMAT_OPTION $METRICS_OPTION $PERSIST_OPTIONS $CONCURRENT_OPTION $OVERHEAD_OPTION $BREAKDOWN_OPTION --daemon $SAMPLER_SOCKET $PROFILER_OUTPUT_DIR $PROFILER_TIME_STEPS &
+    echo $! > sampler.pid
+
+    # wait until the daemon serves the control socket
+    for RETRY in $(seq 1 50)
+    do
+        is_sampler_address $SAMPLER_SOCKET 2> /dev/null && break
+        sleep 0.1
+    done
+    echo -e "[$GREEN""INFO "$BLANK"] the sampler daemon $GREEN$(cat sampler.pid)$BLANK is listening on $GREEN$SAMPLER_SOCKET$BLANK"
+    echo -e "[$GREEN""INFO "$BLANK"] stop it with: python3 ./daemon.py $SAMPLER_SOCKET quit"
+}
+
 function delta()
 {
     # clean up status file from the previous work
@@ -283,92 +526,34 @@ function delta()
     # clean up the output directory before profiling
     if [ ! -z "$DO_CLEAN_UP" ]
     then
-        find $AGGREGATE_OUTPUT_DIR -name "delta_????_??_??_??_??_??.json" | xargs -r rm -f
+        find $AGGREGATE_OUTPUT_DIR -name "delta_????_??_??_??_??_??.json" -o -name "delta_????_??_??_??_??_??*.ndjson" | xargs -r rm -f
     fi
 
     # start calculating aggregate values
-    # must sort all files in output directory to alternatively take the aggregate values
-    PROFILING_FILES=$(find $PROFILING_INPUT_DIR -name "????_??_??_??_??_??.json" | sort)
-    IFS=$'\n' read -rd '' -a PROFILING_FILES <<< "$PROFILING_FILES"
-    SIZE=$((${#PROFILING_FILES[@]}-1))
-
-    for INDEX in $(seq 1 $SIZE)
-    do
-        PREV_INDEX=$(($INDEX-1))
-        ./aggregate.sh ${PROFILING_FILES[$PREV_INDEX]} ${PROFILING_FILES[$INDEX]} $AGGREGATE_CONFIG_FILE > $AGGREGATE_OUTPUT_DIR/delta_$(date '+%Y_%m_%d_%H_%M_%S').json
-    done
+    # the whole run is loaded once and all pairs of consecutive files are aggregated together
+    # (aggregate.sh computes the same values for a single pair of files)
+    if [ -z "$AGGREGATE_CONFIG_FILE" ]
+    then
+        AGGREGATE_CONFIG_FILE=aggregate.cfg
+    fi
+    python3 ./aggregate.py $PROFILING_INPUT_DIR $AGGREGATE_OUTPUT_DIR $AGGREGATE_CONFIG_FILE
 
     # report the status code (assume the aggregate calculation is always correct)
     echo -e "[$GREEN""INFO "$BLANK"] calculating aggregate values passed"
     echo "passed" > status.log
 }
 
-function keys()
-{
-    JSON_FILE=$1
-    local CURRENT_PATH=$2
-
-    if [ -z "$CURRENT_PATH" ]; then
-        KEY_LIST=$(jq $CURRENT_PATH'keys' "$1" | sed '1d;$d;s/,$//;s/^ *//g;s/^.//g;s/.$//g' | tr '\r\n' ' ')
-    else
-        KEY_LIST=$(jq $CURRENT_PATH'|keys' "$1" | sed '1d;$d;s/,$//;s/^ *//g;s/^.//g;s/.$//g' | tr '\r\n' ' ')
-    fi
-
-    if [ ! -z "$KEY_LIST" ]
-    then
-        for KEY in ${KEY_LIST[@]}
-        do
-            case "$(jq -r $CURRENT_PATH[\"$KEY\"]\|type "$1" <<< '""')" in
-
-                "object")
-                    keys "$JSON_FILE" "$CURRENT_PATH[\"$KEY\"]"
-                    ;;
-
-                *)
-					printf "$KEY,"
-					;;
-            esac
-        done
-    fi
-}
-
-function values()
-{
-	JSON_FILE=$1
-    local CURRENT_PATH=$2
-
-    if [ -z "$CURRENT_PATH" ]; then
-        KEY_LIST=$(jq $CURRENT_PATH'keys' "$1" | sed '1d;$d;s/,$//;s/^ *//g;s/^.//g;s/.$//g' | tr '\r\n' ' ')
-    else
-        KEY_LIST=$(jq $CURRENT_PATH'|keys' "$1" | sed '1d;$d;s/,$//;s/^ *//g;s/^.//g;s/.$//g' | tr '\r\n' ' ')
-    fi
-
-    if [ ! -z "$KEY_LIST" ]
-    then
-        for KEY in ${KEY_LIST[@]}
-        do
-            case "$(jq -r $CURRENT_PATH[\"$KEY\"]\|type "$1" <<< '""')" in
-
-                "object")
-                    values "$JSON_FILE" "$CURRENT_PATH[\"$KEY\"]"
-                    ;;
-
-                *)
-					printf "$(jq -r $CURRENT_PATH[\"$KEY\"] "$1" <<< '""'),"
-					;;
-            esac
-        done
-    fi
-}
-
 function csv()
 {
     # clean up status file from the previous work
     echo "" > status.log
 
     # capture the arguments
+    EXPORT_FORMATS=csv
+    RATES_OPTION=""
+    BREAKDOWN_OPTION=""
     echo -e "[$GREEN""INFO "$BLANK"] generating CSV files ..."; shift
-    eval set -- "$(getopt -a --options i:o:p:w -- "$@")"
+    eval set -- "$(getopt -a --options i:o:p:f:wnb: -- "$@")"
     while true
     do
         case "$1" in
@@ -381,9 +566,18 @@ function csv()
             -p|--process-output-file)
                 PROC_OUTPUT_FILE=$2
                 shift 2;;
+            -f|--export-formats)
+                EXPORT_FORMATS=$2
+                shift 2;;
             -w|--overwrite-file)
                 DO_OVERWRITE=$2
                 shift 1;;
+            -n|--no-rates)
+                RATES_OPTION="-n"
+                shift 1;;
+            -b|--breakdown-output-file)
+                BREAKDOWN_OPTION="-b $2"
+                shift 2;;
             --)
                 break;;
         esac
@@ -412,29 +606,6 @@ function csv()
         fi
     fi
     
-    # check for the static metrics
-    FOUND_STATIC=$(find $DELTA_INPUT_DIR -name "static.json")
-    if [ -z "$FOUND_STATIC" ]
-    then
-        echo -e "[$RED""WARN "$BLANK"] could not find static file (static.json) in $DELTA_INPUT_DIR"
-    else
-        STATIC_FIELDS=$(keys $DELTA_INPUT_DIR/static.json .)
-        STATIC_VALUES=$(values $DELTA_INPUT_DIR/static.json .)
-    fi
-    
-    # set up fields
-    #PROC_FIELDS="pId,pCmdline,pName,pNumThreads,pCpuTimeUserMode,pCpuTimeKernelMode,pChildrenUserMode,pChildrenKernelMode,pVoluntaryContextSwitches,pInvoluntaryContextSwitches,pBlockIODelays,pVirtualMemoryBytes"
-    FOUND_DELTA=$(find $DELTA_INPUT_DIR -name "delta_????_??_??_??_??_??.json")
-    if [ -z "$FOUND_DELTA" ]
-    then
-        echo -e "[$RED""ERROR"$BLANK"] could not find any delta files in $DELTA_INPUT_DIR"
-        exit
-    fi
-    
-    DELTA_TEMPLATE_FILE=$(echo ${FOUND_DELTA[0]} | cut -d" " -f1)
-    DELTA_FIELDS=$(jq 'keys' $DELTA_TEMPLATE_FILE | sed '1d;$d;s/,$//;s/^ *//g;s/^.//g;s/.$//g' | tr '\n' ',' | sed 's/,$//')
-    DELTA_FILTERS=$(echo $DELTA_FIELDS | sed 's/^/[./g;s/$/] | @csv/g;s/,/,./g')
-
     # check if the CSV output file is unset
     if [ -z "$CSV_OUTPUT_FILE" ]
     then
@@ -450,22 +621,20 @@ function csv()
         esac
     fi
 
-<< 'PROCESS_OUTPUT_FILE_ENABLE' 
-    # check if the CSV output file is unset
+    # check if the process output file is unset
     if [ -z "$PROC_OUTPUT_FILE" ]
     then
         echo -e "[$YELLOW""WARN "$BLANK"] did not specify the process output file."
-        echo -e "[$YELLOW""WARN "$BLANK"] set it to $YELLOW./process.csv$BLANK"
+        echo -e "[$YELLOW""WARN "$BLANK"] set it to $YELLOW$(dirname $CSV_OUTPUT_FILE)/process.csv$BLANK"
         PROC_OUTPUT_FILE="$(dirname $CSV_OUTPUT_FILE)/process.csv"
     else
-        # check if the CSV output file is absolute path
+        # check if the process output file is absolute path
         case $PROC_OUTPUT_FILE in
             /*) ;;
             ./*) PROC_OUTPUT_FILE="$(pwd)/${PROC_OUTPUT_FILE:2}" ;;
             *) PROC_OUTPUT_FILE="$(pwd)/${PROC_OUTPUT_FILE}" ;;
         esac
     fi
-PROCESS_OUTPUT_FILE_ENABLE
 
     # check if the CSV output file is existed and overwrite flag is on
     if [ ! -z "$DO_OVERWRITE" ] && [ -f "$CSV_OUTPUT_FILE" ]
@@ -483,61 +652,73 @@ PROCESS_OUTPUT_FILE_ENABLE
         rm -f $PROC_OUTPUT_FILE
     fi
 
-    # write headers to CSV output file
-    echo "$STATIC_FIELDS$DELTA_FIELDS" > $CSV_OUTPUT_FILE
-    
-    #echo "$PROC_FIELDS" >> $PROC_OUTPUT_FILE
-
     # print out arguments
     echo -e "[$GREEN""INFO "$BLANK"] the input directory of the profiling: $GREEN$DELTA_INPUT_DIR$BLANK"
     echo -e "[$GREEN""INFO "$BLANK"] the CSV output file of the profiling: $GREEN$CSV_OUTPUT_FILE$BLANK"
 
-    DELTA_FILES=$(find $DELTA_INPUT_DIR -name "delta_????_??_??_??_??_??.json" | sort)
-    for DELTA_FILE in $DELTA_FILES
+    # stream all delta files and the process lists of the samples through one python process
+    if ! python3 ./export.py -i $DELTA_INPUT_DIR -o $CSV_OUTPUT_FILE -p $PROC_OUTPUT_FILE -f $EXPORT_FORMATS $RATES_OPTION $BREAKDOWN_OPTION
+    then
+        echo -e "[$RED""ERROR"$BLANK"] could not export the delta files in $DELTA_INPUT_DIR"
+        echo "failed" > status.log
+        exit
+    fi
+    echo "passed" > status.log
+}
+
+function batch()
+{
+    # clean up status file from the previous work
+    echo "" > status.log
+
+    # capture the arguments
+    BATCH_ARGUMENTS=""
+    echo -e "[$GREEN""INFO "$BLANK"] aggregating runs ..."; shift
+    eval set -- "$(getopt -a --options i:o:a:j:f -- "$@")"
+    while true
     do
-        printf "$STATIC_VALUES" >> $CSV_OUTPUT_FILE
-        jq -r "$DELTA_FILTERS" $DELTA_FILE >> $CSV_OUTPUT_FILE
-
-<< 'PROCESS_OUTPUT_FILE_ENABLE'
-        pId=$(jq -r ".pProcesses[].pId" $DELTA_FILE)
-        pCmdline=$(jq -r ".pProcesses[].pCmdline" $DELTA_FILE)
-        pName=$(jq -r ".pProcesses[].pName" $DELTA_FILE)
-        pNumThreads=$(jq -r ".pProcesses[].pNumThreads" $DELTA_FILE)
-        pCpuTimeUserMode=$(jq -r ".pProcesses[].pCpuTimeUserMode" $DELTA_FILE)
-        pCpuTimeKernelMode=$(jq -r ".pProcesses[].pCpuTimeKernelMode" $DELTA_FILE)
-        pChildrenUserMode=$(jq -r ".pProcesses[].pChildrenUserMode" $DELTA_FILE)
-        pChildrenKernelMode=$(jq -r ".pProcesses[].pChildrenKernelMode" $DELTA_FILE)
-        pVoluntaryContextSwitches=$(jq -r ".pProcesses[].pVoluntaryContextSwitches" $DELTA_FILE)
-        pInvoluntaryContextSwitches=$(jq -r ".pProcesses[].pInvoluntaryContextSwitches" $DELTA_FILE)
-        pBlockIODelays=$(jq -r ".pProcesses[].pBlockIODelays" $DELTA_FILE)
-        pVirtualMemoryBytes=$(jq -r ".pProcesses[].pVirtualMemoryBytes" $DELTA_FILE)
-
-        IFS=$'\n' read -rd '' -a pId <<< "$pId"
-        IFS=$'\n' read -rd '' -a pCmdline <<< "$pCmdline"
-        IFS=$'\n' read -rd '' -a pName <<< "$pName"
-        IFS=$'\n' read -rd '' -a pNumThreads <<< "$pNumThreads"
-        IFS=$'\n' read -rd '' -a pCpuTimeUserMode <<< "$pCpuTimeUserMode"
-        IFS=$'\n' read -rd '' -a pCpuTimeKernelMode <<< "$pCpuTimeKernelMode"
-        IFS=$'\n' read -rd '' -a pChildrenUserMode <<< "$pChildrenUserMode"
-        IFS=$'\n' read -rd '' -a pChildrenKernelMode <<< "$pChildrenKernelMode"
-        IFS=$'\n' read -rd '' -a pVoluntaryContextSwitches <<< "$pVoluntaryContextSwitches"
-        IFS=$'\n' read -rd '' -a pInvoluntaryContextSwitches <<< "$pInvoluntaryContextSwitches"
-        IFS=$'\n' read -rd '' -a pBlockIODelays <<< "$pBlockIODelays"
-        IFS=$'\n' read -rd '' -a pVirtualMemoryBytes <<< "$pVirtualMemoryBytes"
-
-        count=${#pId[@]}
-        for ((index = 0; index < $count; index++))
-        do
-            echo "${pId[$index]},${pCmdline[$index]},${pName[$index]},${pNumThreads[$index]},${pCpuTimeUserMode[$index]},${pCpuTimeKernelMode[$index]},${pChildrenUserMode[$index]},${pChildrenKernelMode[$index]},${pVoluntaryContextSwitches[$index]},${pInvoluntaryContextSwitches[$index]},${pBlockIODelays[$index]},${pVirtualMemoryBytes[$index]}" >> $PROC_OUTPUT_FILE
-        done
-PROCESS_OUTPUT_FILE_ENABLE
+        case "$1" in
+            -i|--input-directory)
+                BATCH_INPUT_DIR=$2
+                shift 2;;
+            -o|--summary-output-file)
+                BATCH_ARGUMENTS="$BATCH_ARGUMENTS --summary-file $2"
+                shift 2;;
+            -a|--aggregate-configuration)
+                AGGREGATE_CONFIG_FILE=$2
+                shift 2;;
+            -j|--workers)
+                BATCH_ARGUMENTS="$BATCH_ARGUMENTS --workers $2"
+                shift 2;;
+            -f|--force)
+                BATCH_ARGUMENTS="$BATCH_ARGUMENTS --force"
+                shift 1;;
+            --)
+                break;;
+        esac
     done
 
-<< 'PROCESS_OUTPUT_FILE_ENABLE'
-    # sort the process CSV output file (first column and ignore the others)
-    sort -sk1,1n -o $PROC_OUTPUT_FILE $PROC_OUTPUT_FILE
-PROCESS_OUTPUT_FILE_ENABLE
-    echo "passed" > status.log
+    # check if the input directory is unset
+    if [ -z "$BATCH_INPUT_DIR" ]
+    then
+        echo -e "[$YELLOW""WARN "$BLANK"] did not specify the root directory of the runs."
+        echo -e "[$YELLOW""WARN "$BLANK"] set it to the current directory $YELLOW$(pwd)$BLANK"
+        BATCH_INPUT_DIR="$(pwd)"
+    fi
+
+    if [ -z "$AGGREGATE_CONFIG_FILE" ]
+    then
+        AGGREGATE_CONFIG_FILE=aggregate.cfg
+    fi
+
+    if python3 ./batch.py $BATCH_INPUT_DIR --aggregate-config-file $AGGREGATE_CONFIG_FILE $BATCH_ARGUMENTS
+    then
+        echo -e "[$GREEN""INFO "$BLANK"] aggregating runs passed"
+        echo "passed" > status.log
+    else
+        echo -e "[$RED""ERROR"$BLANK"] aggregating runs failed"
+        echo "failed" > status.log
+    fi
 }
 
 function graph()
@@ -547,7 +728,7 @@ function graph()
 
     # capture the arguments
     echo -e "[$GREEN""INFO "$BLANK"] graphing metrics ..."; shift
-    eval set -- "$(getopt -a --options r:m:g:s -- "$@")"
+    eval set -- "$(getopt -a --options r:m:g:sd: -- "$@")"
     while true
     do
         case "$1" in
@@ -563,6 +744,9 @@ function graph()
             -s|--single-plot)
                 SINGLE_PLOT=1
                 shift 1;;
+            -d|--downsample-method)
+                DOWNSAMPLE_METHOD=$2
+                shift 2;;
             --)
                 break;;
         esac
@@ -640,6 +824,8 @@ function graph()
     echo -e "[$GREEN""INFO "$BLANK"] the metric input file: $GREEN$METRIC_INPUT_FILE$BLANK"
     echo -e "[$GREEN""INFO "$BLANK"] the graphing output directory: $GREEN$GRAPH_OUTPUT_DIRECTORY$BLANK"
 
+    # the series longer than the image is wide are downsampled
+    export DOWNSAMPLE_METHOD=${DOWNSAMPLE_METHOD:-minmax}
     if [ -z "$SINGLE_PLOT" ]
     then
         python3 graph.py $CSV_INPUT_FILE $GRAPH_OUTPUT_DIRECTORY $METRIC_INPUT_FILE
@@ -648,6 +834,59 @@ function graph()
     fi
 }
 
+function process()
+{
+    # clean up status file from the previous work
+    echo "" > status.log
+
+    # capture the arguments
+    PROCESS_ARGUMENTS=""
+    echo -e "[$GREEN""INFO "$BLANK"] ranking processes ..."; shift
+    eval set -- "$(getopt -a --options i:o:n:s:d:f: -- "$@")"
+    while true
+    do
+        case "$1" in
+            -i|--input-directory)
+                PROCESS_INPUT_DIR=$2
+                shift 2;;
+            -o|--top-output-file)
+                PROCESS_ARGUMENTS="$PROCESS_ARGUMENTS --top-output-file $2"
+                shift 2;;
+            -n|--count)
+                PROCESS_ARGUMENTS="$PROCESS_ARGUMENTS --count $2"
+                shift 2;;
+            -s|--sort-field)
+                PROCESS_ARGUMENTS="$PROCESS_ARGUMENTS --sort-field $2"
+                shift 2;;
+            -d|--delta-output-file)
+                PROCESS_ARGUMENTS="$PROCESS_ARGUMENTS --delta-output-file $2"
+                shift 2;;
+            -f|--export-formats)
+                PROCESS_ARGUMENTS="$PROCESS_ARGUMENTS --export-formats $2"
+                shift 2;;
+            --)
+                break;;
+        esac
+    done
+
+    # check if the input directory is unset
+    if [ -z "$PROCESS_INPUT_DIR" ]
+    then
+        echo -e "[$YELLOW""WARN "$BLANK"] did not specify the input directory of profiling files."
+        echo -e "[$YELLOW""WARN "$BLANK"] set it to the current directory $YELLOW$(pwd)$BLANK"
+        PROCESS_INPUT_DIR="$(pwd)"
+    fi
+
+    if python3 ./processdelta.py --input-directory $PROCESS_INPUT_DIR $PROCESS_ARGUMENTS
+    then
+        echo -e "[$GREEN""INFO "$BLANK"] ranking processes passed"
+        echo "passed" > status.log
+    else
+        echo -e "[$RED""ERROR"$BLANK"] ranking processes failed"
+        echo "failed" > status.log
+    fi
+}
+
 if [ -z "$1" ]
 then
     usage
@@ -658,10 +897,16 @@ fi
 case "$1" in
     "profile")
         profile "$@" ;;
+    "sampler")
+        sampler "$@" ;;
     "delta")
         delta "$@" ;;
     "csv")
         csv "$@" ;;
+    "batch")
+        batch "$@" ;;
+    "process")
+        process "$@" ;;
     "graph")
         graph "$@" ;;
     *)
@@ -0,0 +1,145 @@
+# --------------------------------------------------------------------------
+# The module records the virtual files the samples read and replays them.
+# The recorder writes the files procfs.py read during a sample, with their
+# content at the time of the read, to a numbered tree below the record
+# directory. A file read once (a command line, the CPU caches, the cgroup
+# files resolved at startup) is read again for the later samples so that
+# every tree is a complete host. A tree, recorded or written by
+# fakeroot.py, is a root for rudataall.py --root, and rudataall.py --replay
+# feeds a directory of trees through the collectors one after the other
+# without waiting, which profiles the collection of a large host (tens of
+# thousands of processes, hundreds of CPUs) without a live workload.
+#
+#   RECORD_DIR/000000/proc/...  RECORD_DIR/000000/sys/...  RECORD_DIR/000001/...
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import os
+import time
+import procfs
+
+TREE_NAME='{:06d}'
+WRITE_TIME_SUFFIX='_Write_Time'
+
+def read_again(file_path):
+    try:
+        with open(file_path, "r", errors="replace") as file_pointer:
+            return file_pointer.read()
+    except OSError:
+        return None
+
+def list_trees(replay_dir):
+    """list_trees(replay_dir)
+
+    The method returns the trees to replay, the directory itself when it
+    holds a proc directory, its subdirectories holding one otherwise,
+    sorted by name
+    """
+    if os.path.isdir(os.path.join(replay_dir, "proc")):
+        return [replay_dir]
+    try:
+        names = sorted(os.listdir(replay_dir))
+    except OSError:
+        return []
+    return [os.path.join(replay_dir, name) for name in names if os.path.isdir(os.path.join(replay_dir, name, "proc"))]
+
+class SnapshotRecorder:
+    """SnapshotRecorder(record_dir)
+
+    The class writes the files recorded by procfs.py during every sample
+    to the next numbered tree below the record directory
+    """
+    def __init__(self, record_dir):
+        self.record_dir = record_dir
+        self.count = 0
+        # every file and directory listing recorded so far
+        self.files = set()
+        self.dirs = {}
+
+    def get_tree_path(self, tree_dir, path):
+        relative_path = os.path.relpath(path, procfs.ROOT_DIR)
+        if relative_path.startswith(os.pardir):
+            return None
+        return os.path.join(tree_dir, relative_path)
+
+    def save(self, recording):
+        """save(recording)
+
+        The method writes the files and directories of the recording,
+        completed by the ones recorded by the earlier samples that still
+        exist, to the next tree and returns its directory
+        """
+        files = {}
+        for path, content in recording.items():
+            if isinstance(content, str):
+                files[path] = content
+            else:
+                self.dirs[path] = content
+        for path in self.files - set(files):
+            content = read_again(path)
+            if content is None:
+                self.files.discard(path)
+            else:
+                files[path] = content
+        self.files.update(files)
+        for path in [path for path in self.dirs if path not in recording and not os.path.isdir(path)]:
+            del self.dirs[path]
+
+        tree_dir = os.path.join(self.record_dir, TREE_NAME.format(self.count))
+        self.count += 1
+        made_dirs = set()
+        for dir_path, names in self.dirs.items():
+            for name in names:
+                tree_path = self.get_tree_path(tree_dir, os.path.join(dir_path, name))
+                if tree_path is not None and os.path.join(dir_path, name) not in files:
+                    os.makedirs(tree_path, exist_ok=True)
+                    made_dirs.add(tree_path)
+        for path, content in files.items():
+            tree_path = self.get_tree_path(tree_dir, path)
+            if tree_path is None:
+                continue
+            parent_dir = os.path.dirname(tree_path)
+            if parent_dir not in made_dirs:
+                os.makedirs(parent_dir, exist_ok=True)
+                made_dirs.add(parent_dir)
+            with open(tree_path, 'w') as outfile:
+                outfile.write(content)
+        return tree_dir
+
+class ReplaySummary:
+    """ReplaySummary()
+
+    The class sums up the samples of a replay: how many were taken per
+    second and the mean collection time of every level
+    """
+    def __init__(self):
+        self.start = time.monotonic()
+        self.samples = 0
+        self.processes = 0
+        self.write_times = {}
+
+    def add(self, sample):
+        self.samples += 1
+        self.processes += len(sample.get("pProcesses", []))
+        for key, value in sample.items():
+            if key.endswith(WRITE_TIME_SUFFIX):
+                self.write_times[key] = self.write_times.get(key, 0) + value
+
+    def summary(self):
+        """summary()
+
+        The method returns the number of samples, the elapsed seconds, the
+        samples per second, the mean number of processes and the mean
+        write time of every level in seconds
+        """
+        elapsed = time.monotonic() - self.start
+        samples = max(1, self.samples)
+        return {
+            "samples": self.samples,
+            "seconds": elapsed,
+            "samples_per_second": self.samples / elapsed if elapsed > 0 else 0,
+            "processes": self.processes / samples,
+            "write_times": {key: value / samples for key, value in self.write_times.items()},
+        }
@@ -8,7 +8,6 @@
 # email wlloyd@uw.edu
 # --------------------------------------------------------------------------
 
-import psutil
 import shutil
 import json
 import argparse
@@ -20,11 +19,28 @@ from os import path
 import os
 import glob
 import time
+import itertools
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import procfs
+import daemon
+import scheduler
+import cgroup
+import samplelog
+import aggregate
+import openmetrics
+import overhead
+import hostcache
+import breakdown
+import replay
 
 #add the virtual level.
 CORRECTION_MULTIPLIER=100
 CORRECTION_MULTIPLIER_MEMORY=(1/1000)
-CGROUP_DIR='/sys/fs/cgroup/'
+CGROUP_DIR='sys/fs/cgroup/'  # below the root
+HOSTNAME_FILE='etc/hostname'
 
 parser = argparse.ArgumentParser(description='process path and file /or string of metrics.')
 parser.add_argument('output_dir', action='store', help='stores directory to where the files will be output to')
@@ -32,9 +48,34 @@ parser.add_argument('time_series', type=int, nargs='?', default=0, help='stores
 parser.add_argument("-v", "--vm_profiling", action="store_true", default=False, help='list of metrics to graph over')
 parser.add_argument("-c", "--container_profiling", action="store_true", default=False, help='list of metrics to graph over')
 parser.add_argument("-p", "--processor_profiling", action="store_true", default=False, help='list of metrics to graph over')
+parser.add_argument("--breakdown", type=breakdown.parse_dimensions, action="store", default=[], metavar="cpu,disk,net", help='also collect the per-CPU, per-disk and/or per-interface counters, each stored as a compact array with a single timestamp')
+parser.add_argument("-s", "--process-scope", action="store", choices=['all', 'cgroup', 'tree'], default='all', help='processes to profile: all visible processes, the processes of the container cgroup, or the process tree of the profiled command (default is all)')
+parser.add_argument("--root-pid", type=int, action="store", help='root of the process tree for the tree scope (default is read from ./profile.pid)')
+parser.add_argument("-r", "--overrun", action="store", choices=scheduler.OVERRUN_POLICIES, default=scheduler.STRICT, help='what to do when a sample overruns the time series interval (default is strict)')
+parser.add_argument("-x", "--concurrent", action="store_true", default=False, help='collect the VM, container and process levels of a sample in parallel threads started together')
+parser.add_argument("-A", "--adaptive", action="store_true", default=False, help='adapt the time series interval to the rates of the container (or VM) CPU, memory, disk and network metrics')
+parser.add_argument("--min-interval", type=float, action="store", default=scheduler.MIN_INTERVAL, help='shortest adaptive interval in milliseconds (default is 10)')
+parser.add_argument("--max-interval", type=float, action="store", default=scheduler.MAX_INTERVAL, help='longest adaptive interval in milliseconds (default is 1000)')
+parser.add_argument("-B", "--overhead-budget", type=float, action="store", metavar="PERCENT", help='largest share of one core (percent) the sampler may use over the last samples, past it the costliest level is dropped, then the interval widened')
+parser.add_argument("-f", "--output-format", action="store", choices=samplelog.OUTPUT_FORMATS, help='json writes one file per sample, ndjson appends compact records to one file per run, binary appends fixed-width records under a schema written once (default is json, ndjson for a time series that can sample more than once a second)')
+parser.add_argument("--flush-interval", type=float, action="store", default=1.0, help='seconds between two flushes of the ndjson or binary file (default is 1)')
+parser.add_argument("--persist", action="store", choices=samplelog.PERSIST_MODES, default=samplelog.RAW, help='raw writes the samples, delta writes the aggregate deltas computed while sampling, both writes the two (default is raw)')
+parser.add_argument("--keyframe-interval", type=int, action="store", default=1, help='write the raw sample of every n-th sample only, starting with the first (default is 1)')
+parser.add_argument("-a", "--aggregate-config", action="store", default=aggregate.AGGREGATE_CONFIG, help='aggregate configuration file of the deltas (default is aggregate.cfg)')
+parser.add_argument("--ring-size", type=int, action="store", default=0, help='number of last samples kept in memory and dumped to ring_<time>.ndjson on SIGQUIT or the dump command of the daemon (default is 0, disabled)')
+parser.add_argument("--metrics-listen", action="store", metavar="ADDRESS", help='serve the latest samples in OpenMetrics text format on HOST:PORT or on the given Unix socket path')
+parser.add_argument("--metrics-history", type=int, action="store", default=openmetrics.HISTORY_SIZE, help='number of samples kept in memory for the metrics endpoint (default is 600)')
+parser.add_argument("--static-cache-dir", action="store", metavar="CACHE_DIR", help='directory of the host information cached per boot for static.json (default is $PROFILER_CACHE_DIR or profiler in $XDG_CACHE_HOME or ~/.cache, a directory only the user may write to)')
+parser.add_argument("-R", "--root", action="store", metavar="ROOT_DIR", help='read the proc, sys and cgroup files below the given directory, a tree recorded with --record or written by fakeroot.py, instead of / (default is /)')
+parser.add_argument("-W", "--record", action="store", metavar="RECORD_DIR", help='also write the virtual files read by every sample to a numbered tree below the given directory, the trees can be replayed')
+parser.add_argument("-P", "--replay", action="store", metavar="REPLAY_DIR", help='take one sample of every tree below the given directory (or of the directory itself when it holds a proc tree) back to back, without time series, and print the collection rate')
+parser.add_argument("-N", "--replay-count", type=int, action="store", default=0, help='number of samples of the replay, the trees are replayed in a loop (default is one sample per tree)')
+parser.add_argument("-d", "--daemon", action="store", metavar="ADDRESS", help='keep running as a sampler daemon controlled through the given Unix socket path or HOST:PORT, or signals')
 args= parser.parse_args()
 output_dir = args.output_dir
 time_series = args.time_series
+if args.output_format is None:
+    args.output_format = samplelog.default_format(time_series, args.min_interval if args.adaptive else None)
 
 if all(v is False for v in [args.vm_profiling, args.container_profiling, args.processor_profiling]):
     args.vm_profiling = True
@@ -44,11 +85,39 @@ if all(v is False for v in [args.vm_profiling, args.container_profiling, args.pr
 output_dict={}
 already_printed=False
 
+def use_root(root_dir):
+    """use_root(root_dir)
+
+    The method reads the virtual files below root_dir from now on, the
+    block devices and the cgroup backend are resolved below it again. The
+    counters of another root are not the continuation of the previous
+    ones, their wrap corrections start over
+    """
+    global BLOCK_DEVICES, STORAGE_DEVICES, CGROUP_BACKEND, DISK_WRAP, NETWORK_WRAP
+    procfs.set_root(root_dir)
+    # the disk and network counters of the host stay increasing like psutil's nowrap counters
+    DISK_WRAP=procfs.CounterWrap()
+    NETWORK_WRAP=procfs.CounterWrap()
+    BLOCK_DEVICES=procfs.get_block_devices()
+    STORAGE_DEVICES=procfs.list_storage_devices()
+    CGROUP_BACKEND=cgroup.create_backend(os.path.join(procfs.ROOT_DIR, CGROUP_DIR), BLOCK_DEVICES)
+
+REPLAY_TREES=[]
+if args.replay is not None:
+    REPLAY_TREES=replay.list_trees(args.replay)
+    if not REPLAY_TREES:
+        parser.error("no proc tree to replay in {}".format(args.replay))
+# the files resolved at startup are part of the first snapshot
+if args.record is not None:
+    procfs.start_recording()
+# the block devices and the cgroup version do not change while profiling, resolve them once
+use_root(REPLAY_TREES[0] if REPLAY_TREES else args.root or procfs.ROOT_DIR)
+
 def print_nothing(*args):
     pass
 
-def get_tick_in_ms():
-    return (time.time()) # milliseconds
+def get_time_in_seconds():
+    return (time.time()) # seconds since epoch, the t* timestamps of the metrics
 
 def get_file_content(file_path, default_value=""):
     """get_file_content(file_path, [default_value])
@@ -64,12 +133,7 @@ def get_file_content(file_path, default_value=""):
                 return default_value
             return file_content
     except FileNotFoundError:
-        if not os.path.isfile(".cgroupv2"):
-            print_console("cgroup v2 detected")
-            f = open(".cgroupv2", "a")
-            f.write("File '{}' does not exist".format(file_path))
-            f.close()
-        # print_console("File '{}' does not exist".format(file_path))
+        pass
     except:
         print_console("Could not open the file '{}'".format(file_path))
     return default_value
@@ -104,229 +168,152 @@ def is_process_running():
     else:
         return True
 
+def probe_host():
+    """probe_host()
+
+    The method returns the static metrics of the host, which do not change
+    until it reboots: the kernel, the CPU model, the total size of every
+    cache level and the CPU topology of all the CPUs
+    """
+    cpu_dirs = procfs.list_cpu_dirs()
+    host_dict = {
+        "vKernelInfo" : procfs.read_kernel_info(),
+        "vCpuType" : procfs.read_cpu_model(),
+        "vCpuCache" : procfs.read_cpu_caches(cpu_dirs),
+        "vBootTime" : float(procfs.read_stat(("btime",)).get("btime", [0])[0]),
+        "cNumProcessors": len(procfs.read_cpu_stat()),
+    }
+    host_dict.update(procfs.read_cpu_topology(cpu_dirs))
+    return host_dict
+
 def get_static_info():
     """get_static_info()
 
     Author: Varik Hoang
-    The method write all static metrics to file once
+    The method write all static metrics to file once, the host metrics
+    are probed once per boot and read from the host cache afterwards
     """
-    vKernelInfo = execute_commands(["uname -a"]).decode("utf-8")[:-1]
-    vCpuType = execute_commands(["cat /proc/cpuinfo", "grep model", "grep name", "uniq"]).decode("utf-8").split(sep=": ")[1][:-1]
-    cId=get_file_content("/etc/hostname", "unknown")[:-1]
-    
-    # -----------------------------------------
-    # Add CPU caches L1, L2, L3 to the profiler
-    # -----------------------------------------
-    vCpuCache = {}
-    cpu_dirs = glob.glob('/sys/devices/system/cpu/cpu?')
-    for cpu_dir in cpu_dirs:
-        index_dirs = glob.glob('{}/cache/index*'.format(cpu_dir))
-        for index_dir in index_dirs:
-            file = open("{}/level".format(index_dir), "r")
-            cache_level = int(file.readline()[:-1])
-            file.close()
-    
-            file = open("{}/type".format(index_dir), "r")
-            cache_type = str(file.readline()[:-1])
-            file.close()
-            if cache_type == "Data":
-                cache_type = "d"
-            elif cache_type == "Instruction":
-                cache_type = "i"
-            else:
-                cache_type = ""
-            
-            file = open("{}/shared_cpu_map".format(index_dir), "r")
-            cache_shared_cpu_map = str(file.readline()[:-1])
-            file.close()
-            
-            file = open("{}/size".format(index_dir), "r")
-            cache_size = str(file.readline()[:-1])
-            file.close()
-            
-            cache_key = "L{}{}".format(cache_level, cache_type)
-            if cache_key not in vCpuCache.keys():
-                vCpuCache[cache_key] = {}
-                cache_size_unit = cache_size[len(cache_size)-1]
-                if cache_size_unit == "K":
-                    cache_size = int(cache_size[:-1]) * 1024
-                elif cache_size_unit == "M":
-                    cache_size = int(cache_size[:-1]) * 1024 * 1024
-                else:
-                    cache_size = int(cache_size)
-                vCpuCache[cache_key][cache_shared_cpu_map] = cache_size
-            else:
-                if cache_shared_cpu_map not in vCpuCache[cache_key].keys():
-                    cache_size_unit = cache_size[len(cache_size)-1]
-                    if cache_size_unit == "K":
-                        cache_size = int(cache_size[:-1]) * 1024
-                    elif cache_size_unit == "M":
-                        cache_size = int(cache_size[:-1]) * 1024 * 1024
-                    else:
-                        cache_size = int(cache_size)
-                    vCpuCache[cache_key][cache_shared_cpu_map] = cache_size
-    
-    for cache_key in vCpuCache.keys():
-        total_size = 0
-        for shared_cpu_map in vCpuCache[cache_key].keys():
-            total_size += vCpuCache[cache_key][shared_cpu_map]
-        vCpuCache[cache_key] = total_size
-    
+    if args.root is None and args.record is None and args.replay is None:
+        host_dict = hostcache.get_fingerprint(probe_host, args.static_cache_dir)
+    else:
+        # another root is another host, and a snapshot holds the files of the probe
+        host_dict = probe_host()
+    cId=procfs.read_file(os.path.join(procfs.ROOT_DIR, HOSTNAME_FILE), "unknown").strip()
+
     vm_dict={
-        "vKernelInfo" : vKernelInfo,
-        "vCpuType" : vCpuType,
-        "vCpuCache": vCpuCache,
-        "vBootTime" : psutil.boot_time(),
+        "vKernelInfo" : host_dict["vKernelInfo"],
+        "vCpuType" : host_dict["vCpuType"],
+        "vCpuCache": host_dict["vCpuCache"],
+        "vBootTime" : host_dict["vBootTime"],
         "vId" : "unavailable",
-        "cNumProcessors": psutil.cpu_count(),
+        "cNumProcessors": host_dict["cNumProcessors"],
         "cId": cId,
     }
+    for key in ["vNumaNodes", "vCpuSockets", "vCpuCores", "vCpuThreadsPerCore"]:
+        vm_dict[key] = host_dict.get(key)
     return vm_dict
 
 def getContainerInfo():
-    cpuTime=int(get_file_content("{}/cpuacct/cpuacct.usage".format(CGROUP_DIR), 0))
-    tcpuTime = get_tick_in_ms()
-
-    container_mem_stats = get_file_content("{}/memory/memory.stat".format(CGROUP_DIR), "pgfault 0\npgmajfault 0")
-    cpgfault = int(re.findall(r'pgfault.*', container_mem_stats)[0].split()[1])
-    cpgmajfault = int(re.findall(r'pgmajfault.*', container_mem_stats)[0].split()[1])
+    container_info = CGROUP_BACKEND.read()
+    tcpuTime = get_time_in_seconds()
 
-    cpuinfo_file_stats = get_file_content("/proc/stat", "cpu 0 0 0 0 0 0 0 0 0 0") # default: 1 processor
-    cCpuTimeUserMode = int(re.findall(r'cpu.*', cpuinfo_file_stats)[0].split()[1])
-    tcCpuTimeUserMode = get_tick_in_ms()
-    cCpuTimeKernelMode = int(re.findall(r'cpu.*', cpuinfo_file_stats)[0].split()[3])
-    tcCpuTimeKernelMode = get_tick_in_ms()
-
-    cProcessorStatsFileArr = get_file_content("{}/cpuacct/cpuacct.usage_percpu".format(CGROUP_DIR), "0").split() # default: 1 processor
     cProcessorDict={}
-    count=0
-    for el in cProcessorStatsFileArr:
-        temp_str="cCpu${}TIME".format(count)
-        cProcessorDict[temp_str]=int(el)
-        tcCpuTIME = get_tick_in_ms()
-        cProcessorDict["tcCpu${}TIME".format(count)]=tcCpuTIME
-        count+=1
-
-    # data sample
-    # 8:0 53966
-    # 11:0 0
-    cDiskSectorIO = get_file_content("{}/blkio/blkio.sectors".format(CGROUP_DIR), "11:0 0\n22:0 0")
-    try:
-        cDiskSectorIOFileArr = cDiskSectorIO.split(sep='\n')
-        cDiskSectorIO = sum([int(line.split()[1]) for line in cDiskSectorIOFileArr])
-    except:
-        print_console("Could not find the virtual file {}/blkio/blkio.sectors".format(CGROUP_DIR))
-        cDiskSectorIO=0 
-    
-    cDiskReadBytes=0
-    cDiskWriteBytes=0
-    try:
-        output = execute_commands(["lsblk -a", "grep disk"])
-        major_minor_arr=[]
-        for line in output.decode('UTF-8').split(sep='\n')[:-1]:
-            major_minor_arr.append(line.split()[1])
-
-        cDiskRWBytesFile = get_file_content("{}/blkio/blkio.throttle.io_service_bytes".format(CGROUP_DIR), "259:0 Read 0\n259:0 Write 0")
-        cDiskReadBytesArr=re.findall(r'.*Read.*', cDiskRWBytesFile)
-        cDiskWriteBytesArr=re.findall(r'.*Write.*', cDiskRWBytesFile)
-
-        for el in cDiskReadBytesArr:
-            temp_arr = el.split()
-            for major_minor in major_minor_arr:
-                if (temp_arr[0] == major_minor):
-                    cDiskReadBytes += int(temp_arr[2])
-        
-        for el in cDiskWriteBytesArr:
-            temp_arr = el.split()
-            for major_minor in major_minor_arr:
-                if (temp_arr[0] == major_minor):
-                    cDiskWriteBytes += int(temp_arr[2])
-    except ValueError: # this just happens if the latest kernel version changes the way to read values
-        print_console("There is at least one disk read/write in bytes not an integer type")
-        cDiskReadBytes = 0
-        cDiskWriteBytes = 0
+    for count, el in enumerate(container_info["cpu_percpu"]):
+        cProcessorDict["cCpu${}TIME".format(count)]=el
+        cProcessorDict["tcCpu${}TIME".format(count)]=tcpuTime
 
     cNetworkBytesRecvd = 0
     cNetworkBytesSent = 0
-    cNetworkBytesFileStats = execute_commands(["cat /proc/net/dev", "grep eth0"])
     try:
-        cNetworkBytesArr = cNetworkBytesFileStats.split() # laptop does not have eth0
-        cNetworkBytesRecvd = int(cNetworkBytesArr[1])
-        cNetworkBytesSent = int(cNetworkBytesArr[9])
-    except IndexError:
+        cNetworkBytesArr = procfs.read_net_dev()["eth0"] # laptop does not have eth0
+        cNetworkBytesRecvd = cNetworkBytesArr[0]
+        cNetworkBytesSent = cNetworkBytesArr[8]
+    except (KeyError, IndexError):
         print_console("Could not find the network device eth0")
-    except ValueError: # this just happens if the latest kernel version changes the way to read values
-        print_console("There is at least one network received/sent in bytes not an integer type")
-
-    cMemoryUsed = 0
-    cMemoryMaxUsed = 0
-    try:
-        cMemoryUsed = int(get_file_content("{}/memory/memory.usage_in_bytes".format(CGROUP_DIR), "0"))
-        cMemoryMaxUsed = int(get_file_content("{}/memory/memory.max_usage_in_bytes".format(CGROUP_DIR), "0"))
-    except:
-        print_console("The memory usage in bytes not an integer type")
-
-    #CPU=(`cat /proc/stat | grep '^cpu '`)
-
-    cNumProcesses = sum(1 for line in get_file_content("{}/pids/tasks".format(CGROUP_DIR), "2")) -2
 
     container_dict={        
-        "cCpuTime": cpuTime,
+        "cCpuTime": container_info["cpu_time"],
         "tcCpuTime": tcpuTime,
-        "cPGFault": cpgfault,
-        "cMajorPGFault": cpgmajfault,
+        "cPGFault": container_info["pgfault"],
+        "cMajorPGFault": container_info["pgmajfault"],
         "cProcessorStats": cProcessorDict,
-        "cCpuTimeUserMode": cCpuTimeUserMode,
-        "tcCpuTimeUserMode": tcCpuTimeUserMode,
-        "cCpuTimeKernelMode": cCpuTimeKernelMode,
-        "tcCpuTimeKernelMode": tcCpuTimeKernelMode,
-        "cDiskSectorIO": cDiskSectorIO,
-        "cDiskReadBytes":  cDiskReadBytes,
-        "cDiskWriteBytes": cDiskWriteBytes    ,
+        "cCpuTimeUserMode": container_info["cpu_user"],
+        "tcCpuTimeUserMode": tcpuTime,
+        "cCpuTimeKernelMode": container_info["cpu_kernel"],
+        "tcCpuTimeKernelMode": tcpuTime,
+        "cDiskSectorIO": container_info["disk_sectors"],
+        "cDiskReadBytes":  container_info["disk_read_bytes"],
+        "cDiskWriteBytes": container_info["disk_write_bytes"],
         "cNetworkBytesRecvd":cNetworkBytesRecvd,
         "cNetworkBytesSent": cNetworkBytesSent,
-        "cMemoryUsed": cMemoryUsed,
-        "cMemoryMaxUsed": cMemoryMaxUsed,    
-        "cNumProcesses": cNumProcesses,
+        "cMemoryUsed": container_info["memory_used"],
+        "cMemoryMaxUsed": container_info["memory_max_used"],    
+        "cNumProcesses": container_info["num_processes"],
         "pMetricType": "Process level"
     }
+    container_dict.update(CGROUP_BACKEND.read_pressure())
     return container_dict
 
+def get_disk_totals(disk_stats):
+    """get_disk_totals(disk_stats)
+
+    The method returns the first eight counters of /proc/diskstats summed
+    over the storage devices, the totals psutil.disk_io_counters() sums:
+    reads, merged reads, sectors read, read time, then the same for writes
+    """
+    totals = [0] * 8
+    for name in STORAGE_DEVICES:
+        counters = disk_stats.get(name)
+        if counters is not None and len(counters) >= len(totals):
+            totals = [total + value for total, value in zip(totals, DISK_WRAP.update(name, counters[:len(totals)]))]
+    return totals
+
+def get_network_totals():
+    """get_network_totals()
+
+    The method returns the counters of /proc/net/dev summed over all the
+    interfaces, bytes received first and bytes sent ninth
+    """
+    totals = [0] * 16
+    for name, counters in procfs.read_net_dev().items():
+        if len(counters) >= len(totals):
+            totals = [total + value for total, value in zip(totals, NETWORK_WRAP.update(name, counters[:len(totals)]))]
+    return totals
+
 def getVmInfo():
-    cpu_info=psutil.cpu_times() # ATTENTION could not get ticks for each metrics inside this method
-    t_cpu_info = get_tick_in_ms()
-    net_info=psutil.net_io_counters(nowrap=True)
-    cpu_info2=psutil.cpu_stats()
-    disk_info=psutil.disk_io_counters()
-    memory=psutil.virtual_memory()
-    loadavg=psutil.getloadavg()
-    cpu_freq=psutil.cpu_freq()
-# get_file_content("VIRTUAL_FILE_PATH", "DEFAULT_VALUE")
-    # vm_file = open("/proc/vmstat", "r")
-    pgfault = int(execute_commands(["cat /proc/vmstat", "grep pgfault"]).split()[1])
-    pgmajfault = int(execute_commands(["cat /proc/vmstat", "grep pgmajfault"]).split()[1])
-
-    # cmd1=['lsblk', '-nd', '--output', 'NAME,TYPE']
-    # cmd2=['grep','disk']
-    # p1 = subprocess.Popen(cmd1, stdout=subprocess.PIPE)
-    # p2 = subprocess.Popen(cmd2, stdin=p1.stdout, stdout=subprocess.PIPE)
-    # o, e = p2.communicate()
-    mounted_filesys=str(execute_commands(["lsblk -nd --output NAME,TYPE", "grep disk"]).decode("utf-8").split()[0])
-    vm_disk_file=open("/proc/diskstats", "r")
-    vm_disk_file_stats=vm_disk_file.read()
-    vDiskSucessfulReads=int(re.findall(rf"{mounted_filesys}.*", vm_disk_file_stats)[0].split(sep=" ")[1])
-    vDiskSucessfulWrites=int(re.findall(rf"{mounted_filesys}.*", vm_disk_file_stats)[0].split(sep=" ")[5])
-    vDiskTotal, vDiskUsed, vDiskFree = shutil.disk_usage("/")
+    stat=procfs.read_stat()
+    cpu_info=[ticks / procfs.CLOCK_TICKS for ticks in stat.get("cpu", [0] * 8)] # ATTENTION could not get ticks for each metrics inside this method
+    t_cpu_info = get_time_in_seconds()
+    net_info=get_network_totals()
+    context_switches=stat.get("ctxt", [0])[0]
+    memory=procfs.read_meminfo()
+    loadavg=procfs.read_loadavg()
+    cpu_mhz=procfs.read_cpu_mhz()
+    vmstat = procfs.read_vmstat()
+    pgfault = vmstat.get("pgfault", 0)
+    pgmajfault = vmstat.get("pgmajfault", 0)
+
+    # the first whole disk reported in /proc/diskstats
+    vDiskSucessfulReads = 0
+    vDiskSucessfulWrites = 0
+    vm_disk_stats = procfs.read_diskstats()
+    for name, _major_minor in BLOCK_DEVICES:
+        if name in vm_disk_stats:
+            vDiskSucessfulReads = vm_disk_stats[name][0]
+            vDiskSucessfulWrites = vm_disk_stats[name][4]
+            break
+    disk_info=get_disk_totals(vm_disk_stats)
+    vDiskTotal, vDiskUsed, vDiskFree = shutil.disk_usage(procfs.ROOT_DIR)
 
 	# TODO add all ticks for each metric
     vm_dict={
         "vMetricType" : "VM Level",
         "vCpuTime" : (cpu_info[0] + cpu_info[2]) *CORRECTION_MULTIPLIER ,
         "tvCpuTime" : t_cpu_info,
-        "vDiskSectorReads" : disk_info[2]/512, 
-        "vDiskSectorWrites" : disk_info[3]/512,
-        "vNetworkBytesRecvd" : net_info[1],
-        "vNetworkBytesSent" : net_info[0], 
+        "vDiskSectorReads" : float(disk_info[2]), 
+        "vDiskSectorWrites" : float(disk_info[6]),
+        "vNetworkBytesRecvd" : net_info[0],
+        "vNetworkBytesSent" : net_info[8], 
         "vPgFault" : pgfault,
         "vMajorPageFault" : pgmajfault,
         "vCpuTimeUserMode" : cpu_info[0] * CORRECTION_MULTIPLIER, 
@@ -341,7 +328,7 @@ def getVmInfo():
         "tvCpuTimeIntSrvc" :  t_cpu_info,
         "vCpuTimeSoftIntSrvc" : cpu_info[6] * CORRECTION_MULTIPLIER,
         "tvCpuTimeSoftIntSrvc" : t_cpu_info,
-        "vCpuContextSwitches" : cpu_info2[0]* CORRECTION_MULTIPLIER,
+        "vCpuContextSwitches" : context_switches* CORRECTION_MULTIPLIER,
         "tvCpuContextSwitches" : t_cpu_info,
         "vCpuNice" : cpu_info[1]* CORRECTION_MULTIPLIER,
         "tvCpuNice" : t_cpu_info,
@@ -351,58 +338,101 @@ def getVmInfo():
         "vDiskUsed" : vDiskUsed,
         "vDiskFree" : vDiskFree,
         "vDiskSuccessfulReads" : vDiskSucessfulReads,
-        "vDiskMergedReads" : disk_info[6],
-        "vDiskReadTime" : disk_info[4],
+        "vDiskMergedReads" : disk_info[1],
+        "vDiskReadTime" : disk_info[3],
         "vDiskSuccessfulWrites" : vDiskSucessfulWrites,
-        "vDiskMergedWrites" : disk_info[7],
-        "vDiskWriteTime" : disk_info[5],
-        "vMemoryTotal" : round(memory[0] * CORRECTION_MULTIPLIER_MEMORY),    
-        "vMemoryFree" : round(memory[4]* CORRECTION_MULTIPLIER_MEMORY),
-        "vMemoryBuffers" : round(memory[7]* CORRECTION_MULTIPLIER_MEMORY),
-        "vMemoryCached" : round(memory[8]* CORRECTION_MULTIPLIER_MEMORY),
+        "vDiskMergedWrites" : disk_info[5],
+        "vDiskWriteTime" : disk_info[7],
+        # /proc/meminfo is in kB, the metrics are in thousands of bytes
+        "vMemoryTotal" : round(memory.get("MemTotal", 0) * 1024 * CORRECTION_MULTIPLIER_MEMORY),    
+        "vMemoryFree" : round(memory.get("MemFree", 0) * 1024 * CORRECTION_MULTIPLIER_MEMORY),
+        "vMemoryBuffers" : round(memory.get("Buffers", 0) * 1024 * CORRECTION_MULTIPLIER_MEMORY),
+        "vMemoryCached" : round((memory.get("Cached", 0) + memory.get("SReclaimable", 0)) * 1024 * CORRECTION_MULTIPLIER_MEMORY),
         "vLoadAvg" : loadavg[0],
-        "vCpuMhz" : cpu_freq[0]
+        "vCpuMhz" : cpu_mhz
     }
     return vm_dict
 
+def get_root_pid():
+    if args.root_pid is not None:
+        return args.root_pid
+    try:
+        with open("./profile.pid", "r") as file_pointer:
+            return int(file_pointer.read())
+    except (OSError, ValueError):
+        return None
+
+def get_process_ids():
+    """get_process_ids()
+
+    The method returns the process ids to profile for the process scope,
+    the cost of a sample then scales with the workload and not the host
+    """
+    if args.process_scope == 'cgroup':
+        return procfs.list_cgroup_pids(CGROUP_BACKEND.procs_dir)
+    if args.process_scope == 'tree':
+        root_pid = get_root_pid()
+        if root_pid is not None:
+            return procfs.list_child_pids(root_pid)
+        print_console("Could not find the root process of the tree, profile all processes")
+    return procfs.list_pids()
+
 def getProcInfo():
-    #need to get pPGFault/pMajorPGFault in a different verbosity level: maybe called MP for manual process
-    #pResidentSetSize needs to be get in MP
+    # one read of /proc/<pid>/stat and /proc/<pid>/status per process and sample
     dictlist=[]
-    for proc in psutil.process_iter():
-        #procFile="/proc/{}/stat".format(proc.pid) 
-        #log = open(procFile, "r")
-        #pidProcStat=log.readline().split()
-        try:
-            curr_dict={
-                "pId" : proc.pid,
-                "pCmdline" : " ".join(proc.cmdline()),
-                "pName" : proc.name(),
-                "pNumThreads" : proc.num_threads(),
-                "pCpuTimeUserMode" : proc.cpu_times()[0]* CORRECTION_MULTIPLIER,
-                "pCpuTimeKernelMode" : proc.cpu_times()[1]* CORRECTION_MULTIPLIER,
-                "pChildrenUserMode" : proc.cpu_times()[2]* CORRECTION_MULTIPLIER,
-                "pChildrenKernelMode" : proc.cpu_times()[3]* CORRECTION_MULTIPLIER,
-                #"pPGFault" : int(pidProcStat[9]),
-                #"pMajorPGFault" : int(pidProcStat[11]),
-                "pVoluntaryContextSwitches" : proc.num_ctx_switches()[0],        
-                "pInvoluntaryContextSwitches" : proc.num_ctx_switches()[1],        
-                "pBlockIODelays" : proc.cpu_times()[4]* CORRECTION_MULTIPLIER,
-                "pVirtualMemoryBytes" : proc.memory_info()[1]
-                #"pResidentSetSize" : proc.memory_info()[0]             
-            }
-            dictlist.append(curr_dict)
-        except:
-            pass
+    for proc in procfs.read_processes(get_process_ids()):
+        curr_dict={
+            "pId" : proc["pid"],
+            "pStartTime" : proc["start_time"],
+            "pCmdline" : proc["cmdline"],
+            "pName" : proc["name"],
+            "pNumThreads" : proc["num_threads"],
+            "pCpuTimeUserMode" : proc["utime"] / procfs.CLOCK_TICKS * CORRECTION_MULTIPLIER,
+            "pCpuTimeKernelMode" : proc["stime"] / procfs.CLOCK_TICKS * CORRECTION_MULTIPLIER,
+            "pChildrenUserMode" : proc["cutime"] / procfs.CLOCK_TICKS * CORRECTION_MULTIPLIER,
+            "pChildrenKernelMode" : proc["cstime"] / procfs.CLOCK_TICKS * CORRECTION_MULTIPLIER,
+            "pPGFault" : proc["minflt"],
+            "pMajorPGFault" : proc["majflt"],
+            "pVoluntaryContextSwitches" : proc["voluntary_ctxt_switches"],
+            "pInvoluntaryContextSwitches" : proc["nonvoluntary_ctxt_switches"],
+            "pBlockIODelays" : proc["blkio_ticks"] / procfs.CLOCK_TICKS * CORRECTION_MULTIPLIER,
+            "pVirtualMemoryBytes" : proc["vsize"],
+            "pResidentSetSize" : proc["rss"]
+        }
+        dictlist.append(curr_dict)
     return dictlist
 
-def profile_command():
+def getBreakdownInfo():
+    return breakdown.collect(args.breakdown, BLOCK_DEVICES)
+
+def run_collector(collect, barrier=None):
+    """run_collector(collect, [barrier])
+
+    The method runs the collector of one level and returns its metrics,
+    the monotonic time it started at in nanoseconds, and its wall and CPU
+    time in seconds. The collectors sharing a barrier start together
+    """
+    if barrier is not None:
+        barrier.wait()
+    start = time.monotonic_ns()
+    cpu_start = time.thread_time()
+    info = collect()
+    write_time = (time.monotonic_ns() - start) / scheduler.NANOSECONDS
+    return info, start, write_time, time.thread_time() - cpu_start
+
+def profile_command(jitter=0, missed=0, interval=0):
     """
     Author: Varik Hoang
-    The method executes the command and return the profiling time in milliseconds
+    The method executes the command and return the profiling time in seconds,
+    the jitter, missed deadlines and interval (nanoseconds) of the time
+    series are recorded as well
     """
-    profiling_time=get_tick_in_ms()
-    output_dict["currentTime"] = int(time.time() * 10**9)
+    profiling_time=get_time_in_seconds()
+    output_dict["currentTime"] = time.time_ns()
+    # integer nanoseconds from the scheduler, bc cannot parse the exponent form of small floats
+    output_dict["Sample_Jitter"] = jitter
+    output_dict["Missed_Deadlines"] = missed
+    output_dict["Sample_Interval"] = interval
 
     # seconds_since_epoch = round(datetime.now().timestamp())
     # output_dict["currentTime"] = seconds_since_epoch        #bad value.
@@ -411,52 +441,170 @@ def profile_command():
     if not os.path.exists(static_metrics_file):
         with open(static_metrics_file, 'w') as outfile: 
             json.dump(get_static_info(), outfile, indent=4)
+    collectors = []
     if args.vm_profiling == True:
-        time_start_VM=datetime.now()
-        vm_info=getVmInfo()
-        time_end_VM=datetime.now()
-        VM_write_time=time_end_VM-time_start_VM
-        output_dict.update(vm_info)
-        output_dict["VM_Write_Time"] = VM_write_time.total_seconds()
+        collectors.append(("VM", getVmInfo))
     if args.container_profiling == True:
-        time_start_container=datetime.now()
-        container_info=getContainerInfo()
-        time_end_container=datetime.now()
-        container_write_time=time_end_container-time_start_container
-        output_dict.update(container_info)
-        output_dict["Container_Write_Time"] = container_write_time.total_seconds()
+        collectors.append(("Container", getContainerInfo))
     if args.processor_profiling == True:
-        time_start_proc=datetime.now()
-        procces_info=getProcInfo()
-        time_end_proc=datetime.now()
-        process_write_time=time_end_proc-time_start_proc
-        output_dict["pProcesses"] = procces_info
-        output_dict["Process_Write_Time"] = process_write_time.total_seconds()
+        collectors.append(("Process", getProcInfo))
+    if args.breakdown:
+        collectors.append(("Breakdown", getBreakdownInfo))
+    if COLLECTOR_POOL is not None and len(collectors) > 1:
+        barrier = threading.Barrier(len(collectors))
+        futures = [COLLECTOR_POOL.submit(run_collector, collect, barrier) for _level, collect in collectors]
+        results = [future.result() for future in futures]
+    else:
+        results = [run_collector(collect) for _level, collect in collectors]
+
+    starts = []
+    for (level, _collect), (info, start, write_time, cpu_time) in zip(collectors, results):
+        if level == "Process":
+            output_dict["pProcesses"] = info
+            LEVEL_KEYS[level] = ["pProcesses"]
+        else:
+            output_dict.update(info)
+            LEVEL_KEYS[level] = list(info)
+        output_dict[level + "_Write_Time"] = write_time
+        output_dict[level + "_Cpu_Time"] = cpu_time
+        starts.append(start)
+    # how far apart the levels of the sample were read, in nanoseconds
+    output_dict["Sample_Skew"] = max(starts) - min(starts) if starts else 0
+    if SNAPSHOT_RECORDER is not None:
+        # the sampler's own counters are not part of the snapshot
+        SNAPSHOT_RECORDER.save(procfs.stop_recording())
+    output_dict.update(overhead.read_self_usage())
+    if SNAPSHOT_RECORDER is not None:
+        procfs.start_recording()
+    if OVERHEAD_BUDGET is not None:
+        output_dict[overhead.DECISIONS_KEY] = OVERHEAD_BUDGET.decisions
     
-    # capture the profiling time in milliseconds
-    profiling_time = get_tick_in_ms()-profiling_time
+    # capture the profiling time in seconds
+    profiling_time = get_time_in_seconds()-profiling_time
     output_dict['profiling_time'] = profiling_time
     
     # write to output file
-    filename = datetime.now().strftime(output_dir+"/%Y_%m_%d_%H_%M_%S.json")
-    with open(filename, 'w') as outfile: 
-        json.dump(output_dict, outfile, indent=4)
+    SAMPLE_RECORDER.write(output_dict)
+    if METRICS_RING is not None:
+        METRICS_RING.record(output_dict)
 
     return profiling_time
 
+def enforce_budget(series, adaptive=None):
+    """enforce_budget(series, [adaptive])
+
+    The method checks the overhead budget after a sample and applies and
+    logs its decision: a dropped level is not collected anymore, a wider
+    interval becomes the shortest one of the adaptive interval as well
+    """
+    if OVERHEAD_BUDGET is None:
+        return
+    levels = [level for level, option in LEVEL_OPTIONS if getattr(args, option)]
+    interval = series.interval_ns / 10**6 if series is not None else 0
+    decision = OVERHEAD_BUDGET.update(output_dict, levels, interval)
+    if decision is None:
+        return
+    if decision["action"] == overhead.DROP_LEVEL:
+        level = decision["level"]
+        setattr(args, dict(LEVEL_OPTIONS)[level], False)
+        # the next samples do not carry the last values of the level
+        for key in LEVEL_KEYS.pop(level, []) + [level + "_Write_Time", level + "_Cpu_Time"]:
+            output_dict.pop(key, None)
+    else:
+        if adaptive is not None:
+            adaptive.min_interval = decision["interval"]
+            adaptive.max_interval = max(adaptive.max_interval, adaptive.min_interval)
+            adaptive.interval = adaptive.clamp(adaptive.interval)
+        series.set_interval(decision["interval"])
+    overhead.log_decision(output_dir, decision)
+
 print_console=print
-profile_time = profile_command()
-if time_series > profile_time:
-    time.sleep((time_series-profile_time)/1000)
-print_console=print_nothing
-# keep the process running until it finishes
-while is_process_running():
-    profile_time = profile_command()
-    if time_series > profile_time:
-        time.sleep((time_series-profile_time)/1000)
-profile_command()
+if args.container_profiling == True:
+    print_console("cgroup {} detected".format(CGROUP_BACKEND.version))
+# terminate through the finally blocks so the buffered samples are written
+signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit(0))
+SNAPSHOT_RECORDER=replay.SnapshotRecorder(args.record) if args.record is not None else None
+SAMPLE_RECORDER=samplelog.create_recorder(output_dir, args.output_format, args.flush_interval, args.persist, args.aggregate_config, args.keyframe_interval, args.ring_size)
+# one thread per level, created once for the whole run
+COLLECTOR_POOL=ThreadPoolExecutor(max_workers=4) if args.concurrent else None
+LEVEL_OPTIONS=[("VM", "vm_profiling"), ("Container", "container_profiling"), ("Process", "processor_profiling"), ("Breakdown", "breakdown")]
+# the keys of the last sample of every level, removed from the samples when the level is dropped
+LEVEL_KEYS={}
+OVERHEAD_BUDGET=overhead.OverheadBudget(args.overhead_budget) if args.overhead_budget is not None else None
+METRICS_RING=None
+METRICS_SERVER=None
+if args.metrics_listen is not None:
+    METRICS_RING=openmetrics.MetricsRing(args.metrics_history)
+    METRICS_SERVER=openmetrics.MetricsServer(args.metrics_listen, METRICS_RING)
+    print_console("metrics served on {}".format(args.metrics_listen))
+if args.replay is not None:
+    # the trees are sampled back to back, the collectors run as fast as they can
+    replay_summary = replay.ReplaySummary()
+    try:
+        for tree in itertools.islice(itertools.cycle(REPLAY_TREES), args.replay_count or len(REPLAY_TREES)):
+            if tree != procfs.ROOT_DIR:
+                use_root(tree)
+            profile_command()
+            replay_summary.add(output_dict)
+            print_console=print_nothing
+    finally:
+        SAMPLE_RECORDER.close()
+        procfs.close_files()
+        if METRICS_SERVER is not None:
+            METRICS_SERVER.close()
+        if COLLECTOR_POOL is not None:
+            COLLECTOR_POOL.shutdown()
+    print(json.dumps(replay_summary.summary()))
+    exit()
+
+if args.daemon is not None:
+    # the daemon takes its first sample before serving the control socket
+    sampler = daemon.SamplerDaemon(args.daemon, profile_command, time_series, args.overrun,
+                                   (lambda: SAMPLE_RECORDER.dump(output_dir)) if args.ring_size > 0 else None,
+                                   enforce_budget if OVERHEAD_BUDGET is not None else None)
+    print_console("sampler daemon {} listening on {}".format(os.getpid(), args.daemon))
+    print_console=print_nothing
+    try:
+        sampler.serve()
+    finally:
+        SAMPLE_RECORDER.close()
+        procfs.close_files()
+        if METRICS_SERVER is not None:
+            METRICS_SERVER.close()
+        if COLLECTOR_POOL is not None:
+            COLLECTOR_POOL.shutdown()
+    exit()
+
+# dump the last samples without stopping the time series
+if args.ring_size > 0:
+    signal.signal(signal.SIGQUIT, lambda _signum, _frame: print("dumped the last samples to {}".format(SAMPLE_RECORDER.dump(output_dir)), flush=True))
+
+# the samples fire on absolute deadlines of the monotonic clock
+series = scheduler.Scheduler(time_series, args.overrun)
+adaptive = None
+if args.adaptive and time_series > 0:
+    adaptive = scheduler.AdaptiveInterval(time_series, args.min_interval, args.max_interval)
+    series.set_interval(adaptive.interval)
+try:
+    profile_command(*series.wait(), series.last_interval_ns)
+    print_console("startup-to-first-sample latency: {} seconds".format(daemon.get_startup_latency()))
+    print_console=print_nothing
+    # keep the process running until it finishes
+    while is_process_running():
+        if adaptive is not None:
+            series.set_interval(adaptive.update(output_dict))
+        enforce_budget(series, adaptive)
+        profile_command(*series.wait(), series.last_interval_ns)
+    profile_command()
+finally:
+    SAMPLE_RECORDER.close()
+    if METRICS_SERVER is not None:
+        METRICS_SERVER.close()
+    if COLLECTOR_POOL is not None:
+        COLLECTOR_POOL.shutdown()
 
 if time_series != 0:
+	print(json.dumps(series.summary()))
 	try:
 		os.remove("./profile.pid")
 	except:
@@ -0,0 +1,366 @@
+# --------------------------------------------------------------------------
+# The module writes the profiling samples. The json format keeps the
+# original layout of one indented JSON file per sample named after the
+# second it was taken. The ndjson format appends compact JSON lines to a
+# single file per run through a buffered writer, each record carries a
+# sequence number and nanosecond timestamps so samples taken within the
+# same second are all kept. The binary format writes the same records to a
+# binlog.py run, a schema once and fixed-width numeric records, and starts
+# a new numbered file of the run when a sample no longer fits its schema.
+#
+# The sampler can also compute the aggregate.cfg deltas itself, from the
+# previous sample kept in memory, and persist the deltas only, raw
+# keyframes every n-th sample, or both. The last samples are kept in a
+# fixed-size ring that is dumped to an ndjson file on demand.
+#
+# Usage: python3 samplelog.py export RUN_FILE OUTPUT_DIR
+#        (converts an ndjson or binary run back to the one-file-per-sample
+#        layout)
+#        python3 samplelog.py convert RUN_FILE.ndjson RUN_FILE.bin
+#        python3 samplelog.py convert RUN_FILE.bin RUN_FILE.ndjson
+#        (converts a run between the ndjson and binary formats)
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import collections
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+import aggregate
+import binlog
+
+JSON='json'
+NDJSON='ndjson'
+BINARY='binary'
+OUTPUT_FORMATS=[JSON, NDJSON, BINARY]
+
+# the keys only the ndjson records carry
+SEQUENCE_KEY="sequence"
+TIMESTAMP_KEY="timestamp_ns"
+MONOTONIC_KEY="monotonic_ns"
+RECORD_KEYS=[SEQUENCE_KEY, TIMESTAMP_KEY, MONOTONIC_KEY]
+
+# what the sampler persists
+RAW='raw'
+DELTA='delta'
+BOTH='both'
+PERSIST_MODES=[RAW, DELTA, BOTH]
+
+DELTA_PREFIX="delta_"
+RING_PREFIX="ring_"
+
+BUFFER_SIZE=1024*1024
+# the json files are named after the second, a shorter interval overwrites samples
+JSON_FILE_INTERVAL=1000
+
+class JsonFileWriter:
+    """JsonFileWriter(output_dir)
+
+    The class writes every sample to its own %Y_%m_%d_%H_%M_%S.json file,
+    a sample taken within the second of the previous one overwrites it
+    and is counted as lost
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.filename = None
+        self.lost = 0
+
+    def write(self, sample):
+        filename = datetime.now().strftime(self.output_dir+"/%Y_%m_%d_%H_%M_%S.json")
+        if filename == self.filename:
+            if self.lost == 0:
+                print("several samples within one second overwrite {}, use the ndjson output format to keep them".format(filename), file=sys.stderr)
+            self.lost += 1
+        self.filename = filename
+        with open(filename, 'w') as outfile:
+            json.dump(sample, outfile, indent=4)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.lost > 0:
+            print("{} samples were overwritten by a later sample of the same second".format(self.lost), file=sys.stderr)
+
+class NdjsonWriter:
+    """NdjsonWriter(output_dir, [flush_interval])
+
+    The class appends one compact JSON line per sample to a single file of
+    the run, the buffer is flushed every flush_interval seconds by a
+    background thread and when the writer is closed. The subclasses only
+    change how the file is opened and how a record is written to it
+    """
+
+    EXTENSION=".ndjson"
+
+    def __init__(self, output_dir, flush_interval=1.0, prefix=""):
+        self.base_path = datetime.now().strftime(output_dir+"/"+prefix+"%Y_%m_%d_%H_%M_%S")
+        self.path = self.base_path + self.EXTENSION
+        self.file = self.open_file(self.path)
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.flusher = None
+        if flush_interval > 0:
+            self.flusher = threading.Thread(target=self.flush_periodically, args=(flush_interval,), daemon=True)
+            self.flusher.start()
+
+    def open_file(self, path):
+        return open(path, 'a', buffering=BUFFER_SIZE)
+
+    def write(self, sample):
+        record = {
+            SEQUENCE_KEY: self.sequence,
+            TIMESTAMP_KEY: time.time_ns(),
+            MONOTONIC_KEY: time.monotonic_ns(),
+        }
+        record.update(sample)
+        with self.lock:
+            self.write_record(record)
+        self.sequence += 1
+
+    def write_record(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + "\n")
+
+    def write_line(self, line):
+        with self.lock:
+            self.file.write(line)
+        self.sequence += 1
+
+    def flush(self):
+        with self.lock:
+            if not self.closed.is_set():
+                self.file.flush()
+
+    def flush_periodically(self, flush_interval):
+        while not self.closed.wait(flush_interval):
+            self.flush()
+
+    def close(self):
+        self.closed.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        with self.lock:
+            self.file.close()
+
+class BinaryWriter(NdjsonWriter):
+    """BinaryWriter(output_dir, [flush_interval])
+
+    The class writes the records of the ndjson format to a binary run,
+    a sample not fitting the schema of the current file closes it and
+    starts <run>_1.bin, <run>_2.bin, ... with the schema of that sample
+    """
+
+    EXTENSION=binlog.EXTENSION
+
+    def __init__(self, output_dir, flush_interval=1.0):
+        self.files = 1
+        NdjsonWriter.__init__(self, output_dir, flush_interval)
+
+    def open_file(self, path):
+        return binlog.RunWriter(path)
+
+    def write_record(self, record):
+        try:
+            self.file.write(record)
+        except binlog.SchemaMismatch:
+            self.file.close()
+            self.path = "{}_{}{}".format(self.base_path, self.files, self.EXTENSION)
+            self.file = self.open_file(self.path)
+            self.files += 1
+            self.file.write(record)
+
+class DeltaWriter(NdjsonWriter):
+    """DeltaWriter(output_dir, config_lines, [flush_interval])
+
+    The class keeps the previous sample and appends the delta of every
+    new sample with it to delta_<run>.ndjson, the same lines the delta
+    tool writes for an ndjson run file
+    """
+
+    def __init__(self, output_dir, config_lines, flush_interval=1.0):
+        NdjsonWriter.__init__(self, output_dir, flush_interval, DELTA_PREFIX)
+        self.config_lines = config_lines
+        self.previous = None
+
+    def write(self, sample):
+        # a copy the way the delta tool reads it, the process list is not aggregated,
+        # walked directly rather than through a JSON string on the sampling path
+        record = aggregate.replace_dollar(dict((key, value) for key, value in sample.items() if not isinstance(value, list)))
+        if self.previous is not None:
+            self.write_line(aggregate.aggregate_records([self.previous, record], self.config_lines)[0] + "\n")
+        self.previous = record
+
+class SampleRing:
+    """SampleRing(size)
+
+    The class keeps the compact JSON lines of the last size samples
+    """
+
+    def __init__(self, size):
+        self.lines = collections.deque(maxlen=size)
+
+    def write(self, sample):
+        self.lines.append(json.dumps(sample, separators=(',', ':')) + "\n")
+
+    def dump(self, output_dir):
+        """dump(output_dir)
+
+        The method writes the samples of the ring, oldest first, to
+        ring_<time>.ndjson and returns the file path
+        """
+        path = datetime.now().strftime(output_dir+"/"+RING_PREFIX+"%Y_%m_%d_%H_%M_%S.ndjson")
+        lines = list(self.lines)
+        with open(path, 'w', buffering=BUFFER_SIZE) as outfile:
+            outfile.writelines(lines)
+        return path
+
+class SampleRecorder:
+    """SampleRecorder(writer, [delta_writer], [keyframe_interval], [ring])
+
+    The class routes every sample: the raw writer gets every
+    keyframe_interval-th sample starting with the first, the delta writer
+    and the ring get them all. Without a raw writer only deltas are kept
+    """
+
+    def __init__(self, writer, delta_writer=None, keyframe_interval=1, ring=None):
+        self.writer = writer
+        self.delta_writer = delta_writer
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.ring = ring
+        self.count = 0
+
+    def write(self, sample):
+        if self.writer is not None and self.count % self.keyframe_interval == 0:
+            self.writer.write(sample)
+        if self.delta_writer is not None:
+            self.delta_writer.write(sample)
+        if self.ring is not None:
+            self.ring.write(sample)
+        self.count += 1
+
+    def dump(self, output_dir):
+        if self.ring is None:
+            raise ValueError("the sample ring is disabled")
+        return self.ring.dump(output_dir)
+
+    def close(self):
+        for writer in [self.writer, self.delta_writer]:
+            if writer is not None:
+                writer.close()
+
+def create_recorder(output_dir, output_format=JSON, flush_interval=1.0, persist=RAW, config_path=aggregate.AGGREGATE_CONFIG, keyframe_interval=1, ring_size=0):
+    """create_recorder(output_dir, [output_format], [flush_interval], [persist], ...)
+
+    The method returns the sample recorder of the persist mode
+    """
+    writer = None
+    delta_writer = None
+    if persist != DELTA:
+        writer = create_writer(output_dir, output_format, flush_interval)
+    if persist != RAW:
+        delta_writer = DeltaWriter(output_dir, aggregate.read_config(config_path), flush_interval)
+    ring = SampleRing(ring_size) if ring_size > 0 else None
+    return SampleRecorder(writer, delta_writer, keyframe_interval, ring)
+
+def default_format(time_series, min_interval=None):
+    """default_format(time_series, [min_interval])
+
+    The method returns the output format of a run that does not name one:
+    json, unless the time series (or its shortest adaptive interval) is
+    below a second, which the json files cannot tell apart, then ndjson
+    """
+    interval = time_series if min_interval is None else min(time_series, min_interval)
+    if 0 < time_series and interval < JSON_FILE_INTERVAL:
+        return NDJSON
+    return JSON
+
+def create_writer(output_dir, output_format=JSON, flush_interval=1.0):
+    """create_writer(output_dir, [output_format], [flush_interval])
+
+    The method returns the sample writer of the output format
+    """
+    if output_format == NDJSON:
+        return NdjsonWriter(output_dir, flush_interval)
+    if output_format == BINARY:
+        return BinaryWriter(output_dir, flush_interval)
+    return JsonFileWriter(output_dir)
+
+def read_records(path):
+    """read_records(path)
+
+    The method yields the records of an ndjson or binary run file, a
+    truncated last line or record left by an interrupted run is skipped
+    """
+    if path.endswith(binlog.EXTENSION):
+        yield from binlog.RunReader(path).records()
+        return
+    with open(path, 'r') as infile:
+        for line in infile:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                pass
+
+def export_records(path, output_dir):
+    """export_records(path, output_dir)
+
+    The method converts an ndjson or binary run file to the one-file-per-sample
+    layout read by the delta tool, the files are named after the second
+    of the record timestamp and, as with the json format, the last record
+    of a second wins. It returns the number of files and of records
+    """
+    static_file = os.path.join(os.path.dirname(os.path.abspath(path)), "static.json")
+    if os.path.isfile(static_file) and not os.path.samefile(os.path.dirname(static_file), output_dir):
+        shutil.copy(static_file, output_dir)
+
+    files = set()
+    records = 0
+    for record in read_records(path):
+        timestamp = record.get(TIMESTAMP_KEY, record.get("currentTime", 0))
+        for key in RECORD_KEYS:
+            record.pop(key, None)
+        filename = datetime.fromtimestamp(timestamp / 10**9).strftime(output_dir+"/%Y_%m_%d_%H_%M_%S.json")
+        with open(filename, 'w') as outfile:
+            json.dump(record, outfile, indent=4)
+        files.add(filename)
+        records += 1
+    return len(files), records
+
+def convert_run(path, output_path):
+    """convert_run(path, output_path)
+
+    The method converts an ndjson run file to a binary one, or a binary
+    run file to an ndjson one, after the extension of the output path.
+    It returns the paths written
+    """
+    if output_path.endswith(binlog.EXTENSION):
+        return binlog.convert_records(read_records(path), output_path)
+    with open(output_path, 'w', buffering=BUFFER_SIZE) as outfile:
+        for record in read_records(path):
+            outfile.write(json.dumps(record, separators=(',', ':')) + "\n")
+    return [output_path]
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == "convert":
+        paths = convert_run(sys.argv[2], sys.argv[3])
+        print("converted {} to {}".format(sys.argv[2], ", ".join(paths)))
+        sys.exit(0)
+    if len(sys.argv) != 4 or sys.argv[1] != "export":
+        print("Usage: {} export RUN_FILE OUTPUT_DIR".format(sys.argv[0]))
+        print("       {} convert RUN_FILE.ndjson RUN_FILE.bin".format(sys.argv[0]))
+        print("       {} convert RUN_FILE.bin RUN_FILE.ndjson".format(sys.argv[0]))
+        sys.exit(1)
+    if not os.path.isdir(sys.argv[3]):
+        os.makedirs(sys.argv[3])
+    files, records = export_records(sys.argv[2], sys.argv[3])
+    print("exported {} records to {} files in {}".format(records, files, sys.argv[3]))
+    if files < records:
+        print("{} records shared the second of a later record and were overwritten".format(records - files))
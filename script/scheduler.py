@@ -0,0 +1,199 @@
+# --------------------------------------------------------------------------
+# The module schedules time series samples on absolute deadlines of a
+# monotonic clock, so the sampling cadence neither drifts with the time
+# spent collecting nor jumps when the wall clock is adjusted.
+#
+# In adaptive mode the interval follows the samples: it is halved when
+# the rate of a watched metric moves away from its recent mean, and it
+# grows again while all the rates stay flat, within fixed bounds.
+#
+# (C) 2021 Washington of University
+# email wlloyd@uw.edu
+# --------------------------------------------------------------------------
+
+import time
+
+# what to do when a sample overruns one or more deadlines
+STRICT='strict'     # fire every missed deadline back to back, late
+SKIP='skip'         # drop the missed deadlines and keep the original grid
+COALESCE='coalesce' # take one sample now and restart the grid from it
+OVERRUN_POLICIES=[STRICT, SKIP, COALESCE]
+
+NANOSECONDS=10**9
+
+# the rates watched by the adaptive interval, the container level first
+ADAPTIVE_METRICS=[
+    "cCpuTime", "cMemoryUsed", "cDiskReadBytes", "cDiskWriteBytes", "cNetworkBytesRecvd", "cNetworkBytesSent",
+    "vCpuTime", "vMemoryFree", "vDiskSectorReads", "vDiskSectorWrites", "vNetworkBytesRecvd", "vNetworkBytesSent",
+]
+MIN_INTERVAL=10     # milliseconds
+MAX_INTERVAL=1000   # milliseconds
+TIGHTEN_SCORE=4.0   # deviation of a rate from its running mean, in standard deviations, that halves the interval
+RELAX_SCORE=2.0     # the interval grows while every rate deviates less
+TIGHTEN_FACTOR=0.5
+RELAX_FACTOR=1.25
+SMOOTHING=0.2       # weight of the newest rate in the running means
+
+class Scheduler:
+    """Scheduler(interval, [policy])
+
+    The class fires samples every interval milliseconds. wait() sleeps
+    until the next deadline and returns the jitter (nanoseconds between
+    the deadline and the actual start) and the number of deadlines that
+    passed since the previous sample, each deadline counted once
+    """
+
+    def __init__(self, interval, policy=STRICT, clock=time.monotonic_ns, sleep=time.sleep):
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError("unknown overrun policy '{}'".format(policy))
+        self.interval_ns = int(interval * 10**6)
+        self.policy = policy
+        self.clock = clock
+        self.sleep = sleep
+        self.next_deadline = None
+        # the latest deadline already counted as missed
+        self.missed_deadline = None
+        self.last_interval_ns = 0
+        self.samples = 0
+        self.missed = 0
+        self.jitter_sum = 0
+        self.jitter_max = 0
+
+    def set_interval(self, interval):
+        """set_interval(interval)
+
+        The method changes the interval (milliseconds), the deadline of the
+        next sample moves with it
+        """
+        interval_ns = int(interval * 10**6)
+        if self.next_deadline is not None and self.samples > 0:
+            self.next_deadline += interval_ns - self.interval_ns
+        self.interval_ns = interval_ns
+
+    def remaining(self):
+        """remaining()
+
+        The method returns the seconds left until the next deadline, zero
+        or negative when the next sample is due
+        """
+        if self.next_deadline is None:
+            return 0
+        return (self.next_deadline - self.clock()) / NANOSECONDS
+
+    def wait(self):
+        """wait()
+
+        The method blocks until the next deadline and returns the pair
+        (jitter in nanoseconds, missed deadlines) for the sample about to
+        start. The strict policy fires the missed deadlines late, one after
+        the other, a deadline counted by the first of them is not counted
+        again by the next ones
+        """
+        now = self.clock()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        missed = 0
+        if self.interval_ns > 0 and now >= self.next_deadline + self.interval_ns:
+            # the previous sample overran the deadline of this one
+            overdue = (now - self.next_deadline) // self.interval_ns
+            latest_deadline = self.next_deadline + overdue * self.interval_ns
+            counted_deadline = self.next_deadline
+            if self.missed_deadline is not None:
+                counted_deadline = max(counted_deadline, self.missed_deadline)
+            missed = max(0, (latest_deadline - counted_deadline) // self.interval_ns)
+            self.missed_deadline = latest_deadline
+            if self.policy == SKIP:
+                self.next_deadline += (overdue + 1) * self.interval_ns
+            elif self.policy == COALESCE:
+                self.next_deadline = now
+        remaining = self.next_deadline - now
+        if remaining > 0:
+            self.sleep(remaining / NANOSECONDS)
+        jitter = max(0, self.clock() - self.next_deadline)
+
+        # the interval that led to this sample, none for the first one
+        self.last_interval_ns = self.interval_ns if self.samples > 0 else 0
+        self.next_deadline += self.interval_ns
+        self.samples += 1
+        self.missed += missed
+        self.jitter_sum += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        return jitter, missed
+
+    def summary(self):
+        """summary()
+
+        The method returns the jitter and missed deadline statistics of
+        the samples scheduled so far
+        """
+        return {
+            "samples": self.samples,
+            "missed_deadlines": self.missed,
+            "mean_jitter": self.jitter_sum / self.samples / NANOSECONDS if self.samples else 0,
+            "max_jitter": self.jitter_max / NANOSECONDS,
+        }
+
+class AdaptiveInterval:
+    """AdaptiveInterval(interval, [min_interval], [max_interval], [metrics])
+
+    The class adapts the time series interval (milliseconds) to the rates
+    of the metrics. update() takes every new sample and returns the
+    interval until the next one
+    """
+
+    def __init__(self, interval, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, metrics=ADAPTIVE_METRICS):
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("the adaptive interval bounds must be positive and ordered")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.metrics = metrics
+        self.interval = self.clamp(interval)
+        self.previous = None
+        self.means = {}
+
+    def clamp(self, interval):
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def get_score(self, time_ns, values):
+        """get_score(time_ns, values)
+
+        The method returns the largest deviation of a rate from its running
+        mean in running standard deviations, and updates the running mean
+        and variance of every rate. A rate leaving a flat zero-variance
+        level deviates infinitely
+        """
+        score = 0
+        previous_time, previous_values = self.previous
+        if time_ns is None or previous_time is None or time_ns <= previous_time:
+            return score
+        elapsed = (time_ns - previous_time) / NANOSECONDS
+        for metric, value in values.items():
+            if metric not in previous_values:
+                continue
+            rate = (value - previous_values[metric]) / elapsed
+            if metric not in self.means:
+                self.means[metric] = (rate, 0.0)
+                continue
+            mean, variance = self.means[metric]
+            deviation = rate - mean
+            if deviation != 0:
+                score = max(score, abs(deviation) / variance**0.5 if variance > 0 else float("inf"))
+            # exponentially weighted mean and variance
+            self.means[metric] = (mean + SMOOTHING * deviation, (1 - SMOOTHING) * (variance + SMOOTHING * deviation**2))
+        return score
+
+    def update(self, sample):
+        time_ns = sample.get("currentTime")
+        values = {}
+        for metric in self.metrics:
+            value = sample.get(metric)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                values[metric] = value
+        if self.previous is not None:
+            score = self.get_score(time_ns, values)
+            if score > TIGHTEN_SCORE:
+                self.interval = self.clamp(self.interval * TIGHTEN_FACTOR)
+            elif score < RELAX_SCORE:
+                self.interval = self.clamp(self.interval * RELAX_FACTOR)
+        self.previous = (time_ns, values)
+        return self.interval